@@ -2,10 +2,23 @@ import streamlit as st
 import pandas as pd
 import requests
 import json
-import os
 import random
+import time
+import threading
 from datetime import datetime, date # date型もインポート
 
+# 保存先に依存しない共通の処理
+from vocab_core import (
+    VOCAB_HEADERS, TEST_RESULTS_HEADERS, batched_quiz, flashcards, FLASHCARD_WINDOW_SIZE, FLASHCARD_PREFETCH_MARGIN,
+    get_data_version, bump_data_version, compact_vocab_frame, compact_test_results_frame, details_to_list,
+    decode_details_column, with_plain_categories, render_memory_report, filter_values, filter_count,
+    filter_positions, filter_frame, prepare_search_columns, complete_terms, render_term_input, search_positions,
+    format_filter_cache_stats, export_data_source, build_csv_export, ARROW_IMPORT_EXTENSIONS, VOCAB_ARROW_CHECKS,
+    TEST_RESULTS_ARROW_CHECKS, build_vocab_parquet_export, build_vocab_arrow_export,
+    build_test_results_parquet_export, build_test_results_arrow_export, read_arrow_import, render_paginated_table,
+    TEST_RESULTS_PAGE_SIZE
+)
+
 # --- 設定項目 ---
 # GAS_WEBAPP_URL と GAS_API_KEY は Streamlit Secrets を推奨しますが、
 # ここでは直接記述された値を保持します。
@@ -13,9 +26,6 @@ from datetime import datetime, date # date型もインポート
 GAS_WEBAPP_URL = "https://script.google.com/macros/s/AKfycbzIHJdzrPWRgu3uyOb2A1rHQTvpxzU6sLKBm5Ybwt--ozxLFe0_i7nr071RjwjgdkaxGA/exec"
 GAS_API_KEY = "my_streamlit_secret_key_123"
 
-# ヘッダー定義
-VOCAB_HEADERS = ['ID', '用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)', '学習進捗 (Progress)']
-TEST_RESULTS_HEADERS = ['Date', 'Category', 'TestType', 'Score', 'TotalQuestions', 'Details']
 
 # --- Streamlit アプリケーションの開始 ---
 st.set_page_config(layout="wide")
@@ -33,7 +43,7 @@ def json_serial_for_gas(obj):
     # 他のシリアライズできない型が誤って混入した場合のために例外を発生させる
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
-@st.cache_data(ttl=60)
+# キャッシュはセッション間で共有するスナップショットストア (load_shared_snapshot) で行う
 def load_data_from_gas(sheet_name):
     try:
         params = {'api_key': GAS_API_KEY, 'sheet': sheet_name, 'action': 'read_data'}
@@ -90,6 +100,7 @@ def load_data_from_gas(sheet_name):
             df = df.dropna(subset=['用語 (Term)', '説明 (Definition)'], how='all') # 用語と説明が両方NaNの行は削除
             df = df.drop_duplicates(subset=['用語 (Term)', '説明 (Definition)'], keep='first') # 重複行の削除
             df = df.sort_values(by='ID').reset_index(drop=True)
+            compact_vocab_frame(df)
             
         else: # テスト結果シートの場合
             for col in TEST_RESULTS_HEADERS:
@@ -118,6 +129,11 @@ def load_data_from_gas(sheet_name):
                 df['Details'] = [[] for _ in range(len(df))] # Detailsカラムがない場合は空のリストで初期化
 
 
+            compact_test_results_frame(df)
+
+        bump_data_version(df) # 読み込みごとに新しいデータバージョンを付与
+        if not sheet_name.startswith("Sheet_TestResults_"):
+            prepare_search_columns(df) # 検索用の正規化テキストは読み込み時に一度だけ作る
         return df
     except requests.exceptions.HTTPError as e:
         st.error(f"GAS Webアプリへの接続に失敗しました: {e}")
@@ -137,6 +153,8 @@ def load_data_from_gas(sheet_name):
 def write_data_to_gas(df, sheet_name):
     try:
         df_to_send = df.copy()
+        if 'Details' in df_to_send.columns: # 列指向で保持しているDetailsはPythonのリストに戻して送る
+            df_to_send['Details'] = decode_details_column(df_to_send['Details'])
 
         # PandasのInt64型をintに、NaNをNoneに変換
         for col in df_to_send.select_dtypes(include='Int64').columns:
@@ -147,17 +165,17 @@ def write_data_to_gas(df, sheet_name):
         for _, row in df_to_send.iterrows():
             processed_row = []
             for item in row.values:
-                if pd.isna(item): # PandasのNaNはNoneに変換
-                    processed_row.append(None)
-                elif isinstance(item, (datetime, pd.Timestamp, date)): # datetimeオブジェクトやTimestamp、dateをISO文字列に変換
-                    processed_row.append(item.isoformat())
-                elif isinstance(item, (list, dict)): # リストや辞書はJSON文字列にする
+                if isinstance(item, (list, dict)): # リストや辞書はJSON文字列にする (pd.isna に渡すと要素ごとの判定になるため先に処理)
                     try:
                         # json_serial_for_gas を default として使用し、内部のdatetimeも変換
                         processed_row.append(json.dumps(item, ensure_ascii=False, default=json_serial_for_gas))
                     except TypeError as e:
                         st.error(f"JSONシリアライズエラー: {e} - 問題のデータ: {item}")
                         processed_row.append(str(item)) # シリアライズできない場合は文字列として送信
+                elif pd.isna(item): # PandasのNaNはNoneに変換
+                    processed_row.append(None)
+                elif isinstance(item, (datetime, pd.Timestamp, date)): # datetimeオブジェクトやTimestamp、dateをISO文字列に変換
+                    processed_row.append(item.isoformat())
                 else:
                     processed_row.append(item)
             processed_data_rows.append(processed_row)
@@ -175,6 +193,8 @@ def write_data_to_gas(df, sheet_name):
             return False
         
         st.success(f"データがスプレッドシート '{sheet_name}' に保存されました！")
+        invalidate_shared_snapshot(sheet_name)
+        bump_data_version(df)
         st.cache_data.clear() # キャッシュをクリアして次回読み込み時に最新データを取得
         return True
     except requests.exceptions.RequestException as e:
@@ -188,6 +208,164 @@ def write_data_to_gas(df, sheet_name):
         st.error(f"データの書き込み中に予期せぬエラーが発生しました: {e}")
         return False
 
+# --- テスト結果の詳細表示 ---
+def render_test_result_details(details):
+    """テスト1件分の問題ごとの結果を表示する"""
+    # 'Details'カラムは既にPythonオブジェクト（リスト）としてロードされていることを想定
+    details = details_to_list(details)
+    if not details:
+        st.info("このテストには詳細な結果が記録されていません。")
+        return
+    for i, detail in enumerate(details):
+        is_correct_icon = "✅" if detail.get('is_correct') else "❌"
+        st.write(f"**問題 {i+1}** {is_correct_icon}")
+        st.write(f"　- 問題文: {detail.get('question_text', 'N/A')}")
+        st.write(f"　- 正解: {detail.get('correct_answer', 'N/A')}")
+        st.write(f"　- あなたの回答: {detail.get('user_answer', 'N/A')}")
+        st.write("---辞書情報---")
+        st.write(f"　- 用語: {detail.get('term_name', 'N/A')}")
+        st.write(f"　- 説明: {detail.get('term_definition', 'N/A')}")
+        example = detail.get('term_example') # 列指向のDetailsでは記録のない項目は None になる
+        if example is not None and example != 'N/A' and example != '':
+            st.write(f"　- 例文: {example}")
+        st.markdown("---")
+
+
+# --- シートのバージョン (GAS側で書き込みのたびに増やす番号) ---
+def fetch_sheet_version(sheet_name):
+    """
+    シートのバージョンを返す (GASの 'read_version' アクション。write_data のたびにスクリプトプロパティの番号を増やし、{'version': 番号} を返す)。
+    GASが read_version に対応していない場合や取得に失敗した場合は None
+    """
+    try:
+        params = {'api_key': GAS_API_KEY, 'sheet': sheet_name, 'action': 'read_version'}
+        response = requests.get(GAS_WEBAPP_URL, params=params)
+        response.raise_for_status()
+        result = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    return result.get('version') if isinstance(result, dict) else None
+
+
+# --- セッション間で共有する読み取り専用スナップショット ---
+VERSION_CHECK_INTERVAL_SECONDS = 10 # シートのバージョンを確認し直すまでの時間 (GASへの問い合わせは時間がかかるため長めにする)
+SNAPSHOT_TTL_SECONDS = 60 # バージョンを取得できないシートで、最新スナップショットを再取得せずに使い回す時間
+SNAPSHOT_VERSIONS_KEPT = 3 # シートごとに保持するバージョン数
+SNAPSHOT_IDLE_SECONDS = 1800 # この時間どのセッションからも使われなかったシートのスナップショットはメモリから破棄する
+SNAPSHOT_SHEETS_KEPT = 50 # スナップショットを保持するシート数の上限 (超えた分は使われたのが古いシートから破棄する)
+
+@st.cache_resource
+def get_snapshot_store():
+    """プロセス内の全セッションで共有する {(シート名, バージョン): DataFrame} のストア"""
+    return {'lock': threading.Lock(), 'snapshots': {}, 'latest': {}, 'loading': {}, 'untracked': set(), 'used_at': {}}
+
+def touch_snapshot(store, sheet_name):
+    """シートを使った時刻を記録し、しばらく使われていないシートのスナップショットを破棄する (store['lock'] を持った状態で呼ぶ)
+    used_at は使われた順に並べ直すので、破棄するシートは先頭から見ればよい"""
+    now = time.time()
+    store['used_at'].pop(sheet_name, None)
+    store['used_at'][sheet_name] = now
+    while store['used_at']:
+        oldest_sheet, used_at = next(iter(store['used_at'].items()))
+        if now - used_at <= SNAPSHOT_IDLE_SECONDS and len(store['used_at']) <= SNAPSHOT_SHEETS_KEPT:
+            break
+        del store['used_at'][oldest_sheet]
+        store['latest'].pop(oldest_sheet, None)
+        store['untracked'].discard(oldest_sheet)
+        for stale_ref in [key for key in store['snapshots'] if key[0] == oldest_sheet]:
+            del store['snapshots'][stale_ref]
+
+def publish_snapshot(sheet_name, df, sheet_version=None):
+    """DataFrameを共有スナップショットとして登録し、参照 (シート名, バージョン) を返す
+    登録したDataFrameは読み取り専用として扱い、変更する場合は必ずコピーしてから行う (コピーオンライト)"""
+    store = get_snapshot_store()
+    ref = (sheet_name, get_data_version(df))
+    with store['lock']:
+        store['snapshots'][ref] = df
+        store['latest'][sheet_name] = {'ref': ref, 'sheet_version': sheet_version, 'checked_at': time.time()}
+        sheet_refs = [key for key in store['snapshots'] if key[0] == sheet_name]
+        for stale_ref in sheet_refs[:-SNAPSHOT_VERSIONS_KEPT]:
+            del store['snapshots'][stale_ref]
+    return ref
+
+def unchecked_snapshot(store, sheet_name):
+    """バージョンを確認し直すまでの間は、最新スナップショットをそのまま返す (確認が必要なら None)"""
+    latest = store['latest'].get(sheet_name)
+    if latest is None or latest['ref'] not in store['snapshots']:
+        return None
+    interval = SNAPSHOT_TTL_SECONDS if sheet_name in store['untracked'] else VERSION_CHECK_INTERVAL_SECONDS
+    return store['snapshots'][latest['ref']] if time.time() - latest['checked_at'] < interval else None
+
+def load_shared_snapshot(sheet_name):
+    """最新スナップショットを返す (コピーしない)。シートのバージョンを確かめ、変わっていた場合だけGASから読み込み直す"""
+    store = get_snapshot_store()
+    with store['lock']:
+        touch_snapshot(store, sheet_name)
+        df = unchecked_snapshot(store, sheet_name)
+        if df is not None:
+            return df
+        sheet_lock = store['loading'].setdefault(sheet_name, threading.Lock())
+    # 同じシートの確認・読み込みは1つのセッションだけが行い、待っていたセッションはその結果を使う
+    with sheet_lock:
+        with store['lock']:
+            df = unchecked_snapshot(store, sheet_name)
+        if df is not None:
+            return df
+        sheet_version = fetch_sheet_version(sheet_name) # 読み込みより先に取得する (読み込み中に書き込まれても、次回の確認で読み込み直される)
+        with store['lock']:
+            if sheet_version is None: # バージョンを取得できないシートは従来どおり一定時間ごとに読み込み直す
+                store['untracked'].add(sheet_name)
+            else:
+                store['untracked'].discard(sheet_name)
+            latest = store['latest'].get(sheet_name)
+            if (sheet_version is not None and latest is not None and latest['sheet_version'] == sheet_version
+                    and latest['ref'] in store['snapshots']):
+                latest['checked_at'] = time.time() # 変わっていなければ同じスナップショットを使い続ける
+                return store['snapshots'][latest['ref']]
+        df = load_data_from_gas(sheet_name)
+        publish_snapshot(sheet_name, df, sheet_version)
+        return df
+
+def invalidate_shared_snapshot(sheet_name):
+    """次回の読み込みでGASから最新データを取得させる"""
+    store = get_snapshot_store()
+    with store['lock']:
+        store['latest'].pop(sheet_name, None)
+
+
+# --- 用語の編集・削除 ---
+EDIT_PICKER_LIMIT = 50 # 編集・削除する用語の選択肢に表示する件数
+
+
+# --- プロファイリング (絞り込み・検索キャッシュのヒット率) ---
+def render_profiling_panel():
+    with st.sidebar.expander("⏱ プロファイリング"):
+        st.write(format_filter_cache_stats())
+
+
+# --- テスト結果のCSVエクスポート (DetailsはシートのJSON文字列の形式に戻す) ---
+def test_results_export_chunk(chunk):
+    """ダウンロード用にDetailsをJSON文字列に、日時を文字列に戻す"""
+    return chunk.assign(
+        Details=decode_details_column(chunk['Details']).apply(
+            lambda x: json.dumps(x, ensure_ascii=False, default=json_serial_for_gas) if isinstance(x, list) else '[]'
+        ),
+        Date=chunk['Date'].dt.strftime("%Y-%m-%d %H:%M:%S"),
+    )
+
+def build_test_results_csv_export(df):
+    return build_csv_export(df, test_results_export_chunk)
+
+
+# --- テスト結果のParquet・Arrow IPC インポート (日時はシートに合わせてタイムゾーンなしにする) ---
+def read_test_results_import(uploaded_file):
+    """テスト結果のファイルを読み込み、TEST_RESULTS_HEADERS の列と読み込み時と同じ型に揃える (Detailsは辞書のリストに戻す)"""
+    df = read_arrow_import(uploaded_file, TEST_RESULTS_ARROW_CHECKS, required_cols=TEST_RESULTS_HEADERS)[TEST_RESULTS_HEADERS]
+    df['Date'] = pd.to_datetime(df['Date'], utc=True).dt.tz_convert(None) # シートの日時はタイムゾーンなしで扱う
+    df['Details'] = decode_details_column(df['Details'])
+    return df.dropna(subset=['Date'])
+
+
 # --- ユーザー名入力処理 ---
 if st.session_state.username is None:
     st.info("最初にあなたの名前を入力してください。")
@@ -208,8 +386,11 @@ if st.session_state.username:
     test_results_sheet_name = f"Sheet_TestResults_{sanitized_username}"
 
     # ユーザーの用語データをロード
-    df_vocab = load_data_from_gas(current_worksheet_name)
-    df_test_results = load_data_from_gas(test_results_sheet_name) 
+    # 共有スナップショットを読み取り専用で使用する (変更する場合はコピーしてから)
+    df_vocab = load_shared_snapshot(current_worksheet_name)
+    df_test_results = load_shared_snapshot(test_results_sheet_name)
+    render_memory_report({'用語データ': df_vocab, 'テスト結果': df_test_results})
+    render_profiling_panel()
 
     # セッションステートの初期化（テストモード用）
     if 'test_mode' not in st.session_state:
@@ -228,7 +409,6 @@ if st.session_state.username:
     # セッションステートの初期化（学習モード用）
     if 'learning_mode' not in st.session_state:
         st.session_state.learning_mode = {
-            'filtered_df_indices': [],
             'current_index_in_filtered': 0,
             'selected_category': '全てのカテゴリ',
             'progress_filter': '全ての進捗'
@@ -239,16 +419,19 @@ if st.session_state.username:
         st.session_state.dictionary_mode = {
             'search_term': '',
             'selected_category': '全てのカテゴリ',
-            'expanded_term_id': None # 展開表示する用語のID
+            'expanded_term_ids': set(), # 展開表示する用語のID
+            'page': 0, # 表示中のページ (0始まり)
+            'page_size': 20,
+            'filter_key': None # ページ番号をリセットするための絞り込み条件
         }
 
 
     # --- テスト問題生成ヘルパー関数 ---
     def generate_questions_for_test(test_type, question_source, category_filter='全てのカテゴリ', num_questions=10):
-        eligible_vocab_df = df_vocab.copy()
+        eligible_vocab_df = df_vocab
 
         if question_source == 'category' and category_filter != '全てのカテゴリ':
-            eligible_vocab_df = eligible_vocab_df[eligible_vocab_df['カテゴリ (Category)'] == category_filter]
+            eligible_vocab_df = filter_frame(df_vocab, {'カテゴリ (Category)': category_filter})
         
         if test_type == 'example_to_term':
             eligible_vocab_df = eligible_vocab_df[pd.notna(eligible_vocab_df['例文 (Example)']) & (eligible_vocab_df['例文 (Example)'] != '')]
@@ -321,6 +504,7 @@ if st.session_state.username:
         st.session_state.test_mode['score'] = 0
         st.session_state.test_mode['answers'] = [None] * len(st.session_state.test_mode['questions'])
         st.session_state.test_mode['detailed_results'] = []
+        st.session_state.test_mode['test_id'] = datetime.now().strftime('%Y%m%d%H%M%S%f')
         
         st.rerun()
 
@@ -343,33 +527,30 @@ if st.session_state.username:
     if page == "用語一覧":
         st.header("登録済みビジネス用語")
         if not df_vocab.empty:
-            all_categories = ['全てのカテゴリ'] + sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
-            selected_category = st.selectbox("カテゴリで絞り込む:", all_categories)
-            filtered_df = df_vocab.copy()
-            if selected_category != '全てのカテゴリ':
-                filtered_df = filtered_df[filtered_df['カテゴリ (Category)'] == selected_category]
+            all_categories = ['全てのカテゴリ'] + filter_values(df_vocab, 'カテゴリ (Category)')
+            selected_category = st.selectbox("カテゴリで絞り込む:", all_categories,
+                format_func=lambda x: x if x == '全てのカテゴリ' else f"{x} ({filter_count(df_vocab, 'カテゴリ (Category)', x)})")
             search_term = st.text_input("用語や説明を検索:")
-            if search_term:
-                search_lower = search_term.lower()
-                filtered_df = filtered_df[
-                    filtered_df.apply(lambda row: 
-                                      search_lower in str(row['用語 (Term)']).lower() or
-                                      search_lower in str(row['説明 (Definition)']).lower() or
-                                      (pd.notna(row['例文 (Example)']) and search_lower in str(row['例文 (Example)']).lower()), 
-                                      axis=1)
-                ]
-            st.dataframe(filtered_df, use_container_width=True, hide_index=True)
+            filter_conditions = {} if selected_category == '全てのカテゴリ' else {'カテゴリ (Category)': selected_category}
+            filtered_positions = search_positions(df_vocab, filter_conditions, search_term,
+                                                  ['用語 (Term)', '説明 (Definition)', '例文 (Example)'])
+            render_paginated_table(df_vocab, df_vocab.index[filtered_positions], 'vocab_list_table', VOCAB_HEADERS,
+                                   filter_key=(selected_category, search_term))
         else:
             st.info("まだ用語が登録されていません。「用語の追加・編集」から追加してください。")
 
     elif page == "用語の追加・編集":
         st.header("新しい用語の追加")
+        if st.session_state.pop('reset_add_term_input', False): # 追加後は入力欄を作り直して空にする
+            st.session_state.add_term_input_resets = st.session_state.get('add_term_input_resets', 0) + 1
+        # 用語はフォームの外で入力させ、キー入力が途切れるたびに登録済みの候補と重複を表示する
+        new_term, existing_terms = render_term_input(df_vocab, "用語 (Term)*", f"add_term_input_{st.session_state.get('add_term_input_resets', 0)}",
+                                                     placeholder="例: Burn Rate")
         with st.form("add_term_form"):
-            new_term = st.text_input("用語 (Term)*", help="例: Burn Rate")
             new_definition = st.text_area("説明 (Definition)*", help="例: キャッシュを消費する速度。通常、月単位で測定される。")
             new_example = st.text_area("例文 (Example)", help="例: 「スタートアップは高いBurn Rateを維持しているため、追加の資金調達が必要だ。」")
             
-            existing_categories = sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
+            existing_categories = filter_values(df_vocab, 'カテゴリ (Category)')
             selected_category = st.selectbox("カテゴリ (Category)", 
                                              options=['新しいカテゴリを作成'] + existing_categories)
             if selected_category == '新しいカテゴリを作成':
@@ -380,7 +561,9 @@ if st.session_state.username:
             
             submitted = st.form_submit_button("用語を追加")
             if submitted:
-                if new_term and new_definition and category_to_add:
+                if existing_terms:
+                    st.error(f"用語 '{new_term}' は既に登録されています。下の「既存用語の編集・削除」から編集してください。")
+                elif new_term and new_definition and category_to_add:
                     new_id = 1 if df_vocab.empty else df_vocab['ID'].max() + 1
                     new_row = pd.DataFrame([{
                         'ID': new_id,
@@ -393,14 +576,20 @@ if st.session_state.username:
                     updated_df = pd.concat([df_vocab, new_row], ignore_index=True)
                     if write_data_to_gas(updated_df, current_worksheet_name):
                         st.success(f"用語 '{new_term}' が追加されました！")
+                        st.session_state.reset_add_term_input = True
                         st.rerun()
                 else:
                     st.error("用語、説明、カテゴリは必須項目です。")
         st.markdown("---")
         st.header("既存用語の編集・削除")
         if not df_vocab.empty:
+            # 全用語を並べ替えて並べる代わりに、トライ木から前方一致する用語だけを候補にする
+            edit_search = st.text_input("編集または削除する用語を検索 (前方一致):", key="edit_term_search")
+            edit_candidates, edit_candidate_total = complete_terms(df_vocab, edit_search, EDIT_PICKER_LIMIT)
+            if edit_candidate_total > len(edit_candidates):
+                st.caption(f"{edit_candidate_total} 件中 {len(edit_candidates)} 件を表示しています。続けて入力すると絞り込めます。")
             term_to_edit_delete = st.selectbox("編集または削除する用語を選択:", 
-                                                options=['選択してください'] + sorted(df_vocab['用語 (Term)'].tolist()))
+                                                options=['選択してください'] + edit_candidates)
             if term_to_edit_delete != '選択してください':
                 selected_term_data = df_vocab[df_vocab['用語 (Term)'] == term_to_edit_delete].iloc[0]
                 with st.form("edit_delete_form"):
@@ -408,7 +597,7 @@ if st.session_state.username:
                     edited_definition = st.text_area("説明 (Definition)*", value=selected_term_data['説明 (Definition)'])
                     edited_example = st.text_area("例文 (Example)", value=selected_term_data['例文 (Example)'])
                     
-                    existing_categories_for_edit = sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
+                    existing_categories_for_edit = filter_values(df_vocab, 'カテゴリ (Category)')
                     try:
                         current_category_index = existing_categories_for_edit.index(selected_term_data['カテゴリ (Category)'])
                         default_index_for_selectbox = current_category_index + 1 # '新しいカテゴリを作成' の分オフセット
@@ -435,6 +624,7 @@ if st.session_state.username:
                     delete_submitted = col_delete.form_submit_button("削除")
                     if edit_submitted:
                         if edited_term and edited_definition and category_to_save:
+                            df_vocab = with_plain_categories(df_vocab) # 共有スナップショットを直接変更しない (新しいカテゴリも代入できるように文字列列に戻したコピー)
                             idx = df_vocab[df_vocab['ID'] == selected_term_data['ID']].index[0]
                             df_vocab.loc[idx, '用語 (Term)'] = edited_term
                             df_vocab.loc[idx, '説明 (Definition)'] = edited_definition
@@ -461,7 +651,7 @@ if st.session_state.username:
             st.info("学習する用語がありません。「用語の追加・編集」から追加してください。")
             st.stop()
         
-        all_categories = ['全てのカテゴリ'] + sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
+        all_categories = ['全てのカテゴリ'] + filter_values(df_vocab, 'カテゴリ (Category)')
         progress_options = ['全ての進捗', 'Not Started', 'Learning', 'Mastered']
 
         col_filter1, col_filter2 = st.columns(2)
@@ -474,80 +664,68 @@ if st.session_state.username:
                                                     key="learn_progress_filter",
                                                     index=progress_options.index(st.session_state.learning_mode['progress_filter']))
         
-        # まずfiltered_dfを定義
-        filtered_df = df_vocab.copy()
+        filter_conditions = {}
         if selected_category_filter != '全てのカテゴリ':
-            filtered_df = filtered_df[filtered_df['カテゴリ (Category)'] == selected_category_filter]
+            filter_conditions['カテゴリ (Category)'] = selected_category_filter
         if selected_progress_filter != '全ての進捗':
-            filtered_df = filtered_df[filtered_df['学習進捗 (Progress)'] == selected_progress_filter]
-
-        # フィルタリング条件が変わったか、または filtered_df_indices が初期化されていないかチェック
-        if (selected_category_filter != st.session_state.learning_mode['selected_category'] or
-            selected_progress_filter != st.session_state.learning_mode['progress_filter'] or
-            not st.session_state.learning_mode['filtered_df_indices'] or
-            # 現在のフィルタリング結果のインデックスとセッションステートのインデックスが異なるかチェック
-            set(st.session_state.learning_mode['filtered_df_indices']) != set(filtered_df.index.tolist())
-            ):
+            filter_conditions['学習進捗 (Progress)'] = selected_progress_filter
+        filtered_positions = filter_positions(df_vocab, filter_conditions)
+
+        # 表示する行は毎回インデックスから求め直す (読み込み直しで行の位置が変わっても古い位置を使わない)
+        filtered_df_indices = df_vocab.index.tolist() if filtered_positions is None else df_vocab.index[filtered_positions].tolist()
+        # 絞り込み条件か、絞り込んだ用語 (IDの並び) が変わったときだけ表示位置をリセットする (再実行はしない)
+        deck_terms = df_vocab['ID'].tolist() if filtered_positions is None else df_vocab['ID'].iloc[filtered_positions].tolist()
+        deck_id = f"{selected_category_filter}|{selected_progress_filter}|{len(deck_terms)}|{hash(tuple(deck_terms))}"
+        if st.session_state.learning_mode.get('deck_id') != deck_id:
+            st.session_state.learning_mode['deck_id'] = deck_id
             st.session_state.learning_mode['selected_category'] = selected_category_filter
             st.session_state.learning_mode['progress_filter'] = selected_progress_filter
-            st.session_state.learning_mode['filtered_df_indices'] = filtered_df.index.tolist()
             st.session_state.learning_mode['current_index_in_filtered'] = 0
-            # フィルタリング結果が空でない場合のみrerun
-            # filtered_df.empty のチェックは以下の if filtered_df.empty: で処理
-            st.rerun()
+            st.session_state.learning_mode['window_offset'] = 0
 
-        # filtered_dfが空だった場合の処理
-        if filtered_df.empty:
+        if not filtered_df_indices:
             st.info("この条件に一致する用語は見つかりませんでした。")
-            st.session_state.learning_mode['filtered_df_indices'] = []
-            st.session_state.learning_mode['current_index_in_filtered'] = 0
             st.stop()
         
-        total_terms_in_filtered = len(filtered_df)
-        current_display_index_in_filtered = st.session_state.learning_mode['current_index_in_filtered']
-
-        # 現在のインデックスが範囲外にならないように調整 (フィルタリング結果が変わった場合など)
-        if current_display_index_in_filtered >= total_terms_in_filtered:
+        total_terms_in_filtered = len(filtered_df_indices)
+
+        # コンポーネントが前回の描画で要求したウィンドウ (表示位置が端に近づいたときのバックグラウンド要求)
+        flashcards_key = f"flashcards_{deck_id}"
+        window_request = st.session_state.get(flashcards_key)
+        if window_request and window_request.get('deck_id') == deck_id:
+            st.session_state.learning_mode['window_offset'] = window_request['window_offset']
+            st.session_state.learning_mode['current_index_in_filtered'] = window_request['position']
+
+        window_offset = st.session_state.learning_mode['window_offset']
+        if window_offset >= total_terms_in_filtered:
+            window_offset = 0
+            st.session_state.learning_mode['window_offset'] = 0
             st.session_state.learning_mode['current_index_in_filtered'] = 0
-            current_display_index_in_filtered = 0 # 再度設定
-            # filtered_df.empty のチェックは済んでいるので、ここは問題ない
-            # st.rerun() はここで不要、下の term_data の取得で正しいデータがロードされる
-
-        original_idx = st.session_state.learning_mode['filtered_df_indices'][current_display_index_in_filtered]
-        current_term_data = df_vocab.loc[original_idx] # オリジナルのdf_vocabからデータを取得
 
-        st.markdown("---")
-        st.subheader(f"現在表示中: {current_display_index_in_filtered + 1} / {total_terms_in_filtered}")
-
-        st.metric("用語", current_term_data['用語 (Term)'])
-        st.info(f"カテゴリ: **{current_term_data['カテゴリ (Category)']}**")
-        st.write(f"### 説明")
-        st.markdown(f"**{current_term_data['説明 (Definition)']}**")
-        if pd.notna(current_term_data['例文 (Example)']) and current_term_data['例文 (Example)'] != '':
-            st.write(f"### 例文")
-            st.markdown(f"*{current_term_data['例文 (Example)']}*")
-        
-        st.write(f"---")
-        
-        st.write(f"現在の学習進捗: **{current_term_data['学習進捗 (Progress)']}**")
-        
-        # 学習進捗の更新セレクトボックスを完全に削除
+        window_df = df_vocab.loc[filtered_df_indices[window_offset:window_offset + FLASHCARD_WINDOW_SIZE]]
+        window_cards = [
+            {
+                'term': str(row['用語 (Term)']),
+                'definition': str(row['説明 (Definition)']) if pd.notna(row['説明 (Definition)']) else '',
+                'example': str(row['例文 (Example)']) if pd.notna(row['例文 (Example)']) else '',
+                'category': str(row['カテゴリ (Category)']) if pd.notna(row['カテゴリ (Category)']) else '',
+                'progress': str(row['学習進捗 (Progress)'])
+            }
+            for row in window_df.to_dict(orient='records')
+        ]
 
         st.markdown("---")
-
-        col_prev, col_random, col_next = st.columns(3)
-        with col_prev:
-            if st.button("前の用語へ", disabled=(current_display_index_in_filtered == 0)):
-                st.session_state.learning_mode['current_index_in_filtered'] -= 1
-                st.rerun()
-        with col_random:
-            if st.button("ランダムな用語へ"):
-                st.session_state.learning_mode['current_index_in_filtered'] = random.randrange(total_terms_in_filtered)
-                st.rerun()
-        with col_next:
-            if st.button("次の用語へ", disabled=(current_display_index_in_filtered >= total_terms_in_filtered - 1)):
-                st.session_state.learning_mode['current_index_in_filtered'] += 1
-                st.rerun()
+        flashcards(
+            deck_id=deck_id,
+            cards=window_cards,
+            window_offset=window_offset,
+            window_size=FLASHCARD_WINDOW_SIZE,
+            prefetch_margin=FLASHCARD_PREFETCH_MARGIN,
+            total=total_terms_in_filtered,
+            position=st.session_state.learning_mode['current_index_in_filtered'],
+            key=flashcards_key,
+            default=None
+        )
 
     elif page == "辞書モード":
         st.header("辞書モード")
@@ -556,7 +734,7 @@ if st.session_state.username:
             st.info("辞書に登録された用語がありません。「用語の追加・編集」から追加してください。")
             st.stop()
         
-        all_categories = ['全てのカテゴリ'] + sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
+        all_categories = ['全てのカテゴリ'] + filter_values(df_vocab, 'カテゴリ (Category)')
 
         search_col, category_col = st.columns([2, 1])
         with search_col:
@@ -568,55 +746,74 @@ if st.session_state.username:
                                                                                  index=all_categories.index(st.session_state.dictionary_mode['selected_category']),
                                                                                  key="dict_category_filter")
 
-        filtered_df = df_vocab.copy()
-        
-        if st.session_state.dictionary_mode['selected_category'] != '全てのカテゴリ':
-            filtered_df = filtered_df[filtered_df['カテゴリ (Category)'] == st.session_state.dictionary_mode['selected_category']]
-        
-        if st.session_state.dictionary_mode['search_term']:
-            search_lower = st.session_state.dictionary_mode['search_term'].lower()
-            filtered_df = filtered_df[
-                filtered_df.apply(lambda row: 
-                                  search_lower in str(row['用語 (Term)']).lower() or
-                                  search_lower in str(row['説明 (Definition)']).lower() or
-                                  (pd.notna(row['例文 (Example)']) and search_lower in str(row['例文 (Example)']).lower()), 
-                                  axis=1)
-            ]
+        # 用語の展開・ページ移動だけの再実行では、キャッシュ済みの絞り込み結果を使う
+        selected_dictionary_category = st.session_state.dictionary_mode['selected_category']
+        filter_conditions = {} if selected_dictionary_category == '全てのカテゴリ' else {'カテゴリ (Category)': selected_dictionary_category}
+        filtered_df = df_vocab.iloc[search_positions(df_vocab, filter_conditions, st.session_state.dictionary_mode['search_term'],
+                                                     ['用語 (Term)', '説明 (Definition)', '例文 (Example)'])]
         
         if filtered_df.empty:
             st.info("この条件に一致する用語は見つかりませんでした。")
         else:
             st.markdown("---")
-            st.subheader(f"検索結果 ({len(filtered_df)} 件)")
-            for _, row in filtered_df.iterrows():
-                # expander の key に一意な ID を使用
-                expander_key = f"expander_{row['ID']}"
-                
-                # expanded 状態を制御するためのボタンも同じIDを使う
-                if st.session_state.dictionary_mode['expanded_term_id'] == row['ID']:
-                    # 展開されている状態で、詳細を見るボタンを押させない
-                    is_expanded = True
-                else:
-                    is_expanded = False
+            total_hits = len(filtered_df)
+
+            # 絞り込み条件が変わったら1ページ目に戻す
+            filter_key = (st.session_state.dictionary_mode['search_term'], st.session_state.dictionary_mode['selected_category'])
+            if st.session_state.dictionary_mode['filter_key'] != filter_key:
+                st.session_state.dictionary_mode['filter_key'] = filter_key
+                st.session_state.dictionary_mode['page'] = 0
+
+            col_count, col_page_size = st.columns([3, 1])
+            with col_count:
+                st.subheader(f"検索結果 ({total_hits} 件)")
+            with col_page_size:
+                page_size_options = [10, 20, 50, 100]
+                st.session_state.dictionary_mode['page_size'] = st.selectbox("1ページの表示件数:", page_size_options,
+                                                                             index=page_size_options.index(st.session_state.dictionary_mode['page_size']),
+                                                                             key="dict_page_size")
+            page_size = st.session_state.dictionary_mode['page_size']
+            total_pages = (total_hits - 1) // page_size + 1
+            current_page = min(st.session_state.dictionary_mode['page'], total_pages - 1)
+            st.session_state.dictionary_mode['page'] = current_page
+
+            # 表示中のページの用語だけウィジェットを作り、説明・例文は開いている用語だけ描画する
+            expanded_term_ids = st.session_state.dictionary_mode['expanded_term_ids']
+            page_df = filtered_df.iloc[current_page * page_size:(current_page + 1) * page_size]
+            for row in page_df.to_dict(orient='records'):
+                term_id = int(row['ID'])
+                is_expanded = term_id in expanded_term_ids
+
+                col_title, col_toggle = st.columns([5, 1])
+                with col_title:
+                    st.markdown(f"**{row['用語 (Term)']}** （カテゴリ: {row['カテゴリ (Category)']}）")
+                with col_toggle:
+                    if st.button("閉じる" if is_expanded else "詳細を見る", key=f"toggle_dict_{term_id}"):
+                        if is_expanded:
+                            expanded_term_ids.discard(term_id)
+                        else:
+                            expanded_term_ids.add(term_id)
+                        st.rerun()
 
-                with st.expander(f"**{row['用語 (Term)']}.** （カテゴリ: {row['カテゴリ (Category)']}）", 
-                                  expanded=is_expanded):
+                if is_expanded:
                     st.write(f"### 説明")
                     st.markdown(f"**{row['説明 (Definition)']}**")
                     if pd.notna(row['例文 (Example)']) and row['例文 (Example)'] != '':
                         st.write(f"### 例文")
                         st.markdown(f"*{row['例文 (Example)']}*")
-                    
-                    if st.button("閉じる", key=f"close_dict_{row['ID']}"):
-                        st.session_state.dictionary_mode['expanded_term_id'] = None
-                        st.rerun()
-                
-                # expanderの外に詳細を見るボタンを配置して、expanded_term_idを更新する
-                if not is_expanded:
-                    if st.button("詳細を見る", key=f"open_dict_{row['ID']}"):
-                        st.session_state.dictionary_mode['expanded_term_id'] = row['ID']
-                        st.rerun()
-                st.markdown("---") 
+                st.markdown("---")
+
+            col_prev, col_page, col_next = st.columns([1, 2, 1])
+            with col_prev:
+                if st.button("前のページ", key="dict_prev_page", disabled=(current_page == 0)):
+                    st.session_state.dictionary_mode['page'] -= 1
+                    st.rerun()
+            with col_page:
+                st.write(f"{current_page + 1} / {total_pages} ページ")
+            with col_next:
+                if st.button("次のページ", key="dict_next_page", disabled=(current_page >= total_pages - 1)):
+                    st.session_state.dictionary_mode['page'] += 1
+                    st.rerun()
 
     elif page == "テストモード":
         st.header("テストモード")
@@ -624,7 +821,7 @@ if st.session_state.username:
             st.info("テストする用語がありません。「用語の追加・編集」から追加してください。")
             st.stop()
 
-        all_categories_for_test = ['全てのカテゴリ'] + sorted(df_vocab['カテゴリ (Category)'].dropna().unique().tolist())
+        all_categories_for_test = ['全てのカテゴリ'] + filter_values(df_vocab, 'カテゴリ (Category)')
         
         # テストがアクティブでない場合 (テスト設定画面)
         if not st.session_state.test_mode['is_active']:
@@ -760,63 +957,46 @@ if st.session_state.username:
 
             # 通常の問題出題
             else:
-                current_question = questions[current_idx]
-                st.subheader(f"問題 {current_idx + 1} / {total_questions}")
-                current_correct_answers = sum(1 for i, q in enumerate(questions[:current_idx]) if st.session_state.test_mode['answers'][i] == q['correct_answer'])
-                st.metric(label="現在のスコア", value=f"{current_correct_answers} / {current_idx}")
-                
-                st.write(f"**問題:** {current_question['question_text']}")
-
-                with st.form(key=f"question_form_{current_idx}"):
-                    default_choice_index = 0
-                    if st.session_state.test_mode['answers'][current_idx] in current_question['choices']:
-                        try:
-                            default_choice_index = current_question['choices'].index(st.session_state.test_mode['answers'][current_idx])
-                        except ValueError:
-                            default_choice_index = 0 # 選択肢が変更された場合などに備え
-                    
-                    selected_choice = st.radio("選択肢:", current_question['choices'], 
-                                               key=f"radio_{current_idx}",
-                                               index=default_choice_index) 
-                    
-                    submit_answer = st.form_submit_button("回答を送信")
+                # 問題一式をコンポーネントに一度だけ渡し、ページ送りや選択はブラウザ内で処理する
+                # 正解はブラウザに送らず、回答がまとめて返ってきたときだけ再実行して採点する
+                submission = batched_quiz(
+                    questions=[{'question_text': q['question_text'], 'choices': q['choices']} for q in questions],
+                    test_id=st.session_state.test_mode['test_id'],
+                    key=f"batched_quiz_{st.session_state.test_mode['test_id']}",
+                    default=None
+                )
 
-                    if submit_answer:
-                        st.session_state.test_mode['answers'][current_idx] = selected_choice 
-                        
-                        is_correct_current_q = (selected_choice == current_question['correct_answer'])
-                        if is_correct_current_q:
-                            st.success("正解！🎉")
-                        else:
-                            st.error(f"不正解... 😭 正解は: **{current_question['correct_answer']}**")
+                if submission and submission.get('test_id') == st.session_state.test_mode['test_id']:
+                    st.session_state.test_mode['answers'] = list(submission['answers'])
+
+                    # 学習進捗の更新 (全問分をまとめて反映し、GASへの書き込みは1回だけ)
+                    df_vocab = df_vocab.copy() # 共有スナップショットを直接変更しない
+                    progress_updated = False
+                    for q, user_ans in zip(questions, st.session_state.test_mode['answers']):
+                        original_df_index = df_vocab[df_vocab['ID'] == q['term_id']].index
+                        if original_df_index.empty:
+                            continue
+                        row_idx = original_df_index[0]
+                        current_progress = df_vocab.loc[row_idx, '学習進捗 (Progress)']
                         
-                        # 学習進捗の更新 (テストモード内での簡易更新)
-                        original_df_index = df_vocab[df_vocab['ID'] == current_question['term_id']].index
-                        if not original_df_index.empty:
-                            row_idx = original_df_index[0]
-                            current_progress = df_vocab.loc[row_idx, '学習進捗 (Progress)']
-                            
-                            # 進捗を Not Started -> Learning -> Mastered に更新
-                            if is_correct_current_q:
-                                if current_progress == 'Not Started':
-                                    df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Learning'
-                                elif current_progress == 'Learning':
-                                    df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Mastered'
-                            else: # 不正解の場合、進捗を戻す
-                                if current_progress == 'Mastered':
-                                    df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Learning'
-                                elif current_progress == 'Learning':
-                                    df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Not Started'
-                            
-                            # 更新されたdf_vocabをGASに書き込む
-                            if write_data_to_gas(df_vocab, current_worksheet_name):
-                                # st.info(f"用語 '{current_question['term_name']}' の学習進捗が更新されました。")
-                                pass # メッセージは抑制
-                            else:
-                                st.warning(f"用語 '{current_question['term_name']}' の学習進捗更新に失敗しました。")
-
-                        st.session_state.test_mode['current_question_index'] += 1
-                        st.rerun() 
+                        # 進捗を Not Started -> Learning -> Mastered に更新
+                        if user_ans == q['correct_answer']:
+                            if current_progress == 'Not Started':
+                                df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Learning'
+                            elif current_progress == 'Learning':
+                                df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Mastered'
+                        else: # 不正解の場合、進捗を戻す
+                            if current_progress == 'Mastered':
+                                df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Learning'
+                            elif current_progress == 'Learning':
+                                df_vocab.loc[row_idx, '学習進捗 (Progress)'] = 'Not Started'
+                        progress_updated = True
+
+                    if progress_updated and not write_data_to_gas(df_vocab, current_worksheet_name):
+                        st.warning("学習進捗の更新に失敗しました。")
+
+                    st.session_state.test_mode['current_question_index'] = total_questions
+                    st.rerun()
                 
                 st.markdown("---")
                 if st.button("テストを終了する (途中終了)", key="end_test_midway"):
@@ -827,27 +1007,47 @@ if st.session_state.username:
         st.header("データ管理")
         
         st.subheader("全用語データのエクスポート")
-        if st.button("CSVでダウンロード (用語データ)"):
-            if not df_vocab.empty:
-                csv = df_vocab.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="用語データをダウンロード",
-                    data=csv,
-                    file_name=f"{sanitized_username}_vocabulary_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv",
-                    mime="text/csv",
-                    key="download_vocab_csv"
-                )
-            else:
-                st.info("ダウンロードする用語データがありません。")
+        if not df_vocab.empty:
+            # CSVはボタンが押されたときに生成する (ページを開くたびに全件を書き出さない)
+            st.download_button(
+                label="CSVでダウンロード (用語データ)",
+                data=export_data_source('vocab_csv', df_vocab, build_csv_export),
+                file_name=f"{sanitized_username}_vocabulary_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv",
+                mime="text/csv",
+                key="download_vocab_csv",
+                on_click="ignore"
+            )
+            # Parquet・Arrow は列の型を保ったまま書き出す (Supabase版への移行やバックアップ向け)
+            st.download_button(
+                label="Parquetでダウンロード (用語データ)",
+                data=export_data_source('vocab_parquet', df_vocab, build_vocab_parquet_export),
+                file_name=f"{sanitized_username}_vocabulary_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.parquet",
+                mime="application/vnd.apache.parquet",
+                key="download_vocab_parquet",
+                on_click="ignore"
+            )
+            st.download_button(
+                label="Arrowでダウンロード (用語データ)",
+                data=export_data_source('vocab_arrow', df_vocab, build_vocab_arrow_export),
+                file_name=f"{sanitized_username}_vocabulary_data_{datetime.now().strftime('%Y%m%d%H%M%S')}.arrow",
+                mime="application/vnd.apache.arrow.file",
+                key="download_vocab_arrow",
+                on_click="ignore"
+            )
+        else:
+            st.info("ダウンロードする用語データがありません。")
 
         st.markdown("---")
-        st.subheader("用語データの一括インポート (CSV)")
+        st.subheader("用語データの一括インポート (CSV / Parquet / Arrow)")
         st.warning("⚠️ **注意**: インポートを行うと、既存のデータが上書きされる可能性があります。事前にデータをダウンロードしてバックアップを取ることを強く推奨します。")
-        uploaded_file = st.file_uploader("CSVファイルをアップロードしてください", type=["csv"])
+        uploaded_file = st.file_uploader("CSV・Parquet・Arrowファイルをアップロードしてください", type=["csv", "parquet", "arrow", "feather"])
         if uploaded_file is not None:
             try:
-                uploaded_df = pd.read_csv(uploaded_file)
                 required_cols = ['用語 (Term)', '説明 (Definition)', 'カテゴリ (Category)']
+                if uploaded_file.name.endswith(ARROW_IMPORT_EXTENSIONS): # 列の型をスキーマで検証してから読み込む
+                    uploaded_df = read_arrow_import(uploaded_file, VOCAB_ARROW_CHECKS, required_cols)
+                else:
+                    uploaded_df = pd.read_csv(uploaded_file)
                 if not all(col in uploaded_df.columns for col in required_cols):
                     st.error(f"CSVファイルには以下の必須カラムが含まれている必要があります: {', '.join(required_cols)}")
                 else:
@@ -870,56 +1070,79 @@ if st.session_state.username:
             except Exception as e:
                 st.error(f"ファイルの読み込みまたは処理中にエラーが発生しました: {e}")
 
+        st.markdown("---")
+        st.subheader("テスト結果のインポート (Parquet / Arrow)")
+        results_file = st.file_uploader("Parquet・Arrowファイルをアップロードしてください", type=["parquet", "arrow", "feather"],
+                                        key="results_file_uploader")
+        if results_file is not None:
+            results_action = st.radio("インポート方法を選択", ("既存の結果に追加", "既存の結果を上書き"), key="results_import_action_radio")
+            if st.button("テスト結果のインポートを実行"):
+                try:
+                    imported_results = read_test_results_import(results_file)
+                    if results_action == "既存の結果に追加" and not df_test_results.empty:
+                        existing_results = df_test_results.assign(Details=decode_details_column(df_test_results['Details']))
+                        imported_results = pd.concat([existing_results, imported_results], ignore_index=True)
+                    imported_results = imported_results.sort_values(by='Date', ascending=False).reset_index(drop=True)
+                    if write_data_to_gas(imported_results, test_results_sheet_name):
+                        st.success("テスト結果が正常にインポートされました！")
+                        st.rerun()
+                except Exception as e:
+                    st.error(f"ファイルの読み込みまたは処理中にエラーが発生しました: {e}")
+
         st.markdown("---")
         st.subheader("過去のテスト結果")
         if not df_test_results.empty:
-            df_test_results_display = df_test_results.copy()
-            
-            # 'Date'カラムを表示用にフォーマット
-            df_test_results_display['Date_Display'] = df_test_results_display['Date'].dt.strftime("%Y-%m-%d %H:%M:%S")
-            
-            for idx, row in df_test_results_display.iterrows():
-                with st.expander(f"テスト日時: {row['Date_Display']} | カテゴリ: {row['Category']} | 形式: {row['TestType']} | スコア: {row['Score']} / {row['TotalQuestions']}"):
-                    st.write(f"---")
-                    st.write(f"**テスト詳細:**")
-                    
-                    # 'Details'カラムは既にPythonオブジェクト（リスト）としてロードされていることを想定
-                    details = row['Details'] if isinstance(row['Details'], list) else []
-
-                    if not details:
-                        st.info("このテストには詳細な結果が記録されていません。")
-                    else:
-                        for i, detail in enumerate(details):
-                            is_correct_icon = "✅" if detail.get('is_correct') else "❌" # .get() を使用
-                            st.write(f"**問題 {i+1}** {is_correct_icon}")
-                            st.write(f"　- 問題文: {detail.get('question_text', 'N/A')}")
-                            st.write(f"　- 正解: {detail.get('correct_answer', 'N/A')}")
-                            st.write(f"　- あなたの回答: {detail.get('user_answer', 'N/A')}")
-                            st.write("---辞書情報---") 
-                            st.write(f"　- 用語: {detail.get('term_name', 'N/A')}")
-                            st.write(f"　- 説明: {detail.get('term_definition', 'N/A')}")
-                            example = detail.get('term_example', 'N/A')
-                            if example != 'N/A' and example != '':
-                                st.write(f"　- 例文: {example}")
-                            st.markdown("---")
+            # 一覧は表示中のページの概要だけを表示し、詳細は選択したテスト1件分だけ描画する
+            total_results = len(df_test_results)
+            total_result_pages = (total_results - 1) // TEST_RESULTS_PAGE_SIZE + 1
+            results_page = st.number_input("ページ", min_value=1, max_value=total_result_pages, value=1, step=1,
+                                           key="test_results_page") - 1
+            page_start = results_page * TEST_RESULTS_PAGE_SIZE
+            page_results = df_test_results.iloc[page_start:page_start + TEST_RESULTS_PAGE_SIZE]
+
+            summary_df = pd.DataFrame({
+                'テスト日時': page_results['Date'].dt.strftime("%Y-%m-%d %H:%M:%S"),
+                'カテゴリ': page_results['Category'],
+                '形式': page_results['TestType'],
+                'スコア': page_results['Score'].astype(str) + " / " + page_results['TotalQuestions'].astype(str)
+            })
+            st.caption(f"全 {total_results} 件中 {page_start + 1}〜{page_start + len(page_results)} 件を表示しています。行を選択すると詳細を表示します。")
+            results_selection = st.dataframe(summary_df, hide_index=True, use_container_width=True,
+                                             on_select="rerun", selection_mode="single-row",
+                                             key=f"test_results_table_{results_page}")
+
+            selected_rows = results_selection.selection.rows
+            if selected_rows:
+                selected_result = df_test_results.iloc[page_start + selected_rows[0]]
+                st.write(f"---")
+                st.write(f"**テスト詳細:** {selected_result['Date'].strftime('%Y-%m-%d %H:%M:%S')} | カテゴリ: {selected_result['Category']} | 形式: {selected_result['TestType']} | スコア: {selected_result['Score']} / {selected_result['TotalQuestions']}")
+                render_test_result_details(selected_result['Details'])
             
             st.markdown("---")
-            if st.button("CSVでダウンロード (テスト結果)"):
-                # ダウンロード用にはDetailsをJSON文字列に戻す
-                df_test_results_download = df_test_results.copy()
-                df_test_results_download['Details'] = df_test_results_download['Details'].apply(
-                    lambda x: json.dumps(x, ensure_ascii=False, default=json_serial_for_gas) if isinstance(x, list) else '[]'
-                )
-                df_test_results_download['Date'] = df_test_results_download['Date'].dt.strftime("%Y-%m-%d %H:%M:%S")
-
-                csv_test_results = df_test_results_download.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="テスト結果をダウンロード",
-                    data=csv_test_results,
-                    file_name=f"{sanitized_username}_test_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv",
-                    mime="text/csv",
-                    key="download_test_results_csv"
-                )
+            st.download_button(
+                label="CSVでダウンロード (テスト結果)",
+                data=export_data_source('test_results_csv', df_test_results, build_test_results_csv_export),
+                file_name=f"{sanitized_username}_test_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv",
+                mime="text/csv",
+                key="download_test_results_csv",
+                on_click="ignore"
+            )
+            st.download_button(
+                label="Parquetでダウンロード (テスト結果)",
+                data=export_data_source('test_results_parquet', df_test_results, build_test_results_parquet_export),
+                file_name=f"{sanitized_username}_test_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.parquet",
+                mime="application/vnd.apache.parquet",
+                key="download_test_results_parquet",
+                on_click="ignore"
+            )
+            st.download_button(
+                label="Arrowでダウンロード (テスト結果)",
+                data=export_data_source('test_results_arrow', df_test_results, build_test_results_arrow_export),
+                file_name=f"{sanitized_username}_test_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.arrow",
+                mime="application/vnd.apache.arrow.file",
+                key="download_test_results_arrow",
+                on_click="ignore"
+            )
 
         else:
             st.info("過去のテスト結果はまだありません。テストモードでテストを実施してください。")
\ No newline at end of file
@@ -1,20 +1,48 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import requests
 import json
 import os
 import random
 from datetime import datetime, date
 import io
+import time
+import threading
+import logging
+import atexit
+from urllib.parse import quote
+from collections import OrderedDict
+
+# 保存先に依存しない共通の処理
+from vocab_core import (
+    VOCAB_HEADERS, TEST_RESULTS_HEADERS, batched_quiz, get_sampling_table, weighted_sample_without_replacement,
+    get_data_version, bump_data_version, ARROW_STRING_DTYPE, compact_vocab_frame, compact_test_results_frame,
+    details_to_list, decode_details_column, with_plain_categories, render_memory_report, carry_filter_index,
+    filter_values, filter_count, filter_frame, prepare_search_columns, render_term_input, search_positions,
+    format_filter_cache_stats, export_data_source, build_csv_export, build_json_export, TEST_RESULTS_ARROW_CHECKS,
+    build_vocab_parquet_export, build_vocab_arrow_export, build_test_results_parquet_export,
+    build_test_results_arrow_export, read_arrow_import, render_paginated_table, iter_import_chunks,
+    normalize_import_chunk, NEAR_DUPLICATE_THRESHOLD, get_import_preview, new_import_checkpoint,
+    TEST_RESULTS_PAGE_SIZE
+)
 
 # --- Supabase 接続のインポート ---
 from st_supabase_connection import SupabaseConnection
 
-# --- 設定項目 ---
-VOCAB_HEADERS = ['ID', '用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)', '学習進捗 (Progress)']
-TEST_RESULTS_HEADERS = ['Date', 'Category', 'TestType', 'Score', 'TotalQuestions', 'Details']
+# デバッグ用の情報や、処理を続けられる失敗は画面ではなくログに出す
+logger = logging.getLogger(__name__)
+
+# --- 任意の依存ライブラリ ---
+try:
+    import psycopg # 変更通知 (LISTEN/NOTIFY) の受信に使う。無ければ従来どおり一定時間ごとにバージョンを確認する
+except ImportError:
+    psycopg = None
+
 
 # --- Streamlit アプリケーションの開始 ---
+script_start_time = time.perf_counter() # アプリ全体の再実行時間の計測用
 st.set_page_config(layout="wide")
 st.title("ビジネス用語集ビルダー")
 
@@ -36,7 +64,8 @@ if 'test_mode' not in st.session_state:
         'selected_category': '全カテゴリ',
         'question_count': 10,
         'test_type': 'term_to_def', # 'term_to_def' or 'example_to_term'
-        'question_source': 'random_all' # 'random_all', 'learning_focus'
+        'question_source': 'random_all', # 'random_all', 'learning_focus'
+        'answer_mode': 'batched' # 'batched' (ブラウザ内でまとめて回答) or 'per_question'
     }
 if 'test_review_mode' not in st.session_state:
     st.session_state.test_review_mode = {
@@ -44,10 +73,9 @@ if 'test_review_mode' not in st.session_state:
         'review_index': 0,
         'results_to_review': []
     }
-if 'df_vocab' not in st.session_state:
-    st.session_state.df_vocab = pd.DataFrame(columns=VOCAB_HEADERS)
-if 'df_test_results' not in st.session_state:
-    st.session_state.df_test_results = pd.DataFrame(columns=TEST_RESULTS_HEADERS)
+if 'snapshot_refs' not in st.session_state:
+    # セッションはDataFrame本体ではなく共有スナップショットへの参照 (テーブル名, バージョン) だけを保持する
+    st.session_state.snapshot_refs = {}
 
 
 # --- Supabase 接続の初期化 (st.secrets から認証情報を取得) ---
@@ -67,36 +95,36 @@ supabase = get_supabase_connection()
 # --- テーブルが存在しない場合に自動で作成する関数 ---
 # この関数は、Supabaseプロジェクトに public.execute_sql 関数が作成されていることを前提とします。
 def create_table_if_not_exists(table_name, headers, is_vocab_table=True):
-    st.sidebar.write(f"DEBUG: Checking for table '{table_name}'...")
+    logger.debug(f"Checking for table '{table_name}'...")
     try:
         # テーブルが存在するか確認 (簡単なクエリを試す)
         # 存在しない場合、st-supabase-connectionはAPIErrorを発生させる
         supabase.table(table_name).select('ID').limit(0).execute()
-        st.sidebar.write(f"DEBUG: Table '{table_name}' already exists.")
+        logger.debug(f"Table '{table_name}' already exists.")
         return True
     except Exception as e:
         # テーブルが存在しない場合、エラー（PGRST205など）が発生する
         # APIErrorかどうかをチェックして、存在しない場合にのみ作成処理に進む
         if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 404: # 実際は404ではなくAPIErrorのコードをチェック
-            st.sidebar.write(f"DEBUG: Table '{table_name}' does not exist (HTTP 404), creating it.")
+            logger.debug(f"Table '{table_name}' does not exist (HTTP 404), creating it.")
         elif "PGRST205" in str(e): # PGRST205はPostgRESTがテーブルを見つけられないエラーコード
-             st.sidebar.write(f"DEBUG: Table '{table_name}' does not exist (PGRST205), creating it.")
+             logger.debug(f"Table '{table_name}' does not exist (PGRST205), creating it.")
         else:
-            st.sidebar.write(f"DEBUG: Unknown error when checking table '{table_name}': {e}. Attempting to create.")
+            logger.warning(f"Unknown error when checking table '{table_name}': {e}. Attempting to create.")
         
         # テーブル作成クエリ
         if is_vocab_table:
             columns_sql = ", ".join([f'"{h}" text NULL' for h in headers if h != 'ID'])
             create_query = f"""
-            CREATE TABLE public."{table_name}" (
+            CREATE TABLE public.{sql_identifier(table_name)} (
                 "ID" bigint NOT NULL,
                 {columns_sql},
-                CONSTRAINT "{table_name}_pkey" PRIMARY KEY ("ID")
+                CONSTRAINT {sql_identifier(table_name + "_pkey")} PRIMARY KEY ("ID")
             );
             """
         else: # test_results_ table
             create_query = f"""
-            CREATE TABLE public."{table_name}" (
+            CREATE TABLE public.{sql_identifier(table_name)} (
                 "Date" timestamp with time zone NULL,
                 "Category" text NULL,
                 "TestType" text NULL,
@@ -108,139 +136,1273 @@ def create_table_if_not_exists(table_name, headers, is_vocab_table=True):
         
         try:
             # SQLを実行してテーブルを作成 (RPC経由)
-            st.sidebar.write(f"DEBUG: Executing create table query for '{table_name}'...")
+            logger.debug(f"Executing create table query for '{table_name}'...")
             supabase.rpc("execute_sql", {'sql_query': create_query}).execute()
-            st.sidebar.write(f"DEBUG: Successfully created table '{table_name}'.")
+            logger.debug(f"Successfully created table '{table_name}'.")
 
             # RLSポリシーも自動で追加 (開発用、本番では見直し推奨)
             # 全員にアクセスを許可するポリシー
             rls_policy_query = f"""
-            CREATE POLICY "Enable all access for anon users on {table_name}"
-            ON public."{table_name}"
+            CREATE POLICY {sql_identifier("Enable all access for anon users on " + table_name)}
+            ON public.{sql_identifier(table_name)}
             FOR ALL
             TO anon
             USING (TRUE)
             WITH CHECK (TRUE);
             """
-            st.sidebar.write(f"DEBUG: Executing RLS policy query for '{table_name}'...")
+            logger.debug(f"Executing RLS policy query for '{table_name}'...")
             supabase.rpc("execute_sql", {'sql_query': rls_policy_query}).execute()
-            st.sidebar.write(f"DEBUG: RLS policy added for table '{table_name}'.")
+            logger.debug(f"RLS policy added for table '{table_name}'.")
             return True
         except Exception as create_e:
             st.error(f"テーブル '{table_name}' の作成中にエラーが発生しました: {create_e}")
             st.exception(create_e)
-            st.sidebar.write(f"DEBUG: Table creation error: {create_e}")
+            logger.warning(f"Table creation error: {create_e}")
             return False
 
 # --- Supabaseからデータをロードする関数 (GAS版からの変更) ---
-@st.cache_data(ttl=60)
+# キャッシュはセッション間で共有するスナップショットストア (load_shared_snapshot) で行う
 def load_data_from_supabase(table_name):
-    st.sidebar.write(f"DEBUG: Attempting to load data from Supabase table: {table_name}")
+    logger.debug(f"Attempting to load data from Supabase table: {table_name}")
     try:
         # Supabaseから全データを読み込む
+        fetched_at = time.time()
         response = supabase.table(table_name).select("*").execute()
         
         if response.data:
-            df = pd.DataFrame(response.data)
-            st.sidebar.write(f"DEBUG: Successfully loaded {len(df)} rows from table '{table_name}'.")
-
-            if table_name.startswith("vocab_"): # 用語シートの場合
-                # 必要なカラムが存在しない場合に作成（インポート時のエラー回避）
-                for col in VOCAB_HEADERS:
-                    if col not in df.columns:
-                        df[col] = pd.NA
-                df = df[VOCAB_HEADERS] # カラム順序を固定
-                
-                df['ID'] = pd.to_numeric(df['ID'], errors='coerce').fillna(0).astype('Int64')
-                df['学習進捗 (Progress)'] = df['学習進捗 (Progress)'].fillna('Not Started')
-                df['例文 (Example)'] = df['例文 (Example)'].fillna('')
-                df = df.dropna(subset=['用語 (Term)', '説明 (Definition)'], how='all') # 両方NaNの行を削除
-                df = df.drop_duplicates(subset=['用語 (Term)', '説明 (Definition)'], keep='first') # 重複行を削除
-                df = df.sort_values(by='ID').reset_index(drop=True)
-                
-            elif table_name.startswith("test_results_"): # テスト結果シートの場合
-                for col in TEST_RESULTS_HEADERS:
-                    if col not in df.columns:
-                        df[col] = pd.NA
-                df = df[TEST_RESULTS_HEADERS]
-
-                if 'Date' in df.columns:
-                    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-                    df = df.dropna(subset=['Date'])
-                    if not df.empty:
-                        df = df.sort_values(by='Date', ascending=False).reset_index(drop=True)
-                
-                if 'Details' in df.columns and not df.empty:
-                    def parse_json_safely(json_str):
-                        if pd.isna(json_str) or not isinstance(json_str, str) or not json_str.strip():
-                            return []
-                        try:
-                            # Supabaseからのデータは既に辞書/リストの場合もあるため、直接返す
-                            # 文字列の場合はjson.loadsを試みる
-                            if isinstance(json_str, (dict, list)):
-                                return json_str
-                            return json.loads(json_str)
-                        except (json.JSONDecodeError, TypeError):
-                            st.warning(f"テスト結果の詳細データをJSONとしてパースできませんでした: {str(json_str)[:200]}...")
-                            return []
-                    df['Details'] = df['Details'].apply(parse_json_safely)
-                else:
-                    df['Details'] = [[] for _ in range(len(df))]
-            
+            logger.debug(f"Successfully loaded {len(response.data)} rows from table '{table_name}'.")
+            df = records_to_frame(table_name, response.data)
+            set_sync_watermark(df, latest_timestamp(row.get('updated_at') for row in response.data), fetched_at)
+            bump_data_version(df) # 読み込みごとに新しいデータバージョンを付与
+            if table_name.startswith("vocab_"):
+                prepare_search_columns(df) # 検索用の正規化テキストは読み込み時に一度だけ作る
             return df
         else:
-            st.sidebar.write(f"DEBUG: No data found in table '{table_name}'. Returning empty DataFrame.")
+            logger.debug(f"No data found in table '{table_name}'. Returning empty DataFrame.")
             return pd.DataFrame(columns=TEST_RESULTS_HEADERS if table_name.startswith("test_results_") else VOCAB_HEADERS)
 
     except Exception as e:
         st.error(f"Supabaseからのデータの読み込み中にエラーが発生しました: {e}")
         st.exception(e)
-        st.sidebar.write(f"DEBUG: Supabase Read Error: {e}")
-        return pd.DataFrame(columns=TEST_RESULTS_HEADERS if table_name.startswith("test_results_") else VOCAB_HEADERS)
-
-
-# --- Supabaseにデータを書き込む関数 (GAS版からの変更) ---
-def write_data_to_supabase(df, table_name):
-    try:
-        data_to_upsert = df.to_dict(orient='records')
+        logger.warning(f"Supabase Read Error: {e}")
+        df = pd.DataFrame(columns=TEST_RESULTS_HEADERS if table_name.startswith("test_results_") else VOCAB_HEADERS)
+        df.attrs['load_error'] = True # 読み込みに失敗した空のデータはディスクのスナップショットに保存しない
+        return df
+
+def records_to_frame(table_name, records):
+    """Supabaseから返された行 (辞書のリスト) を、アプリで使う列・型のDataFrameにする (全体の読み込みと差分の取り込みで共通)"""
+    df = pd.DataFrame(records)
+
+    if table_name.startswith("vocab_"): # 用語シートの場合
+        # 必要なカラムが存在しない場合に作成（インポート時のエラー回避）
+        for col in VOCAB_HEADERS:
+            if col not in df.columns:
+                df[col] = pd.NA
+        df = df[VOCAB_HEADERS] # カラム順序を固定
+        
+        df['ID'] = pd.to_numeric(df['ID'], errors='coerce').fillna(0).astype('Int64')
+        df['学習進捗 (Progress)'] = df['学習進捗 (Progress)'].fillna('Not Started')
+        df['例文 (Example)'] = df['例文 (Example)'].fillna('')
+        df = df.dropna(subset=['用語 (Term)', '説明 (Definition)'], how='all') # 両方NaNの行を削除
         
-        # 既存データを全削除 (ID = -1 は存在しないと仮定して、全行を対象)
-        st.sidebar.write(f"DEBUG: Deleting all existing data from table '{table_name}'...")
-        # delete().neq('ID', -1) は、IDが-1でないすべての行を削除するという意図。
-        # SupabaseのPythonクライアントで全削除するには、select('*').execute() でIDを取得してから削除するか、
-        # あるいは RLS を考慮しないなら .delete().gt('ID', 0) などで全行対象にするのが確実。
-        # ここでは一番シンプルな .delete().neq('ID', -1).execute() で行が返されることを期待する
-        # .data が None でないことを確認して、成功を判断する
-        delete_response = supabase.table(table_name).delete().neq('ID', -1).execute() 
+    elif table_name.startswith("test_results_"): # テスト結果シートの場合
+        for col in TEST_RESULTS_HEADERS:
+            if col not in df.columns:
+                df[col] = pd.NA
+        df = df[TEST_RESULTS_HEADERS]
+
+        if 'Date' in df.columns:
+            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+            df = df.dropna(subset=['Date'])
         
-        if delete_response.data is not None or delete_response.count >= 0: # 削除が正常に行われたと判断
-             st.sidebar.write(f"DEBUG: Successfully cleared table '{table_name}'. Deleted {delete_response.count} rows.")
+        if 'Details' in df.columns and not df.empty:
+            def parse_json_safely(json_str):
+                # Supabaseからのデータ(jsonb)は既に辞書/リストの場合もあるため、直接返す
+                if isinstance(json_str, (dict, list)):
+                    return json_str
+                if pd.isna(json_str) or not isinstance(json_str, str) or not json_str.strip():
+                    return []
+                try:
+                    # 文字列の場合はjson.loadsを試みる
+                    return json.loads(json_str)
+                except (json.JSONDecodeError, TypeError):
+                    st.warning(f"テスト結果の詳細データをJSONとしてパースできませんでした: {str(json_str)[:200]}...")
+                    return []
+            df['Details'] = df['Details'].apply(parse_json_safely)
         else:
-            st.warning(f"DEBUG: Could not confirm clearing table '{table_name}'. Response: {delete_response}")
+            df['Details'] = [[] for _ in range(len(df))]
+
+    return order_table_frame(table_name, df)
+
+def order_table_frame(table_name, df):
+    """重複の除去・並べ替えを行い、省メモリな型に揃える"""
+    if table_name.startswith("vocab_"):
+        df = df.drop_duplicates(subset=['用語 (Term)', '説明 (Definition)'], keep='first') # 重複行を削除
+        df = df.sort_values(by='ID').reset_index(drop=True)
+        return compact_vocab_frame(df)
+    if not df.empty:
+        df = df.sort_values(by='Date', ascending=False).reset_index(drop=True)
+    return compact_test_results_frame(df)
+
+
+# --- テーブルのバージョン (書き込みのたびにトリガーで増える番号) と行ごとの変更日時・削除記録 ---
+TABLE_VERSIONS_TABLE = "table_versions"
+CHANGE_CHANNEL = "table_versions" # バージョンが増えるたびに {"table_name": ..., "version": ...} を送る NOTIFY のチャネル
+DELETED_ROWS_TABLE = "deleted_rows" # 削除された行のキー (差分の取り込みで、手元のデータから消す行を知るための記録)
+DELETED_ROWS_RETENTION_DAYS = 7 # 削除記録を残す日数 (これより前に同期したデータは全体を読み込み直す)
+
+# バージョンを1増やし、新しいバージョンを NOTIFY で知らせるトリガー関数 (変更通知の受信スレッドも接続時に同じ定義で更新する)
+BUMP_TABLE_VERSION_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION public.bump_table_version() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER AS $$
+    DECLARE
+        new_version bigint;
+    BEGIN
+        INSERT INTO public."{TABLE_VERSIONS_TABLE}" (table_name, version) VALUES (TG_TABLE_NAME, 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = public."{TABLE_VERSIONS_TABLE}".version + 1
+        RETURNING version INTO new_version;
+        PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object('table_name', TG_TABLE_NAME, 'version', new_version)::text);
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+def table_key_column(table_name):
+    """行を突き合わせる列 (テスト結果は終了日時を行ごとに一意なキーとして使う)"""
+    return 'ID' if table_name.startswith("vocab_") else 'Date'
+
+def sql_identifier(name):
+    """SQLの識別子として埋め込めるように二重引用符で囲む (テーブル名はユーザー名から作るため、引用符を含んでいてもよいようにする)"""
+    return '"' + name.replace('"', '""') + '"'
+
+def sql_literal(value):
+    """SQLの文字列リテラルとして埋め込めるように単一引用符で囲む"""
+    return "'" + value.replace("'", "''") + "'"
+
+def change_tracking_sql(table_name):
+    """
+    table_name への書き込みのたびにバージョンを1増やすトリガーに加えて、行ごとの変更日時 (updated_at) と、
+    削除された行のキーを deleted_rows に残すトリガーを作るSQL (何度実行してもよい)。
+    アプリは行を物理削除・全件の書き直しをするため、削除フラグの列ではなく別テーブルに削除を記録する。
+    """
+    table = sql_identifier(table_name)
+    return f"""
+    CREATE TABLE IF NOT EXISTS public."{TABLE_VERSIONS_TABLE}" (
+        table_name text PRIMARY KEY,
+        version bigint NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS public."{DELETED_ROWS_TABLE}" (
+        table_name text NOT NULL,
+        row_key text NULL, -- NULL はテーブル全体の削除 (TRUNCATE)
+        deleted_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS "{DELETED_ROWS_TABLE}_table_name_deleted_at_idx" ON public."{DELETED_ROWS_TABLE}" (table_name, deleted_at);
+    {BUMP_TABLE_VERSION_FUNCTION_SQL}
+    CREATE OR REPLACE FUNCTION public.touch_updated_at() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        NEW.updated_at := now();
+        RETURN NEW;
+    END;
+    $$;
+    CREATE OR REPLACE FUNCTION public.record_deleted_row() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER AS $$
+    BEGIN
+        IF TG_LEVEL = 'ROW' THEN
+            INSERT INTO public."{DELETED_ROWS_TABLE}" (table_name, row_key) VALUES (TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0]);
+            RETURN OLD;
+        END IF;
+        IF TG_OP = 'TRUNCATE' THEN
+            INSERT INTO public."{DELETED_ROWS_TABLE}" (table_name, row_key) VALUES (TG_TABLE_NAME, NULL);
+        END IF;
+        -- 削除のたびに、保存期間を過ぎた記録を消す
+        DELETE FROM public."{DELETED_ROWS_TABLE}"
+            WHERE table_name = TG_TABLE_NAME AND deleted_at < now() - interval '{DELETED_ROWS_RETENTION_DAYS} days';
+        RETURN NULL;
+    END;
+    $$;
+    ALTER TABLE public.{table} ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+    CREATE INDEX IF NOT EXISTS {sql_identifier(table_name + "_updated_at_idx")} ON public.{table} (updated_at);
+    DROP TRIGGER IF EXISTS touch_updated_at ON public.{table};
+    CREATE TRIGGER touch_updated_at BEFORE INSERT OR UPDATE ON public.{table}
+        FOR EACH ROW EXECUTE FUNCTION public.touch_updated_at();
+    DROP TRIGGER IF EXISTS record_deleted_row ON public.{table};
+    CREATE TRIGGER record_deleted_row AFTER DELETE ON public.{table}
+        FOR EACH ROW EXECUTE FUNCTION public.record_deleted_row('{table_key_column(table_name)}');
+    DROP TRIGGER IF EXISTS purge_deleted_rows ON public.{table};
+    CREATE TRIGGER purge_deleted_rows AFTER DELETE OR TRUNCATE ON public.{table}
+        FOR EACH STATEMENT EXECUTE FUNCTION public.record_deleted_row('{table_key_column(table_name)}');
+    DROP TRIGGER IF EXISTS bump_table_version ON public.{table};
+    CREATE TRIGGER bump_table_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{table}
+        FOR EACH STATEMENT EXECUTE FUNCTION public.bump_table_version();
+    INSERT INTO public."{TABLE_VERSIONS_TABLE}" (table_name, version) VALUES ({sql_literal(table_name)}, 0)
+        ON CONFLICT (table_name) DO NOTHING;
+    """
 
+@st.cache_resource
+def install_change_tracking(table_name):
+    """バージョン・変更日時・削除記録のトリガーをプロセスごとに一度だけ設定する (public.execute_sql 関数が必要)"""
+    try:
+        supabase.rpc("execute_sql", {'sql_query': change_tracking_sql(table_name)}).execute()
+        return True
+    except Exception:
+        return False
 
-        # 新しいデータを挿入
-        st.sidebar.write(f"DEBUG: Inserting {len(data_to_upsert)} rows into table '{table_name}'...")
-        insert_response = supabase.table(table_name).insert(data_to_upsert).execute()
-        
-        if insert_response.data: # 挿入されたデータが返されれば成功
-            st.cache_data.clear() # キャッシュをクリアして、次回の読み込みで最新データを取得させる
-            st.sidebar.write(f"DEBUG: Data successfully written to Supabase table '{table_name}'.")
+def read_table_version(table_name):
+    response = supabase.table(TABLE_VERSIONS_TABLE).select('version').eq('table_name', table_name).execute()
+    return int(response.data[0]['version']) if response.data else None
+
+def fetch_table_version(table_name):
+    """テーブルのバージョンを1行だけの問い合わせで返す。バージョンを管理できない場合は None (常にテーブル全体を読み込む)"""
+    try:
+        try:
+            version = read_table_version(table_name)
+        except Exception: # table_versions テーブル自体がまだ無い
+            version = None
+        if version is None and install_change_tracking(table_name): # まだバージョン管理していないテーブル
+            version = read_table_version(table_name)
+        return version
+    except Exception as e:
+        logger.warning(f"Could not read the version of table '{table_name}': {e}")
+        return None
+
+
+# --- 前回の同期以降に変更された行だけの取り込み (updated_at と削除記録による差分) ---
+# updated_at はトランザクションの開始時刻のため、遅れてコミットされた行を取りこぼさないように同期済みの日時から少し戻って問い合わせる
+DELTA_OVERLAP_SECONDS = 30
+SYNC_ATTRS = ('synced_at', 'fetched_at') # 取り込んだ行の最新の変更日時 (サーバーの時刻) と、問い合わせた時刻
+
+def latest_timestamp(values):
+    """updated_at・deleted_at の文字列のうち最も新しい日時を ISO 8601 の文字列で返す (無ければ None)"""
+    parsed = pd.to_datetime(pd.Series(list(values), dtype=object), utc=True, errors='coerce', format='ISO8601').dropna()
+    return parsed.max().isoformat() if not parsed.empty else None
+
+def set_sync_watermark(df, synced_at, fetched_at):
+    """次回の差分の起点をDataFrameに記録する。変更日時が分からない (updated_at の列が無い・行が無い) 場合は記録しない"""
+    if synced_at is not None:
+        df.attrs['synced_at'] = synced_at
+        df.attrs['fetched_at'] = fetched_at
+
+def delta_since(df):
+    """差分を問い合わせる起点の日時を返す。同期の記録が無いか、削除記録の保存期間を過ぎている場合は None (全体を読み込む)"""
+    if any(attr not in df.attrs for attr in SYNC_ATTRS):
+        return None
+    if time.time() - df.attrs['fetched_at'] > (DELETED_ROWS_RETENTION_DAYS - 1) * 86400:
+        return None
+    return (pd.Timestamp(df.attrs['synced_at']) - pd.Timedelta(seconds=DELTA_OVERLAP_SECONDS)).isoformat()
+
+def parse_row_keys(table_name, keys):
+    """行のキー (Supabaseの値・削除記録の文字列) を、DataFrameのキー列と比べられる型にする"""
+    keys = pd.Series(list(keys), dtype=object)
+    if table_name.startswith("vocab_"):
+        return pd.to_numeric(keys, errors='coerce').dropna().astype('Int64')
+    return pd.to_datetime(keys, utc=True, errors='coerce', format='ISO8601').dropna()
+
+def apply_table_delta(table_name, base):
+    """
+    以前のスナップショット base に、その同期以降に追加・変更された行を取り込み、削除された行を除いたDataFrameを返す。
+    差分を使えない場合 (同期の記録が無い・保存期間切れ・TRUNCATE された・問い合わせに失敗した) は None (全体を読み込む)
+    """
+    since = delta_since(base)
+    if since is None:
+        return None
+    fetched_at = time.time()
+    try: # どちらも索引を使う小さな問い合わせ
+        deleted = (supabase.table(DELETED_ROWS_TABLE).select('row_key, deleted_at')
+                   .eq('table_name', table_name).gt('deleted_at', since).execute().data or [])
+        if any(row['row_key'] is None for row in deleted): # テーブル全体が消された
+            return None
+        changed = supabase.table(table_name).select('*').gt('updated_at', since).execute().data or []
+    except Exception as e:
+        logger.warning(f"Could not fetch the changes of table '{table_name}': {e}")
+        return None
+
+    # 削除された行と、変更された行の古い内容を除いてから、変更後の行を加える
+    key = table_key_column(table_name)
+    stale_keys = parse_row_keys(table_name, [row['row_key'] for row in deleted] + [row.get(key) for row in changed])
+    parts = [base[~base[key].isin(stale_keys)]]
+    if changed:
+        parts.append(records_to_frame(table_name, changed))
+    parts = [part for part in parts if not part.empty]
+    df = order_table_frame(table_name, pd.concat(parts, ignore_index=True) if parts else base.iloc[0:0].copy())
+
+    synced_at = latest_timestamp([base.attrs['synced_at']] + [row.get('updated_at') for row in changed] + [row['deleted_at'] for row in deleted])
+    set_sync_watermark(df, synced_at, fetched_at)
+    bump_data_version(df)
+    if table_name.startswith("vocab_"):
+        prepare_search_columns(df)
+    logger.debug(f"Merged {len(changed)} changed and {len(deleted)} deleted rows into table '{table_name}' (changes since {since}).")
+    return df
+
+
+# --- ディスク上のスナップショットキャッシュ (Arrow IPC、メモリマップで読み込み) ---
+# サーバーの再起動後も、バージョンが変わっていないテーブルはSupabaseから読み込み直さずにこのファイルを使う
+SNAPSHOT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot_cache")
+
+def disk_snapshot_path(table_name, version):
+    return os.path.join(SNAPSHOT_CACHE_DIR, f"{quote(table_name, safe='')}.{version}.arrow")
+
+def latest_disk_snapshot_version(table_name):
+    """ディスクに残っているスナップショットのうち最新のバージョン (無ければ None)"""
+    prefix = f"{quote(table_name, safe='')}."
+    try:
+        names = os.listdir(SNAPSHOT_CACHE_DIR)
+    except OSError:
+        return None
+    versions = [name[len(prefix):-len('.arrow')] for name in names if name.startswith(prefix) and name.endswith('.arrow')]
+    versions = [int(version) for version in versions if version.isdigit()]
+    return max(versions) if versions else None
+
+def arrow_snapshot_dtype(arrow_type):
+    """文字列は Arrow 文字列のまま、Detailsの list<struct> は列指向のまま (メモリマップ上のデータを参照して) DataFrameにする"""
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return ARROW_STRING_DTYPE
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+def write_disk_snapshot(table_name, version, df):
+    """Supabaseから読み込んだDataFrameを、テーブルとバージョンごとの Arrow IPC ファイルとして保存し、古いバージョンのファイルを消す"""
+    path = disk_snapshot_path(table_name, version)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(SNAPSHOT_CACHE_DIR, exist_ok=True)
+        # 差分の起点 (同期済みの日時) も一緒に保存し、再起動後も変更行だけを取り込めるようにする
+        metadata = {attr: str(df.attrs[attr]) for attr in SYNC_ATTRS if attr in df.attrs}
+        table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(metadata or None)
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, path) # 書き込み途中のファイルを他のプロセスが読まないように、書き終えてから置き換える
+        prefix = f"{quote(table_name, safe='')}."
+        for name in os.listdir(SNAPSHOT_CACHE_DIR):
+            if name.startswith(prefix) and name.endswith('.arrow') and os.path.join(SNAPSHOT_CACHE_DIR, name) != path:
+                os.remove(os.path.join(SNAPSHOT_CACHE_DIR, name))
+    except (OSError, pa.ArrowException, TypeError, ValueError) as e: # キャッシュの保存に失敗しても読み込み自体は続ける
+        logger.warning(f"Could not write the snapshot cache for '{table_name}': {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def read_disk_snapshot(table_name, version):
+    """バージョンが一致するスナップショットのファイルがあればメモリマップで読み込み、読み込み時と同じ型に揃えて返す。無ければ None"""
+    path = disk_snapshot_path(table_name, version)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        df = table.to_pandas(types_mapper=arrow_snapshot_dtype)
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"Could not read the snapshot cache for '{table_name}': {e}")
+        return None
+    if table_name.startswith("vocab_"):
+        df['ID'] = df['ID'].astype('Int64')
+        compact_vocab_frame(df)
+    else:
+        compact_test_results_frame(df)
+    metadata = table.schema.metadata or {}
+    if b'synced_at' in metadata and b'fetched_at' in metadata:
+        set_sync_watermark(df, metadata[b'synced_at'].decode(), float(metadata[b'fetched_at']))
+    bump_data_version(df)
+    if table_name.startswith("vocab_"):
+        prepare_search_columns(df)
+    logger.debug(f"Loaded {len(df)} rows of table '{table_name}' from the snapshot cache (version {version}).")
+    return df
+
+def load_table_snapshot(table_name, version, base=None):
+    """
+    バージョンの一致するディスクのスナップショットがあればそれを使う。無ければ以前のスナップショット
+    (base。無ければディスクに残っている古いバージョン) に変更行だけを取り込み、それもできなければSupabaseから全体を読み込む。
+    結果はディスクに保存する。version は読み込みより先に取得しておく (読み込み中に書き込まれても、次回の確認で読み込み直される)。
+    """
+    if version is None:
+        return load_data_from_supabase(table_name)
+    df = read_disk_snapshot(table_name, version)
+    if df is not None:
+        return df
+    if base is None:
+        disk_version = latest_disk_snapshot_version(table_name)
+        if disk_version is not None and disk_version < version:
+            base = read_disk_snapshot(table_name, disk_version)
+    df = apply_table_delta(table_name, base) if base is not None else None
+    if df is None:
+        df = load_data_from_supabase(table_name)
+        if df.attrs.get('load_error'):
+            return df
+        if 'synced_at' not in df.attrs and not df.empty: # 変更日時の列を追加する前からバージョン管理していたテーブル
+            install_change_tracking(table_name)
+    write_disk_snapshot(table_name, version, df)
+    return df
+
+
+# --- テーブルの変更通知 (プロセス内の全セッションに新しいバージョンを配信する) ---
+# 通知の送り手は、Postgres の NOTIFY を受け取るスレッド (psycopg と secrets の SUPABASE_DB_URL がある場合) と、このプロセスでの書き込み
+LISTENER_RECONNECT_SECONDS = 5 # 通知の受信が切れたときに再接続するまでの時間
+NOTIFIED_CHECK_INTERVAL_SECONDS = 300 # 通知を受信できている間の、念のためのバージョン確認の間隔
+CHANGE_WATCH_SECONDS = 2 # 通知を受信できない間に、通知されたバージョンを画面に反映するまでの間隔 (プロセス内の確認のみで、Supabaseには問い合わせない)
+NOTIFIED_WATCH_SECONDS = 10 # 通知を受信できている間の同じ確認の間隔 (操作の無いページにも通知を反映しつつ、タブごとのやり取りを減らす)
+
+@st.cache_resource
+def get_change_feed():
+    """プロセス内の全セッションで共有する {テーブル名: 通知された最新バージョン}。NOTIFY の受信スレッドもここで一度だけ起動する"""
+    feed = {'lock': threading.Lock(), 'versions': {}, 'listening_since': None}
+    db_url = st.secrets.get("SUPABASE_DB_URL") # 直接接続またはセッションモードのプーラーの接続文字列 (トランザクションモードでは LISTEN できない)
+    if psycopg is not None and db_url:
+        threading.Thread(target=listen_for_changes, args=(feed, db_url), name="table-change-listener", daemon=True).start()
+    return feed
+
+def change_listener_connected():
+    feed = get_change_feed()
+    with feed['lock']:
+        return feed['listening_since'] is not None
+
+def record_table_version(feed, table_name, version):
+    """通知されたバージョンを記録する (古いバージョンの通知が後から届いても戻さない)"""
+    with feed['lock']:
+        if version > feed['versions'].get(table_name, -1):
+            feed['versions'][table_name] = version
+
+def listen_for_changes(feed, db_url):
+    """Postgres の NOTIFY を受け取り続ける。接続が切れている間は、従来どおり一定時間ごとにバージョンを確認する"""
+    while True:
+        try:
+            with psycopg.connect(db_url, autocommit=True) as conn:
+                try: # 変更通知を送る前に作られたトリガー関数を、通知を送る定義に更新する
+                    conn.execute(BUMP_TABLE_VERSION_FUNCTION_SQL)
+                except psycopg.Error as e:
+                    logger.warning(f"Could not update bump_table_version(): {e}")
+                conn.execute(f'LISTEN "{CHANGE_CHANNEL}"')
+                with feed['lock']:
+                    feed['listening_since'] = time.time() # これ以降に確認したスナップショットは、通知が来るまで確認し直さない
+                for notify in conn.notifies():
+                    try:
+                        payload = json.loads(notify.payload)
+                        record_table_version(feed, payload['table_name'], int(payload['version']))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Ignored a malformed notification: {notify.payload!r} ({e})")
+        except Exception as e: # 接続できない・切れた場合も受信スレッドは止めない
+            logger.warning(f"Change listener disconnected: {e}")
+        with feed['lock']:
+            feed['listening_since'] = None
+        time.sleep(LISTENER_RECONNECT_SECONDS)
+
+def notified_table_version(table_name):
+    """通知されたテーブルの最新バージョン (通知が無ければ None)"""
+    feed = get_change_feed()
+    with feed['lock']:
+        return feed['versions'].get(table_name)
+
+def snapshot_check_interval(latest):
+    """通知を受信できている間に確認したスナップショットは、通知が来るまで確認し直さない (念のため長い間隔では確認する)"""
+    feed = get_change_feed()
+    with feed['lock']:
+        listening_since = feed['listening_since']
+    if listening_since is not None and latest['checked_at'] >= listening_since:
+        return NOTIFIED_CHECK_INTERVAL_SECONDS
+    return VERSION_CHECK_INTERVAL_SECONDS
+
+def newer_notified_versions():
+    """表示中のスナップショットより新しいバージョンが通知されたテーブルの {テーブル名: 通知されたバージョン}"""
+    table_versions = get_snapshot_store()['table_versions']
+    newer = {}
+    for ref in st.session_state.snapshot_refs.values():
+        shown_version = table_versions.get(ref)
+        notified_version = notified_table_version(ref[0])
+        if shown_version is not None and notified_version is not None and notified_version > shown_version:
+            newer[ref[0]] = notified_version
+    return newer
+
+def refresh_on_table_changes():
+    """表示中のテーブルに新しいバージョンが通知されたら、アプリ全体を再実行して他のタブ・端末での変更を表示する"""
+    # テストの回答中とデータ管理の編集中は、入力途中の内容を消さないように画面を作り直さない
+    if st.session_state.test_mode.get('active') or st.session_state.current_page == "データ管理":
+        return
+    rerun_for = st.session_state.setdefault('rerun_for_versions', {}) # 同じ通知で再実行を繰り返さないように記録する
+    for table_name, notified_version in newer_notified_versions().items():
+        if rerun_for.get(table_name) != notified_version:
+            rerun_for[table_name] = notified_version
+            st.rerun()
+
+def watch_table_changes():
+    """
+    画面の側から定期的に refresh_on_table_changes を実行し、操作の無いページにも他のタブ・端末での変更を表示する。
+    確認するのはプロセス内で通知されたバージョンだけ。通知を受信できている間は、表示より新しいバージョンが通知されるまで間隔を長くする
+    """
+    run_every = CHANGE_WATCH_SECONDS if not change_listener_connected() or newer_notified_versions() else NOTIFIED_WATCH_SECONDS
+    st.fragment(run_every=run_every)(refresh_on_table_changes)()
+
+
+# --- セッション間で共有する読み取り専用スナップショット ---
+VERSION_CHECK_INTERVAL_SECONDS = 5 # 変更通知を受信できないときに、テーブルのバージョンを確認し直すまでの時間 (確認は1行だけの問い合わせ)
+SNAPSHOT_TTL_SECONDS = 60 # バージョンを管理できないテーブルで、最新スナップショットを再取得せずに使い回す時間
+SNAPSHOT_VERSIONS_KEPT = 3 # テーブルごとに保持するバージョン数 (古い参照を持つセッション用)
+SNAPSHOT_IDLE_SECONDS = 1800 # この時間どのセッションからも使われなかったテーブルのスナップショットはメモリから破棄する (ディスクには残る)
+SNAPSHOT_TABLES_KEPT = 50 # スナップショットを保持するテーブル数の上限 (超えた分は使われたのが古いテーブルから破棄する)
+
+@st.cache_resource
+def get_snapshot_store():
+    """プロセス内の全セッションで共有する {(テーブル名, バージョン): DataFrame} のストア"""
+    return {'lock': threading.Lock(), 'snapshots': {}, 'table_versions': {}, 'latest': {}, 'loading': {}, 'untracked': set(), 'used_at': {}}
+
+def touch_snapshot(store, table_name):
+    """テーブルを使った時刻を記録し、しばらく使われていないテーブルのスナップショットを破棄する (store['lock'] を持った状態で呼ぶ)
+    破棄した参照を持つセッションは、次に get_session_frame を呼んだときに最新を読み込み直す"""
+    now = time.time()
+    store['used_at'].pop(table_name, None)
+    store['used_at'][table_name] = now # 使われた順に並べ直すので、破棄するテーブルは先頭から見ればよい
+    while store['used_at']:
+        oldest_table, used_at = next(iter(store['used_at'].items()))
+        if now - used_at <= SNAPSHOT_IDLE_SECONDS and len(store['used_at']) <= SNAPSHOT_TABLES_KEPT:
+            break
+        del store['used_at'][oldest_table]
+        store['latest'].pop(oldest_table, None)
+        store['untracked'].discard(oldest_table)
+        for stale_ref in [key for key in store['snapshots'] if key[0] == oldest_table]:
+            del store['snapshots'][stale_ref]
+            store['table_versions'].pop(stale_ref, None)
+
+def publish_snapshot(table_name, df, table_version=None):
+    """DataFrameを共有スナップショットとして登録し、参照 (テーブル名, バージョン) を返す
+    登録したDataFrameは読み取り専用として扱い、変更する場合は必ずコピーしてから行う (コピーオンライト)
+    table_version は df が対応するテーブルのバージョン (不明なら None。次回の確認で読み込み直される)"""
+    store = get_snapshot_store()
+    ref = (table_name, get_data_version(df))
+    with store['lock']:
+        store['snapshots'][ref] = df
+        store['table_versions'][ref] = table_version
+        store['latest'][table_name] = {'ref': ref, 'table_version': table_version, 'checked_at': time.time()}
+        table_refs = [key for key in store['snapshots'] if key[0] == table_name]
+        for stale_ref in table_refs[:-SNAPSHOT_VERSIONS_KEPT]:
+            del store['snapshots'][stale_ref]
+            store['table_versions'].pop(stale_ref, None)
+    return ref
+
+def unchecked_snapshot_ref(store, table_name):
+    """バージョンを確認し直すまでの間は、最新スナップショットへの参照をそのまま返す (確認が必要なら None)"""
+    latest = store['latest'].get(table_name)
+    if latest is None or latest['ref'] not in store['snapshots']:
+        return None
+    if table_name in store['untracked']:
+        interval = SNAPSHOT_TTL_SECONDS
+    else:
+        notified_version = notified_table_version(table_name)
+        if notified_version is not None and (latest['table_version'] is None or notified_version > latest['table_version']):
+            return None # 新しいバージョンが通知されていれば、間隔を待たずに読み込み直す
+        interval = snapshot_check_interval(latest)
+    return latest['ref'] if time.time() - latest['checked_at'] < interval else None
+
+def load_shared_snapshot(table_name):
+    """最新スナップショットへの参照を返す。テーブルのバージョンを確かめ、変わっていた場合だけ読み込み直す (load_table_snapshot)"""
+    store = get_snapshot_store()
+    with store['lock']:
+        touch_snapshot(store, table_name)
+        ref = unchecked_snapshot_ref(store, table_name)
+        if ref is not None:
+            return ref
+        table_lock = store['loading'].setdefault(table_name, threading.Lock())
+    # 同じテーブルの確認・読み込みは1つのセッションだけが行い、待っていたセッションはその結果を使う (再起動直後のアクセス集中対策)
+    with table_lock:
+        with store['lock']:
+            ref = unchecked_snapshot_ref(store, table_name)
+        if ref is not None:
+            return ref
+        table_version = fetch_table_version(table_name)
+        with store['lock']:
+            if table_version is None: # バージョンを管理できないテーブルは従来どおり一定時間ごとに読み込み直す
+                store['untracked'].add(table_name)
+            else:
+                store['untracked'].discard(table_name)
+            latest = store['latest'].get(table_name)
+            if (table_version is not None and latest is not None and latest['table_version'] == table_version
+                    and latest['ref'] in store['snapshots']):
+                latest['checked_at'] = time.time() # 変わっていなければ同じスナップショットを使い続ける
+                return latest['ref']
+            # 変わっていれば、最新スナップショットに変更行だけを取り込む
+            base = store['snapshots'].get(latest['ref']) if table_version is not None and latest is not None else None
+        return publish_snapshot(table_name, load_table_snapshot(table_name, table_version, base), table_version)
+
+def invalidate_shared_snapshots():
+    """次回の読み込みでSupabaseから最新データを取得させる"""
+    store = get_snapshot_store()
+    with store['lock']:
+        store['latest'].clear()
+
+def get_session_frame(kind, headers):
+    """セッションが参照している共有スナップショットを返す (コピーしない)"""
+    ref = st.session_state.snapshot_refs.get(kind)
+    if ref is None:
+        return pd.DataFrame(columns=headers)
+    df = get_snapshot_store()['snapshots'].get(ref)
+    if df is None: # 参照していたバージョンが破棄済みなら最新を読み込み直す
+        ref = load_shared_snapshot(ref[0])
+        st.session_state.snapshot_refs[kind] = ref
+        df = get_snapshot_store()['snapshots'][ref]
+    return df
+
+def set_session_frame(kind, table_name, df):
+    """セッションで編集したDataFrameを新しいバージョンとして共有し、その参照に切り替える"""
+    if kind == 'df_test_results': # 追加・編集で通常の列に戻った部分も省メモリな型に揃える
+        # Supabaseから読み込んだ日時はタイムゾーン付きのため、セッションで追加した行の日時もUTCに揃える
+        df['Date'] = pd.to_datetime(df['Date'], utc=True)
+        compact_test_results_frame(df)
+    else:
+        compact_vocab_frame(df)
+        prepare_search_columns(df)
+    # このセッションの書き込みだけを反映したデータなら、書き込み後のテーブルのバージョンを付けて共有する
+    table_version = st.session_state.setdefault('written_table_versions', {}).pop(table_name, None)
+    # 書き込みが確認できた場合は、元のスナップショットにその書き込みを加えただけなので元の差分の起点を引き継ぐ
+    # (確認できない場合は次回の確認で全体を読み込み直し、書き込めなかった変更が残らないようにする)
+    previous = get_snapshot_store()['snapshots'].get(st.session_state.snapshot_refs.get(kind))
+    if table_version is None:
+        for attr in SYNC_ATTRS:
+            df.attrs.pop(attr, None)
+    elif previous is not None:
+        df.attrs.update({attr: previous.attrs[attr] for attr in SYNC_ATTRS if attr in previous.attrs})
+    st.session_state.snapshot_refs[kind] = publish_snapshot(table_name, df, table_version)
+
+
+# --- 書き込みの前後でのテーブルのバージョンの確認 ---
+# バージョンはトリガーの種類ごとに文1つにつき1増える。upsert (INSERT ... ON CONFLICT DO UPDATE) は、
+# 衝突した行が無くても INSERT と UPDATE の両方の文トリガーを起動するため2増える
+UPSERT_STATEMENTS = 2
+
+def expected_table_version(table_name):
+    """このセッションのデータが対応しているテーブルのバージョン (このセッションの書き込みを含む。不明なら None)"""
+    written = st.session_state.setdefault('written_table_versions', {})
+    if table_name in written:
+        return written[table_name]
+    refs = [ref for ref in st.session_state.snapshot_refs.values() if ref[0] == table_name]
+    return get_snapshot_store()['table_versions'].get(refs[0]) if refs else None
+
+def begin_tracked_write(table_name, overwrite=True):
+    """
+    (書き込んでよいか, 書き込み前のテーブルのバージョン) を返す。
+    このセッションのデータ以降に他から書き込まれていた場合、overwrite (既存の行を書き換える・消す書き込み) なら
+    古いデータで他の変更を上書きしないように書き込みを中止させ、最新のデータを読み込み直させる。
+    行の追加だけなら書き込みを続け、バージョンは None (不明) を返す。
+    書き込み待ちの行を書き込めなかった場合は、エラーを表示して書き込みを中止させる
+    """
+    # 書き込み待ちの行を先に書き込み、後から古い内容で上書きしないようにする
+    queued_rows, _, _ = write_queue_status(table_name)
+    if not flush_write_queue(get_write_queues(), table_name):
+        _, _, error = write_queue_status(table_name)
+        st.error(f"書き込み待ちの用語をSupabaseに書き込めなかったため、保存を中止しました。しばらくしてからもう一度お試しください。エラー: {error}")
+        return False, None
+    expected = expected_table_version(table_name)
+    if expected is not None and queued_rows: # 書き込み待ちの行はこのセッションにも表示しているので、その upsert の分を見込む
+        expected += UPSERT_STATEMENTS
+    version_before = fetch_table_version(table_name) if expected is not None else None
+    if version_before is not None and version_before != expected:
+        record_table_version(get_change_feed(), table_name, version_before) # 次の再実行で最新のデータを読み込む (他のセッションも)
+        if overwrite:
+            st.warning("他のタブ・端末でデータが更新されたため、古いデータで上書きしないように保存を中止しました。最新のデータを読み込み直しますので、もう一度操作してください。")
+            return False, None
+        version_before = None
+    st.session_state.written_table_versions[table_name] = None # 書き込みに失敗した場合はバージョン不明のままにする
+    return True, version_before
+
+def end_tracked_write(table_name, version_before, statements):
+    """書き込み後のバージョンが「書き込み前 + 実行した文の数」なら、間に他からの書き込みは無いので記録する"""
+    if version_before is None:
+        return
+    version_after = fetch_table_version(table_name)
+    if version_after is not None: # このプロセスの他のセッションにも書き込みを知らせる (NOTIFY を受信できない場合の代わり)
+        record_table_version(get_change_feed(), table_name, version_after)
+    if version_after == version_before + statements:
+        st.session_state.written_table_versions[table_name] = version_after
+
+def changed_since_session_frame(table_name):
+    """
+    このセッションのデータを読み込んだ後に、他のタブ・端末からテーブルに書き込まれていれば True。
+    セッションのデータを元に書き込む内容を作る前に確かめ、最新のデータから作り直せるようにする (通知を受信できていれば問い合わせない)
+    """
+    expected = expected_table_version(table_name)
+    if expected is None:
+        return False
+    latest = get_snapshot_store()['latest'].get(table_name)
+    if latest is not None and latest['table_version'] == expected and snapshot_check_interval(latest) == NOTIFIED_CHECK_INTERVAL_SECONDS:
+        current_version = notified_table_version(table_name)
+    else:
+        current_version = fetch_table_version(table_name)
+        if current_version is not None: # 書き込まれていれば、他のセッションも次の再実行で最新のデータを読み込む
+            record_table_version(get_change_feed(), table_name, current_version)
+    return current_version is not None and current_version > expected
+
+
+# --- 変更行だけをSupabaseに書き込む関数 ---
+def dataframe_to_records(df):
+    """pd.NA/NaN を None に変換し、Supabaseに送れる辞書のリストにする"""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def upsert_rows_to_supabase(df_rows, table_name):
+    try:
+        if df_rows.empty:
             return True
-        else:
-            st.error(f"Supabaseへの書き込み中にエラーが発生しました。レスポンス: {insert_response}")
-            st.sidebar.write(f"DEBUG: Supabase Write Error Response: {insert_response}")
+        logger.debug(f"Upserting {len(df_rows)} rows into table '{table_name}'...")
+        can_write, version_before = begin_tracked_write(table_name)
+        if not can_write:
             return False
+        upsert_response = supabase.table(table_name).upsert(dataframe_to_records(df_rows)).execute()
+        if upsert_response.data:
+            end_tracked_write(table_name, version_before, UPSERT_STATEMENTS)
+            st.cache_data.clear()
+            return True
+        st.error(f"Supabaseへの書き込み中にエラーが発生しました。レスポンス: {upsert_response}")
+        return False
+    except Exception as e:
+        st.error(f"Supabaseへのデータの書き込み中に予期せぬエラーが発生しました: {e}")
+        st.exception(e)
+        return False
 
+def rows_to_send(df_rows):
+    """Detailsを辞書のリストに、日時をJSONで送れる ISO 8601 の文字列にして (タイムゾーンの無い日時はUTCとして扱う)、送る行の辞書のリストにする"""
+    df_to_send = df_rows
+    if 'Details' in df_rows.columns:
+        df_to_send = df_to_send.assign(Details=decode_details_column(df_rows['Details']))
+    if 'Date' in df_rows.columns:
+        df_to_send = df_to_send.assign(Date=pd.to_datetime(df_rows['Date'], utc=True).map(pd.Timestamp.isoformat))
+    return dataframe_to_records(df_to_send)
+
+def insert_rows_to_supabase(df_rows, table_name):
+    """新しい行だけを追加する (テスト結果の保存など。テーブル全体は書き直さない)"""
+    try:
+        if df_rows.empty:
+            return True
+        logger.debug(f"Inserting {len(df_rows)} rows into table '{table_name}'...")
+        can_write, version_before = begin_tracked_write(table_name, overwrite=False)
+        if not can_write:
+            return False
+        insert_response = supabase.table(table_name).insert(rows_to_send(df_rows)).execute()
+        if insert_response.data:
+            end_tracked_write(table_name, version_before, 1)
+            st.cache_data.clear()
+            return True
+        st.error(f"Supabaseへの書き込み中にエラーが発生しました。レスポンス: {insert_response}")
+        return False
     except Exception as e:
         st.error(f"Supabaseへのデータの書き込み中に予期せぬエラーが発生しました: {e}")
         st.exception(e)
-        st.sidebar.write(f"DEBUG: Unexpected Supabase Write Error: {e}")
         return False
 
+def import_test_results_to_supabase(df_rows, table_name, overwrite):
+    """
+    インポートしたテスト結果を IMPORT_BATCH_ROWS 行ずつ追加する。overwrite の場合は先に既存の結果を全て削除する。
+    書き込み前後のバージョンの確認とキャッシュのクリアは、インポート全体で1回だけ行う。
+    """
+    can_write, version_before = begin_tracked_write(table_name, overwrite=overwrite)
+    if not can_write:
+        return False
+    statements = 0
+    try:
+        if overwrite:
+            # テスト結果のテーブルにはID列が無いため、Date で全行を対象にする (Date が空の行も含める)
+            logger.debug(f"Deleting all existing data from table '{table_name}'...")
+            supabase.table(table_name).delete().or_('Date.is.null,Date.not.is.null').execute()
+            statements += 1
+        logger.debug(f"Inserting {len(df_rows)} rows into table '{table_name}' in batches of {IMPORT_BATCH_ROWS}...")
+        for batch_start in range(0, len(df_rows), IMPORT_BATCH_ROWS):
+            insert_response = supabase.table(table_name).insert(rows_to_send(df_rows.iloc[batch_start:batch_start + IMPORT_BATCH_ROWS])).execute()
+            statements += 1
+            if not insert_response.data:
+                st.error(f"Supabaseへの書き込み中にエラーが発生しました。レスポンス: {insert_response}")
+                return False
+    except Exception as e:
+        st.error(f"Supabaseへのデータの書き込み中に予期せぬエラーが発生しました: {e}")
+        st.exception(e)
+        return False
+    finally:
+        if statements:
+            st.cache_data.clear()
+    end_tracked_write(table_name, version_before, statements)
+    return True
+
+def delete_rows_from_supabase(ids, table_name):
+    try:
+        if not ids:
+            return True
+        logger.debug(f"Deleting {len(ids)} rows from table '{table_name}'...")
+        can_write, version_before = begin_tracked_write(table_name)
+        if not can_write:
+            return False
+        supabase.table(table_name).delete().in_('ID', ids).execute()
+        end_tracked_write(table_name, version_before, 1)
+        st.cache_data.clear()
+        return True
+    except Exception as e:
+        st.error(f"Supabaseからのデータの削除中に予期せぬエラーが発生しました: {e}")
+        st.exception(e)
+        return False
+
+
+# --- 書き込み待ちのキュー (続けて追加した用語を短い間隔でまとめて1回の upsert にする) ---
+# 書き込みはバックグラウンドのタイマーで行うので、追加後にページを閉じても書き込まれる (プロセスの終了時にも書き込む)
+WRITE_COALESCE_SECONDS = 3 # 最後の追加からこの時間、次の追加が無ければまとめて書き込む
+WRITE_COALESCE_MAX_SECONDS = 15 # 追加が続いても、最初の追加からこの時間で書き込む
+WRITE_RETRY_SECONDS = 10 # 書き込みに失敗したときに再試行するまでの時間
+
+@st.cache_resource
+def get_write_queues():
+    """プロセス内で共有する、テーブル (ユーザー) ごとの書き込み待ちの行。同じユーザーの別のタブも同じキューを使う"""
+    queues = {'lock': threading.Lock(), 'tables': {}, 'feed': get_change_feed()}
+    atexit.register(flush_all_write_queues, queues)
+    return queues
+
+def get_write_queue(queues, table_name):
+    return queues['tables'].setdefault(table_name, {
+        'rows': OrderedDict(), 'generation': 0, 'first_queued_at': None, 'timer': None,
+        'flush_lock': threading.Lock(), 'error': None, 'last_id': 0
+    })
+
+def schedule_flush(queues, table_name, delay):
+    """書き込みのタイマーを設定し直す (queues['lock'] を持った状態で呼ぶ)"""
+    queue = get_write_queue(queues, table_name)
+    if queue['timer'] is not None:
+        queue['timer'].cancel()
+    queue['timer'] = threading.Timer(max(delay, 0), flush_write_queue, args=(queues, table_name))
+    queue['timer'].daemon = True
+    queue['timer'].start()
+
+def enqueue_new_row(table_name, row, min_id):
+    """新しい行を書き込み待ちにして、割り当てたIDを返す (IDは min_id 以上で、他のタブの書き込み待ちの行とも重ならない)"""
+    queues = get_write_queues()
+    with queues['lock']:
+        queue = get_write_queue(queues, table_name)
+        # 書き込み済みでまだスナップショットに取り込まれていない行とも重ならないように、割り当てた最大のIDも使う
+        new_id = max(int(min_id), queue['last_id'] + 1)
+        queue['last_id'] = new_id
+        queue['rows'][new_id] = dict(row, ID=new_id)
+        queue['generation'] += 1
+        now = time.time()
+        if queue['first_queued_at'] is None:
+            queue['first_queued_at'] = now
+        schedule_flush(queues, table_name, min(WRITE_COALESCE_SECONDS, queue['first_queued_at'] + WRITE_COALESCE_MAX_SECONDS - now))
+    return new_id
+
+def flush_write_queue(queues, table_name):
+    """
+    書き込み待ちの行を1回の upsert でまとめて書き込む。タイマーのスレッド・ログアウト時・同じテーブルへの他の書き込みの前に呼ぶ。
+    書き込めなかった行は待ちに残して再試行する。書き込み待ちが残っていれば False
+    """
+    queue = queues['tables'].get(table_name)
+    if queue is None:
+        return True
+    with queue['flush_lock']: # タイマーとセッションから同時に書き込まない
+        with queues['lock']:
+            rows = list(queue['rows'].values())
+            if queue['timer'] is not None:
+                queue['timer'].cancel()
+                queue['timer'] = None
+        if not rows:
+            return True
+        try:
+            supabase.table(table_name).upsert(rows).execute()
+        except Exception as e:
+            with queues['lock']:
+                queue['error'] = str(e)
+                schedule_flush(queues, table_name, WRITE_RETRY_SECONDS)
+            return False
+        with queues['lock']:
+            for row in rows:
+                if queue['rows'].get(row['ID']) is row: # 書き込み中に同じIDで追加し直された行は次回に書き込む
+                    del queue['rows'][row['ID']]
+            queue['generation'] += 1
+            queue['error'] = None
+            queue['first_queued_at'] = time.time() if queue['rows'] else None
+    try:
+        version = read_table_version(table_name)
+    except Exception:
+        version = None
+    if version is not None: # 全セッションに知らせ、次の再実行で書き込んだ行を差分として取り込ませる
+        record_table_version(queues['feed'], table_name, version)
+    return True
+
+def flush_all_write_queues(queues):
+    for table_name in list(queues['tables']):
+        flush_write_queue(queues, table_name)
+
+def write_queue_status(table_name):
+    """(書き込み待ちの行の辞書のリスト, 待ちが変わるたびに増える番号, 直近の書き込みエラー) を返す"""
+    queues = get_write_queues()
+    with queues['lock']:
+        queue = queues['tables'].get(table_name)
+        if queue is None:
+            return [], 0, None
+        return list(queue['rows'].values()), queue['generation'], queue['error']
+
+def with_pending_rows(df, table_name):
+    """書き込み待ちの用語を末尾に加えたDataFrameを返す (待ちが無ければ df のまま)。結果は待ちが変わるまでセッションに保持する"""
+    rows, generation, _ = write_queue_status(table_name)
+    cache = st.session_state.setdefault('pending_row_frames', {})
+    if not rows:
+        cache.pop(table_name, None)
+        return df
+    key = (get_data_version(df), generation)
+    if table_name in cache and cache[table_name][0] == key:
+        return cache[table_name][1]
+    pending = pd.DataFrame(rows, columns=VOCAB_HEADERS).astype({'ID': 'Int64'})
+    pending = pending[~pending['ID'].isin(df['ID'])] # 書き込み後にスナップショットへ取り込まれた行は除く
+    merged = df
+    if not pending.empty:
+        merged = pd.concat([df, pending], ignore_index=True) if not df.empty else pending.reset_index(drop=True)
+        compact_vocab_frame(merged)
+        bump_data_version(merged)
+        prepare_search_columns(merged)
+        carry_filter_index(df, merged, appended_from=len(df))
+    cache[table_name] = (key, merged)
+    return merged
+
+
+# --- テスト結果のParquet・Arrow IPC インポート (日時は読み込み時と同じくUTCに揃える) ---
+def read_test_results_import(uploaded_file):
+    """テスト結果のファイルを読み込み、TEST_RESULTS_HEADERS の列と読み込み時と同じ型に揃える (Detailsは辞書のリストに戻す)"""
+    df = read_arrow_import(uploaded_file, TEST_RESULTS_ARROW_CHECKS, required_cols=TEST_RESULTS_HEADERS)[TEST_RESULTS_HEADERS]
+    df['Date'] = pd.to_datetime(df['Date'], utc=True) # 読み込み時と同じくUTCに揃える
+    df['Details'] = decode_details_column(df['Details'])
+    return df.dropna(subset=['Date'])
+
+
+# --- データ管理 ---
+DATA_EDITOR_PAGE_SIZE = 100 # データ管理のエディタで一度に編集する行数
+
+
+# --- 分割インポートのバッチ書き込み (チェックポイントの位置から再開する) ---
+IMPORT_BATCH_ROWS = 500 # 1回のリクエストでSupabaseに書き込む行数 (リクエストサイズの上限対策)
+
+
+def run_chunked_import(uploaded_file, table_name, checkpoint, import_ids, skip_positions, total_rows, progress_bar):
+    """
+    ファイルをチャンクごとに読み込み直し、import_ids (get_import_preview で決めたID) の行を IMPORT_BATCH_ROWS 行ずつ書き込む。
+    バッチを書き込むたびにチェックポイントを進める。書き込みはIDでのupsertなので、再開時に同じ行を送っても重複しない。
+    書き込み前後のバージョンの確認とキャッシュのクリアは、バッチごとではなくインポート全体で1回だけ行う。
+    """
+    can_write, version_before = begin_tracked_write(table_name)
+    if not can_write:
+        return False
+    statements = 0 # 実行した文の数 (書き込み後のバージョンと突き合わせる)
+    try:
+        if not checkpoint['cleared']:
+            logger.debug(f"Deleting all existing data from table '{table_name}'...")
+            supabase.table(table_name).delete().neq('ID', -1).execute()
+            statements += 1
+            checkpoint['cleared'] = True
+        skip = pd.Index(skip_positions)
+        logger.debug(f"Upserting rows into table '{table_name}' in batches of {IMPORT_BATCH_ROWS}...")
+        for raw_chunk in iter_import_chunks(uploaded_file):
+            chunk_end = raw_chunk.index.max() + 1 if len(raw_chunk) else checkpoint['rows_done']
+            if chunk_end <= checkpoint['rows_done']: # 前回までに処理済みのチャンク
+                continue
+            chunk = normalize_import_chunk(raw_chunk)
+            for batch_start in range(max(raw_chunk.index.min(), checkpoint['rows_done']), chunk_end, IMPORT_BATCH_ROWS):
+                batch_end = min(batch_start + IMPORT_BATCH_ROWS, chunk_end)
+                batch = chunk[(chunk.index >= batch_start) & (chunk.index < batch_end) & ~chunk.index.isin(skip)]
+                ids = import_ids[batch.index.to_numpy(dtype=np.int64)]
+                batch = batch[ids > 0].assign(ID=pd.array(ids[ids > 0], dtype='Int64')) # ID 0 は完全一致の重複
+                if not batch.empty:
+                    upsert_response = supabase.table(table_name).upsert(dataframe_to_records(batch)).execute()
+                    statements += UPSERT_STATEMENTS
+                    if not upsert_response.data:
+                        st.error(f"Supabaseへの書き込み中にエラーが発生しました。レスポンス: {upsert_response}")
+                        return False
+                checkpoint['skipped'] += (batch_end - batch_start) - len(batch)
+                checkpoint['inserted'] += len(batch)
+                checkpoint['rows_done'] = batch_end
+                progress_bar.progress(min(batch_end / max(total_rows, 1), 1.0), text=f"{batch_end} / {total_rows} 行を処理しました")
+    finally:
+        if statements:
+            st.cache_data.clear()
+    # 途中で失敗した場合はバージョン不明のままにし、次回の確認でテーブル全体を読み込み直す
+    end_tracked_write(table_name, version_before, statements)
+    return True
+
+
+# --- ページ遷移 ---
+def go_to_page(page_name):
+    st.session_state.current_page = page_name
+    st.rerun()
+
+
+# --- 再実行時間の計測 (プロファイリング) ---
+RERUN_TIMING_HISTORY = 50
+
+def record_rerun_timing(scope, elapsed_seconds):
+    """'full' (アプリ全体) / 'fragment' (フラグメントのみ) ごとに再実行時間を記録する"""
+    timings = st.session_state.setdefault('rerun_timings', {'full': [], 'fragment': []})
+    timings.setdefault(scope, []).append(elapsed_seconds * 1000)
+    del timings[scope][:-RERUN_TIMING_HISTORY]
+
+def average_rerun_timing(scope):
+    samples = st.session_state.get('rerun_timings', {}).get(scope, [])
+    return sum(samples) / len(samples) if samples else None
+
+def format_rerun_timing_caption():
+    full_avg = average_rerun_timing('full')
+    fragment_avg = average_rerun_timing('fragment')
+    fragment_text = f"{fragment_avg:.1f} ms" if fragment_avg is not None else "-"
+    full_text = f"{full_avg:.1f} ms" if full_avg is not None else "-"
+    return f"⏱ 再実行時間の平均: フラグメント {fragment_text} / アプリ全体 {full_text}"
+
+def render_profiling_panel():
+    with st.sidebar.expander("⏱ プロファイリング"):
+        timings = st.session_state.get('rerun_timings', {})
+        for scope, label in [('full', 'アプリ全体の再実行'), ('fragment', 'テスト (フラグメント) の再実行')]:
+            samples = timings.get(scope, [])
+            if samples:
+                st.write(f"{label}: 平均 {sum(samples) / len(samples):.1f} ms / 直近 {samples[-1]:.1f} ms ({len(samples)} 回)")
+            else:
+                st.write(f"{label}: 計測なし")
+        st.write(format_filter_cache_stats())
+
+
+# --- テストモード関連関数 ---
+def start_new_test(df_vocab):
+    test_settings = st.session_state.test_mode
+
+    # 選択されたカテゴリでフィルタリング
+    # 共有スナップショットはコピーせず、そのまま (または絞り込み結果を) 読み取り専用で使う
+    if test_settings['selected_category'] == '全カテゴリ':
+        available_vocab = df_vocab
+    else:
+        available_vocab = filter_frame(df_vocab, {'カテゴリ (Category)': test_settings['selected_category']})
+
+    if available_vocab.empty or len(available_vocab) < test_settings['question_count']:
+        st.error("選択された条件で十分な問題を作成できませんでした。カテゴリや問題数を見直してください。")
+        st.session_state.test_mode['active'] = False
+        return
+
+    # 出題元に基づくフィルタリングと選択
+    if test_settings['question_source'] == 'learning_focus':
+        # 誤答率・最終出題日・学習進捗から重みを計算し、エイリアス法で重複なしに抽選
+        weights, alias_table = get_sampling_table(
+            df_vocab, available_vocab, get_session_frame('df_test_results', TEST_RESULTS_HEADERS), test_settings['selected_category'])
+        positions = weighted_sample_without_replacement(weights, test_settings['question_count'], alias_table)
+        selected_questions_df = available_vocab.iloc[positions]
+    else: # 'random_all'
+        selected_questions_df = available_vocab.sample(n=test_settings['question_count'], random_state=random.randint(0, 10000))
+
+    questions = []
+    for index, row in selected_questions_df.iterrows():
+        correct_answer = ""
+        question_text = ""
+        if test_settings['test_type'] == 'term_to_def':
+            question_text = f"用語: **{row['用語 (Term)']}** の説明として正しいものを選びなさい。"
+            plain_question_text = f"用語: {row['用語 (Term)']} の説明として正しいものを選びなさい。"
+            correct_answer = row['説明 (Definition)']
+            options_pool = available_vocab['説明 (Definition)'].tolist()
+        elif test_settings['test_type'] == 'example_to_term':
+            if pd.isna(row['例文 (Example)']) or row['例文 (Example)'] == '':
+                # 例文がない場合はスキップするか、他の形式にフォールバック
+                continue 
+            question_text = f"例文: 「*{row['例文 (Example)']}*」 が示す用語として正しいものを選びなさい。"
+            plain_question_text = f"例文: 「{row['例文 (Example)']}」 が示す用語として正しいものを選びなさい。"
+            correct_answer = row['用語 (Term)']
+            options_pool = available_vocab['用語 (Term)'].tolist()
+        
+        # 選択肢を作成 (正解と異なるダミー選択肢を3つ追加)
+        options = [correct_answer]
+        dummy_options = [opt for opt in options_pool if opt != correct_answer]
+        options.extend(random.sample(dummy_options, min(3, len(dummy_options))))
+        random.shuffle(options)
+
+        questions.append({
+            'term_id': row['ID'],
+            'term': row['用語 (Term)'],
+            'definition': row['説明 (Definition)'],
+            'example': row['例文 (Example)'],
+            'category': row['カテゴリ (Category)'],
+            'question_text': question_text,
+            'plain_question_text': plain_question_text, # 一括回答のコンポーネントはMarkdownを表示しないため、強調記号を付けない文面
+            'correct_answer': correct_answer,
+            'options': options
+        })
+    
+    # 選択肢がない問題がスキップされた場合を考慮
+    if not questions:
+        st.error("選択された条件で有効な問題を作成できませんでした。例文が設定されていない用語が含まれている可能性があります。")
+        st.session_state.test_mode['active'] = False
+        return
+
+    st.session_state.test_mode['active'] = True
+    st.session_state.test_mode['current_question_index'] = 0
+    st.session_state.test_mode['questions'] = questions
+    st.session_state.test_mode['answers'] = [None] * len(questions)
+    st.session_state.test_mode['score'] = 0
+    st.session_state.test_mode['detailed_results'] = []
+    st.session_state.test_mode['finished'] = False
+    st.session_state.test_mode['graded'] = False
+    st.session_state.test_mode['test_id'] = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    st.rerun()
+
+
+def run_batched_test():
+    # 問題一式をコンポーネントに一度だけ渡し、ページ送りや選択はブラウザ内で処理する
+    # 正解はブラウザに送らず、回答がまとめて返ってきたときだけ再実行して end_test で採点する
+    test_mode = st.session_state.test_mode
+    client_questions = [
+        {'question_text': q['plain_question_text'], 'choices': q['options']}
+        for q in test_mode['questions']
+    ]
+    submission = batched_quiz(
+        questions=client_questions,
+        test_id=test_mode['test_id'],
+        key=f"batched_quiz_{test_mode['test_id']}",
+        default=None
+    )
+    if submission and submission.get('test_id') == test_mode['test_id']:
+        test_mode['answers'] = list(submission['answers'])
+        test_mode['finished'] = True
+        st.rerun()
+
+
+@st.fragment
+def run_test(df_vocab, current_test_results_table_name):
+    # 回答やページ送りではこのフラグメントだけを再実行し、サイドバーやデータ読み込みは再実行しない
+    fragment_start = time.perf_counter()
+    try:
+        test_mode = st.session_state.test_mode
+        current_question = test_mode['questions'][test_mode['current_question_index']]
+
+        st.subheader(f"問題 {test_mode['current_question_index'] + 1} / {len(test_mode['questions'])}")
+        st.markdown(current_question['question_text'])
+
+        user_answer = st.radio(
+            "回答を選択してください:",
+            current_question['options'],
+            key=f"q_{test_mode['current_question_index']}"
+        )
+        
+        st.session_state.test_mode['answers'][test_mode['current_question_index']] = user_answer
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("前の問題", key="prev_q"):
+                if test_mode['current_question_index'] > 0:
+                    test_mode['current_question_index'] -= 1
+                    st.rerun(scope="fragment")
+        with col2:
+            if st.button("次の問題", key="next_q"):
+                if test_mode['current_question_index'] < len(test_mode['questions']) - 1:
+                    test_mode['current_question_index'] += 1
+                    st.rerun(scope="fragment")
+                else: # 最終問題の次を押したとき
+                    # 採点と保存はサイドバーにも書き込むため、アプリ全体を再実行して end_test で行う
+                    test_mode['finished'] = True
+                    st.rerun()
+
+        st.caption(format_rerun_timing_caption())
+    finally:
+        record_rerun_timing('fragment', time.perf_counter() - fragment_start)
+
+
+def end_test(df_vocab, current_test_results_table_name):
+    test_mode = st.session_state.test_mode
+    if test_mode.get('graded'): # 採点・保存済みの場合は結果表示のみ
+        show_test_finished(test_mode['score'], len(test_mode['questions']), test_mode['detailed_results'])
+        return
+
+    total_score = 0
+    detailed_results = []
+    # 回答中に他のタブ・端末で用語が更新されていれば、最新のデータに学習進捗を反映する (古いデータで他の変更を上書きしない)
+    if changed_since_session_frame(current_vocab_table_name):
+        st.session_state.snapshot_refs['df_vocab'] = load_shared_snapshot(current_vocab_table_name)
+        df_vocab = get_session_frame('df_vocab', VOCAB_HEADERS)
+    df_vocab_before = df_vocab
+    df_vocab = df_vocab.copy() # 共有スナップショットを直接変更しないようにコピーしてから進捗を更新する
+    changed_labels = [] # 学習進捗を更新した行 (絞り込みインデックスの差分更新用)
+
+    for i, question in enumerate(test_mode['questions']):
+        user_answer = test_mode['answers'][i]
+        is_correct = (user_answer == question['correct_answer'])
+        
+        if is_correct:
+            total_score += 1
+            # 学習進捗を更新（正解したらMasteredへ向かう）
+            vocab_idx = df_vocab[df_vocab['ID'] == question['term_id']].index
+            if not vocab_idx.empty:
+                current_progress = df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)']
+                if current_progress == 'Not Started':
+                    df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Learning'
+                    changed_labels.append(vocab_idx[0])
+                elif current_progress == 'Learning':
+                    df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Mastered'
+                    changed_labels.append(vocab_idx[0])
+        else:
+            # 不正解なら学習進捗をLearningに戻す
+            vocab_idx = df_vocab[df_vocab['ID'] == question['term_id']].index
+            if not vocab_idx.empty:
+                df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Learning'
+                changed_labels.append(vocab_idx[0])
+
+        detailed_results.append({
+            'term_id': question['term_id'],
+            'term': question['term'],
+            'definition': question['definition'],
+            'question_text': question['question_text'],
+            'correct_answer': question['correct_answer'],
+            'user_answer': user_answer,
+            'is_correct': is_correct
+        })
+
+    # 学習進捗を更新した行だけを書き込む (他のタブ・端末では変更行だけの小さな取り込みで済む)
+    # 書き込めなかった場合はセッションのデータを変えず、保存されていない内容を表示しない
+    progress_saved = upsert_rows_to_supabase(df_vocab.loc[list(dict.fromkeys(changed_labels))], current_vocab_table_name)
+    if progress_saved:
+        bump_data_version(df_vocab)
+        carry_filter_index(df_vocab_before, df_vocab, changed_positions=df_vocab.index.get_indexer(changed_labels))
+        set_session_frame('df_vocab', current_vocab_table_name, df_vocab) # 更新されたdf_vocabを新しいスナップショットとして共有
+    else: # 書き込み前のスナップショットのバージョンのまま扱う (テーブルが変わっていれば次回の確認で読み込み直す)
+        st.session_state.setdefault('written_table_versions', {}).pop(current_vocab_table_name, None)
+
+    # テスト結果を保存
+    new_test_result = pd.DataFrame([{
+        'Date': datetime.now(),
+        'Category': test_mode['selected_category'],
+        'TestType': test_mode['test_type'],
+        'Score': total_score,
+        'TotalQuestions': len(test_mode['questions']),
+        'Details': detailed_results # ここがJSONBになる部分
+    }])
+    result_saved = insert_rows_to_supabase(new_test_result, current_test_results_table_name) # 新しい結果の1行だけを追加する
+    if result_saved:
+        df_test_results = pd.concat([get_session_frame('df_test_results', TEST_RESULTS_HEADERS), new_test_result], ignore_index=True)
+        bump_data_version(df_test_results)
+        set_session_frame('df_test_results', current_test_results_table_name, df_test_results)
+    else:
+        st.session_state.setdefault('written_table_versions', {}).pop(current_test_results_table_name, None)
+    if not (progress_saved and result_saved):
+        st.error("テストの結果・学習進捗を保存できませんでした。採点結果は表示しますが、テスト結果の一覧や学習進捗には反映されていません。")
+
+    test_mode['score'] = total_score
+    test_mode['detailed_results'] = detailed_results
+    test_mode['graded'] = True
+    show_test_finished(total_score, len(test_mode['questions']), detailed_results)
+
+
+def reset_test_mode():
+    st.session_state.test_mode['active'] = False
+    st.session_state.test_mode['finished'] = False
+    st.session_state.test_mode['graded'] = False
+
+
+def show_test_finished(total_score, total_questions, detailed_results):
+    st.subheader("テスト終了！")
+    st.success(f"あなたのスコア: {total_score} / {total_questions}")
+    
+    if st.button("詳細結果を見る", key="view_detailed_results"):
+        st.session_state.test_review_mode['active'] = True
+        st.session_state.test_review_mode['review_index'] = 0
+        st.session_state.test_review_mode['results_to_review'] = detailed_results
+        reset_test_mode() # テストモードを終了
+        go_to_page("テスト結果") # テスト結果ページに遷移
+
+    if st.button("新しいテストを始める", key="start_new_test_after_finish"):
+        reset_test_mode()
+        st.rerun()
+
+    if st.button("用語集に戻る", key="back_to_vocab_list_after_finish"):
+        reset_test_mode()
+        go_to_page("用語集")
 
-# --- メインロジック ---
 
+# --- メインロジック ---
 # ユーザー名に応じたテーブル名の設定 (usernameがNoneの場合は一時的なデフォルト)
 current_vocab_table_name = f"vocab_{st.session_state.username.lower()}" if st.session_state.username else "vocab_default"
 current_test_results_table_name = f"test_results_{st.session_state.username.lower()}" if st.session_state.username else "test_results_default"
@@ -275,8 +1437,8 @@ if st.session_state.username is None:
                     st.rerun()
 
                 # 新しいユーザー名でデータをロードし直す
-                st.session_state.df_vocab = load_data_from_supabase(current_vocab_table_name)
-                st.session_state.df_test_results = load_data_from_supabase(current_test_results_table_name)
+                st.session_state.snapshot_refs['df_vocab'] = load_shared_snapshot(current_vocab_table_name)
+                st.session_state.snapshot_refs['df_test_results'] = load_shared_snapshot(current_test_results_table_name)
                 st.session_state.vocab_data_loaded = True
             # ログイン後、用語集へ
             st.session_state.current_page = "用語集"
@@ -296,13 +1458,18 @@ else: # ユーザーがログインしている場合
                 st.rerun()
 
             # Supabaseからデータをロード
-            st.session_state.df_vocab = load_data_from_supabase(current_vocab_table_name)
-            st.session_state.df_test_results = load_data_from_supabase(current_test_results_table_name)
+            st.session_state.snapshot_refs['df_vocab'] = load_shared_snapshot(current_vocab_table_name)
+            st.session_state.snapshot_refs['df_test_results'] = load_shared_snapshot(current_test_results_table_name)
             st.session_state.vocab_data_loaded = True
+    else:
+        # 他のセッションや端末での書き込みでテーブルのバージョンが変わっていれば、最新のスナップショットに切り替える
+        st.session_state.snapshot_refs['df_vocab'] = load_shared_snapshot(current_vocab_table_name)
+        st.session_state.snapshot_refs['df_test_results'] = load_shared_snapshot(current_test_results_table_name)
     
-    # ここからはセッションステートからDataFrameを取得して使用
-    df_vocab = st.session_state.df_vocab
-    df_test_results = st.session_state.df_test_results
+    # ここからは共有スナップショットを読み取り専用で使用 (変更する場合はコピーしてから set_session_frame で共有し直す)
+    df_vocab = with_pending_rows(get_session_frame('df_vocab', VOCAB_HEADERS), current_vocab_table_name) # 書き込み待ちの用語も表示・検索の対象にする
+    df_test_results = get_session_frame('df_test_results', TEST_RESULTS_HEADERS)
+    watch_table_changes() # 他のタブ・端末での変更が通知されたら、操作を待たずに表示を更新する
 
     # --- 共通サイドバー ---
     st.sidebar.title(f"ようこそ、{st.session_state.username}さん！")
@@ -320,13 +1487,19 @@ else: # ユーザーがログインしている場合
     
     # 新規用語追加フォーム (サイドバーに配置)
     st.sidebar.header("新規用語の追加")
+    if st.session_state.pop('reset_sidebar_new_term', False): # 追加後は入力欄を空にする (ウィジェットの作成前にのみ変更できる)
+        for input_key in ['sidebar_new_definition', 'sidebar_new_example']:
+            st.session_state[input_key] = ""
+        st.session_state.sidebar_new_term_resets = st.session_state.get('sidebar_new_term_resets', 0) + 1 # 用語の入力欄は作り直して空にする
+    # 用語はフォームの外で入力させ、キー入力が途切れるたびに登録済みの候補と重複を表示する
+    with st.sidebar:
+        new_term, existing_terms = render_term_input(df_vocab, "用語", f"sidebar_new_term_{st.session_state.get('sidebar_new_term_resets', 0)}")
     with st.sidebar.form("add_term_form"):
-        new_term = st.text_input("用語", key="sidebar_new_term")
         new_definition = st.text_area("説明", key="sidebar_new_definition")
         new_example = st.text_area("例文 (任意)", key="sidebar_new_example")
         
         # カテゴリの選択肢は、df_vocabが空でなければそこから取得
-        categories = df_vocab['カテゴリ (Category)'].dropna().unique().tolist() if not df_vocab.empty else []
+        categories = filter_values(df_vocab, 'カテゴリ (Category)')
         new_category = st.selectbox("カテゴリ", [''] + categories + ['新しいカテゴリを作成'], key="sidebar_new_category")
         
         if new_category == '新しいカテゴリを作成':
@@ -336,40 +1509,45 @@ else: # ユーザーがログインしている場合
         
         submitted = st.form_submit_button("用語を追加")
         if submitted:
-            if new_term and new_definition and new_category and new_category != '新しいカテゴリを作成': 
-                next_id = (df_vocab['ID'].max() + 1) if not df_vocab.empty else 1
-                new_row = pd.DataFrame([{
-                    'ID': next_id,
+            if existing_terms:
+                st.error(f"用語 '{new_term}' は既に登録されています。データ管理から既存の用語を編集してください。")
+            elif new_term and new_definition and new_category and new_category != '新しいカテゴリを作成': 
+                next_id = (int(df_vocab['ID'].max()) + 1) if not df_vocab.empty else 1
+                new_row = {
                     '用語 (Term)': new_term,
                     '説明 (Definition)': new_definition,
                     '例文 (Example)': new_example,
                     'カテゴリ (Category)': new_category,
                     '学習進捗 (Progress)': 'Not Started'
-                }])
-                df_vocab = pd.concat([df_vocab, new_row], ignore_index=True)
-                # Supabaseに書き込む
-                if write_data_to_supabase(df_vocab, current_vocab_table_name):
-                    st.success(f"用語 '{new_term}' を追加しました！")
-                    st.session_state.df_vocab = df_vocab # セッションステートも更新
-                    # 入力フィールドをクリア (Streamlitのバグ回避のためrerun)
-                    st.session_state.sidebar_new_term = ""
-                    st.session_state.sidebar_new_definition = ""
-                    st.session_state.sidebar_new_example = ""
-                    st.rerun()
-                else:
-                    st.error("用語の追加に失敗しました。")
+                }
+                # 続けて追加した用語は書き込み待ちのキューでまとめ、入力が途切れたらバックグラウンドで1回の upsert で書き込む
+                enqueue_new_row(current_vocab_table_name, new_row, next_id)
+                st.success(f"用語 '{new_term}' を追加しました！")
+                # 入力フィールドは次の再実行でウィジェットを作る前にクリアする
+                st.session_state.reset_sidebar_new_term = True
+                st.rerun()
             else:
                 st.error("用語、説明、有効なカテゴリは必須です。")
     
+    pending_rows, _, pending_error = write_queue_status(current_vocab_table_name)
+    if pending_rows:
+        st.sidebar.caption(f"⏳ 保存待ちの用語: {len(pending_rows)} 件 (入力が途切れると数秒後にまとめて保存します)")
+    if pending_error:
+        st.sidebar.warning(f"保存待ちの用語を書き込めませんでした。自動で再試行します: {pending_error}")
+    
     st.sidebar.markdown("---")
+    render_profiling_panel()
+    render_memory_report({'用語データ': df_vocab, 'テスト結果': df_test_results})
     if st.sidebar.button("ログアウト", key="logout_button"):
-        st.session_state.username = None
-        st.session_state.current_page = "Welcome"
-        st.session_state.vocab_data_loaded = False # ログアウト時にデータロードフラグをリセット
-        st.cache_data.clear() # キャッシュもクリア
-        st.session_state.df_vocab = pd.DataFrame(columns=VOCAB_HEADERS)
-        st.session_state.df_test_results = pd.DataFrame(columns=TEST_RESULTS_HEADERS)
-        st.rerun()
+        if not flush_write_queue(get_write_queues(), current_vocab_table_name): # 保存待ちの用語を書き込んでからログアウトする
+            st.sidebar.error("保存待ちの用語を書き込めなかったため、ログアウトを中止しました。しばらくしてからもう一度お試しください。")
+        else:
+            st.session_state.username = None
+            st.session_state.current_page = "Welcome"
+            st.session_state.vocab_data_loaded = False # ログアウト時にデータロードフラグをリセット
+            st.cache_data.clear() # キャッシュもクリア
+            st.session_state.snapshot_refs = {}
+            st.rerun()
 
     # --- メインコンテンツ ---
     if st.session_state.current_page == "用語集":
@@ -384,32 +1562,22 @@ else: # ユーザーがログインしている場合
             with col_search:
                 search_query = st.text_input("キーワード検索 (用語、説明、例文、カテゴリ)", key="vocab_search_query")
             with col_category:
-                categories = ['全カテゴリ'] + df_vocab['カテゴリ (Category)'].dropna().unique().tolist()
-                selected_category_filter = st.selectbox("カテゴリで絞り込み", categories, key="vocab_category_filter")
-
-            filtered_vocab = df_vocab.copy()
-
-            # カテゴリフィルタリング
-            if selected_category_filter != '全カテゴリ':
-                filtered_vocab = filtered_vocab[filtered_vocab['カテゴリ (Category)'] == selected_category_filter]
-
-            # 文字検索 (あいまい検索)
-            if search_query:
-                search_cols = ['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)']
-                filtered_vocab = filtered_vocab[
-                    filtered_vocab[search_cols].astype(str).apply(
-                        lambda x: x.str.contains(search_query, case=False, na=False)
-                    ).any(axis=1)
-                ]
-            
-            if filtered_vocab.empty:
+                categories = ['全カテゴリ'] + filter_values(df_vocab, 'カテゴリ (Category)')
+                selected_category_filter = st.selectbox("カテゴリで絞り込み", categories, key="vocab_category_filter",
+                    format_func=lambda x: x if x == '全カテゴリ' else f"{x} ({filter_count(df_vocab, 'カテゴリ (Category)', x)})")
+
+            # コピーを作らず、共有スナップショットへの絞り込みは行位置で表す
+            # カテゴリと文字検索 (部分一致) の結果はセッション内でキャッシュされる
+            filter_conditions = {} if selected_category_filter == '全カテゴリ' else {'カテゴリ (Category)': selected_category_filter}
+            filtered_positions = search_positions(df_vocab, filter_conditions, search_query,
+                                                  ['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)'])
+
+            if len(filtered_positions) == 0:
                 st.info("条件に一致する用語は見つかりませんでした。")
             else:
-                st.dataframe(
-                    filtered_vocab.set_index('ID'),
-                    column_order=['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)', '学習進捗 (Progress)'],
-                    use_container_width=True
-                )
+                # 全件ではなく表示中のページだけをブラウザに送る
+                render_paginated_table(df_vocab, df_vocab.index[filtered_positions], 'vocab_table', VOCAB_HEADERS,
+                                       filter_key=(selected_category_filter, search_query))
 
     elif st.session_state.current_page == "データ管理":
         st.header("📊 データ管理")
@@ -417,84 +1585,182 @@ else: # ユーザーがログインしている場合
         
         if df_vocab.empty:
             st.info("まだ用語が登録されていません。サイドバーから新しい用語を追加してください。")
-            st.sidebar.write(f"DEBUG: df_vocab is empty. Columns: {df_vocab.columns.tolist()}")
+            logger.debug(f"df_vocab is empty. Columns: {df_vocab.columns.tolist()}")
         else:
-            st.sidebar.write(f"DEBUG: df_vocab has {len(df_vocab)} rows.")
-            edited_df = st.data_editor(
-                df_vocab,
+            logger.debug(f"df_vocab has {len(df_vocab)} rows.")
+
+            # 1ページ分の行だけをエディタに渡し、保存時は変更のあった行だけを検証・書き込みする
+            total_editor_pages = (len(df_vocab) - 1) // DATA_EDITOR_PAGE_SIZE + 1
+            editor_page = st.number_input("編集するページ", min_value=1, max_value=total_editor_pages, value=1, step=1,
+                                          key="data_editor_page") - 1
+            page_start = editor_page * DATA_EDITOR_PAGE_SIZE
+            latest_page_df = with_plain_categories(df_vocab.iloc[page_start:page_start + DATA_EDITOR_PAGE_SIZE]) # 新しいカテゴリも代入できるように文字列列に戻す
+
+            # エディタのキーはページと、保存・破棄のたびに増やす番号だけで決める (書き込み待ちの行の書き込みなどでデータが読み込み直されても、編集中の内容を消さない)
+            # 編集中は編集を始めたときのページの内容をエディタに渡し続け、行の位置で記録される編集が同じ行に当たるようにする
+            editor_state = st.session_state.setdefault('vocab_editor', {'reset_token': 0, 'key': None, 'page_df': None})
+            editor_key = f"vocab_editor_{editor_page}_{editor_state['reset_token']}"
+            editor_delta = st.session_state.get(editor_key)
+            has_edits = editor_delta is not None and any(editor_delta[kind] for kind in ('edited_rows', 'added_rows', 'deleted_rows'))
+            if not (has_edits and editor_state['key'] == editor_key):
+                editor_state.update(key=editor_key, page_df=latest_page_df)
+            page_df = editor_state['page_df']
+            # 末尾に行が増えただけなら編集の位置はずれないので、編集を始めたときの行が変わっていないかだけを比べる
+            page_moved = has_edits and not page_df.equals(latest_page_df.iloc[:len(page_df)])
+            st.caption(f"全 {len(df_vocab)} 件中 {page_start + 1}〜{page_start + len(page_df)} 件を編集中です。ページを移動する前に変更を保存してください。")
+            if page_moved:
+                st.warning("編集中に、このページの用語が他のタブ・端末で更新されました。古い内容で上書きしないように、このままでは保存できません。"
+                           "「編集を破棄」を押して最新の内容を表示してから、もう一度編集してください。")
+                if st.button("編集を破棄", key="discard_data_management"):
+                    editor_state['reset_token'] += 1
+                    st.rerun()
+
+            st.data_editor(
+                page_df,
                 column_config={
                     "ID": st.column_config.NumberColumn("ID", help="用語のID", width="small", disabled=True),
                     "用語 (Term)": st.column_config.TextColumn("用語 (Term)", help="ビジネス用語"),
                     "説明 (Definition)": st.column_config.TextColumn("説明 (Definition)", help="用語の説明"),
                     "例文 (Example)": st.column_config.TextColumn("例文 (Example)", help="使用例"),
                     "カテゴリ (Category)": st.column_config.SelectboxColumn("カテゴリ (Category)", help="用語のカテゴリ",
-                        options=df_vocab['カテゴリ (Category)'].dropna().unique().tolist() + ['新しいカテゴリを作成'], required=True),
+                        options=filter_values(df_vocab, 'カテゴリ (Category)') + ['新しいカテゴリを作成'], required=True),
                     "学習進捗 (Progress)": st.column_config.SelectboxColumn("学習進捗 (Progress)", help="学習の進捗状況",
                         options=['Not Started', 'Learning', 'Mastered'], required=True)
                 },
                 num_rows="dynamic",
                 hide_index=True,
-                use_container_width=True
+                use_container_width=True,
+                key=editor_key
             )
             
-            if st.button("変更を保存", key="save_data_management"):
-                # 新しいカテゴリ作成時の処理
-                has_category_error = False
-                for idx, row in edited_df.iterrows():
-                    if row['カテゴリ (Category)'] == '新しいカテゴリを作成':
-                        st.error(f"行 {idx+1}: '新しいカテゴリを作成'が選択されています。有効なカテゴリを選択または入力してください。")
-                        has_category_error = True
-                
-                if has_category_error: # カテゴリエラーがあればここで処理を停止
-                    st.stop() 
+            if st.button("変更を保存", key="save_data_management", disabled=page_moved):
+                # エディタのウィジェット状態から 編集・追加・削除 された行だけを取り出す
+                editor_delta = st.session_state[editor_key]
+                edited_rows = {int(pos): changes for pos, changes in editor_delta['edited_rows'].items()}
+                added_rows = editor_delta['added_rows']
+                deleted_positions = [int(pos) for pos in editor_delta['deleted_rows']]
+
+                edited_df = page_df.iloc[list(edited_rows)].copy()
+                for row_label, changes in zip(edited_df.index, edited_rows.values()):
+                    for col, value in changes.items():
+                        edited_df.at[row_label, col] = value
+                added_df = pd.DataFrame(added_rows, columns=VOCAB_HEADERS)
+                deleted_ids = [int(x) for x in page_df.iloc[deleted_positions]['ID'].dropna()]
+                touched_df = pd.concat([edited_df, added_df], ignore_index=True)
+
+                if touched_df.empty and not deleted_ids:
+                    st.info("保存する変更はありません。")
+                    st.stop()
+
+                # 新しいカテゴリ作成時の処理 (変更行のみをベクトル演算で検証)
+                new_category_rows = touched_df.index[touched_df['カテゴリ (Category)'] == '新しいカテゴリを作成']
+                if len(new_category_rows) > 0:
+                    st.error(f"{len(new_category_rows)} 件の行で '新しいカテゴリを作成'が選択されています。有効なカテゴリを選択または入力してください。")
+                    st.stop()
 
                 # 必須カラムのチェック
                 required_cols = ['用語 (Term)', '説明 (Definition)', 'カテゴリ (Category)']
-                if edited_df[required_cols].isnull().values.any() or (edited_df[required_cols] == '').any().any():
+                if (touched_df[required_cols].isnull() | (touched_df[required_cols] == '')).any().any():
                     st.error("用語、説明、カテゴリは必須です。空欄がないか確認してください。")
                     st.stop()
+
+                # 追加行にIDを連番で付与
+                next_id = int(df_vocab['ID'].max()) + 1 if not df_vocab.empty else 1
+                added_df['ID'] = range(next_id, next_id + len(added_df))
+                added_df['学習進捗 (Progress)'] = added_df['学習進捗 (Progress)'].fillna('Not Started')
+                added_df['例文 (Example)'] = added_df['例文 (Example)'].fillna('')
+                rows_to_upsert = pd.concat([edited_df, added_df], ignore_index=True).astype({'ID': 'Int64'})
+
+                if (upsert_rows_to_supabase(rows_to_upsert, current_vocab_table_name) and
+                        delete_rows_from_supabase(deleted_ids, current_vocab_table_name)):
+                    # セッションのdf_vocabにも変更行だけを反映する
+                    # (変更行はその場で更新し、削除行を除いて追加行を末尾に足すので、ID順の並びはそのまま保たれる)
+                    df_vocab_before = df_vocab
+                    df_vocab = with_plain_categories(df_vocab)
+                    df_vocab.loc[edited_df.index, VOCAB_HEADERS] = edited_df[VOCAB_HEADERS]
+                    removed_positions = df_vocab.index.get_indexer(page_df.index[deleted_positions])
+                    df_vocab = df_vocab.drop(index=df_vocab.index[removed_positions]).reset_index(drop=True)
+                    appended_from = len(df_vocab)
+                    df_vocab = pd.concat([df_vocab, added_df.astype({'ID': 'Int64'})], ignore_index=True)
+                    bump_data_version(df_vocab)
+                    carry_filter_index(df_vocab_before, df_vocab, removed_positions=removed_positions,
+                                       changed_positions=df_vocab_before.index.get_indexer(edited_df.index),
+                                       appended_from=appended_from)
+                    st.success("変更を保存しました！")
+                    set_session_frame('df_vocab', current_vocab_table_name, df_vocab) # セッションの参照も更新
+                    editor_state['reset_token'] += 1 # 保存した編集をエディタから消し、保存後の内容を表示する
+                    st.rerun()
                 else:
-                    # 'ID'がNaNになっている新規行を特定し、IDを付与
-                    new_rows = edited_df[edited_df['ID'].isna()]
-                    for idx, row in new_rows.iterrows():
-                        next_id = (df_vocab['ID'].max() + 1) if not df_vocab.empty else 1
-                        edited_df.loc[idx, 'ID'] = next_id
-                    
-                    # edited_dfをdf_vocabに代入し、Supabaseに書き込む
-                    df_vocab = edited_df.astype({'ID': 'Int64'})
-                    if write_data_to_supabase(df_vocab, current_vocab_table_name):
-                        st.success("変更を保存しました！")
-                        st.session_state.df_vocab = df_vocab # セッションステートも更新
-                        st.rerun()
-                    else:
-                        st.error("変更の保存に失敗しました。")
+                    st.error("変更の保存に失敗しました。")
 
         st.markdown("---")
         st.subheader("データのインポート / エクスポート")
 
         # --- エクスポート ---
         st.markdown("##### データのエクスポート")
-        csv_data = df_vocab.to_csv(index=False, encoding='utf-8-sig')
+        # エクスポートはボタンが押されたときに生成する (ページを開くたびに全件を書き出さない)
         st.download_button(
             label="CSVとしてエクスポート",
-            data=csv_data,
+            data=export_data_source('vocab_csv', df_vocab, build_csv_export),
             file_name=f"vocab_data_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime="text/csv",
-            key="export_csv"
+            key="export_csv",
+            on_click="ignore"
         )
         
-        json_data = df_vocab.to_json(orient="records", force_ascii=False)
         st.download_button(
             label="JSONとしてエクスポート",
-            data=json_data,
+            data=export_data_source('vocab_json', df_vocab, build_json_export),
             file_name=f"vocab_data_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
             mime="application/json",
-            key="export_json"
+            key="export_json",
+            on_click="ignore"
         )
 
+        # Parquet・Arrow は列の型を保ったまま書き出す (別環境への移行やバックアップ向け)
+        export_col1, export_col2 = st.columns(2)
+        with export_col1:
+            st.download_button(
+                label="Parquetとしてエクスポート (用語データ)",
+                data=export_data_source('vocab_parquet', df_vocab, build_vocab_parquet_export),
+                file_name=f"vocab_data_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet",
+                mime="application/vnd.apache.parquet",
+                key="export_vocab_parquet",
+                on_click="ignore"
+            )
+            st.download_button(
+                label="Parquetとしてエクスポート (テスト結果)",
+                data=export_data_source('test_results_parquet', df_test_results, build_test_results_parquet_export),
+                file_name=f"test_results_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet",
+                mime="application/vnd.apache.parquet",
+                key="export_test_results_parquet",
+                on_click="ignore"
+            )
+        with export_col2:
+            st.download_button(
+                label="Arrowとしてエクスポート (用語データ)",
+                data=export_data_source('vocab_arrow', df_vocab, build_vocab_arrow_export),
+                file_name=f"vocab_data_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.arrow",
+                mime="application/vnd.apache.arrow.file",
+                key="export_vocab_arrow",
+                on_click="ignore"
+            )
+            st.download_button(
+                label="Arrowとしてエクスポート (テスト結果)",
+                data=export_data_source('test_results_arrow', df_test_results, build_test_results_arrow_export),
+                file_name=f"test_results_{st.session_state.username}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.arrow",
+                mime="application/vnd.apache.arrow.file",
+                key="export_test_results_arrow",
+                on_click="ignore"
+            )
+
         # --- インポート ---
         st.markdown("##### データのインポート")
-        uploaded_file = st.file_uploader("CSVまたはJSONファイルをアップロード", type=["csv", "json"], key="import_file_uploader")
+        import_result = st.session_state.get('import_result')
+        if import_result is not None:
+            st.success(f"データのインポートに成功しました！ ({import_result['inserted']} 行を追加、{import_result['skipped']} 行は重複などのため除外、{import_result['remapped']} 行のIDを振り直し)")
+        uploaded_file = st.file_uploader("CSV・JSON・JSON Lines・Parquet・Arrowファイルをアップロード", type=["csv", "json", "jsonl", "parquet", "arrow", "feather"],
+                                         key=f"import_file_uploader_{st.session_state.get('import_uploader_version', 0)}")
 
         if uploaded_file is not None:
             import_action = st.radio(
@@ -503,67 +1769,113 @@ else: # ユーザーがログインしている場合
                 key="import_action_radio"
             )
             
-            if st.button("インポートを実行", key="execute_import"):
+            # 取り込む前にファイルを読み込み、説明文が既存の用語 (またはファイル内の別の行) とほぼ同じ行をグループにして表示する
+            try:
+                preview = get_import_preview(uploaded_file, import_action, df_vocab)
+            except Exception as e:
+                preview = None
+                st.error(f"ファイルの読み込み中にエラーが発生しました: {e}")
+                st.exception(e)
+
+            if preview is not None:
+                if preview['missing_cols']:
+                    st.warning(f"アップロードされたファイルには以下の必須カラムが不足しています: {', '.join(preview['missing_cols'])}。これらのカラムは空として追加されます。")
+                clusters = preview['clusters']
+                skip_near_duplicates = False
+                if clusters.empty:
+                    st.caption("説明文が既存の用語とほぼ同じ行は見つかりませんでした。")
+                else:
+                    st.warning(f"説明文がほぼ同じ (類似度 {NEAR_DUPLICATE_THRESHOLD:.0%} 以上) 用語のグループが {clusters['グループ'].nunique()} 件見つかりました。")
+                    with st.expander("近似重複の候補を確認", expanded=True):
+                        st.dataframe(clusters, hide_index=True, use_container_width=True)
+                    skip_near_duplicates = st.checkbox(
+                        f"「取り込まない候補」の {len(preview['skip_positions'])} 行を除いてインポートする",
+                        value=True, key="import_skip_near_duplicates"
+                    )
+
+            if preview is not None:
+                # ファイルのIDが無い・不正・既存と重複している行は新しいIDに振り直す (取り込まない行は除く)
+                skip_positions = preview['skip_positions'] if skip_near_duplicates else []
+                id_report = preview['id_report'][~(preview['id_report']['行番号'] - 1).isin(skip_positions)]
+                if not id_report.empty:
+                    with st.expander(f"IDを振り直す行: {len(id_report)} 行"):
+                        st.write(id_report['理由'].value_counts().rename('行数'))
+                        st.dataframe(id_report, hide_index=True, use_container_width=True)
+                if import_action == "既存データを上書き":
+                    st.warning("既存のデータは全て上書きされます。")
+                # 途中で失敗したインポートは、同じファイル・同じ設定で実行し直すとチェックポイントから再開する
+                import_key = preview['key'] + (skip_near_duplicates,)
+                checkpoint = st.session_state.get('import_checkpoint')
+                if checkpoint is not None and checkpoint['key'] != import_key:
+                    checkpoint = None
+                if checkpoint is not None:
+                    st.info(f"前回のインポートは {checkpoint['rows_done']} / {preview['total_rows']} 行目まで完了しています。「インポートを実行」を押すと続きから再開します。")
+
+            if preview is not None and st.button("インポートを実行", key="execute_import"):
+                st.session_state.pop('import_result', None)
+                if checkpoint is None:
+                    checkpoint = new_import_checkpoint(import_key, overwrite=(import_action == "既存データを上書き"))
+                    st.session_state.import_checkpoint = checkpoint
+                progress_bar = st.progress(min(checkpoint['rows_done'] / max(preview['total_rows'], 1), 1.0), text="インポートしています...")
                 try:
-                    if uploaded_file.name.endswith('.csv'):
-                        imported_df = pd.read_csv(uploaded_file)
-                    elif uploaded_file.name.endswith('.json'):
-                        imported_df = pd.read_json(uploaded_file)
-                    else:
-                        st.error("サポートされていないファイル形式です。CSVまたはJSONファイルをアップロードしてください。")
-                        st.stop()
-                    
-                    # 必要なカラムが存在するかチェック
-                    missing_cols = [col for col in VOCAB_HEADERS if col not in imported_df.columns]
-                    if missing_cols:
-                        st.warning(f"アップロードされたファイルには以下の必須カラムが不足しています: {', '.join(missing_cols)}。これらのカラムは空として追加されます。")
-                        for col in missing_cols:
-                            imported_df[col] = pd.NA
-                    imported_df = imported_df[VOCAB_HEADERS]
-
-                    if import_action == "既存データを上書き":
-                        df_vocab = imported_df.copy()
-                        # IDは全て振り直し
-                        df_vocab['ID'] = range(1, len(df_vocab) + 1)
-                        df_vocab['ID'] = df_vocab['ID'].astype('Int64')
-                        st.warning("既存のデータは全て上書きされます。")
-                    else: # 既存データに追加
-                        # 既存のIDの最大値を取得し、新しいIDを付与
-                        max_id = df_vocab['ID'].max() if not df_vocab.empty else 0
-                        
-                        # インポートデータのIDを振り直し（重複やNaN対策）
-                        imported_df['ID'] = imported_df.apply(
-                            lambda row: max_id + 1 + imported_df.index.get_loc(row.name) if pd.isna(row['ID']) or row['ID'] == 0 else row['ID'], axis=1
-                        )
-                        # 既存データとIDが重複しないように調整
-                        if not df_vocab.empty:
-                            existing_ids = df_vocab['ID'].dropna().astype(int).tolist()
-                            imported_df['ID'] = imported_df['ID'].apply(lambda x: x if x not in existing_ids else max_id + 1 + imported_df[imported_df['ID']==x].index[0])
-                        
-                        # 最終的なIDを再度一意に調整（念のため）
-                        all_ids = list(df_vocab['ID'].dropna().astype(int)) if not df_vocab.empty else []
-                        for i in range(len(imported_df)):
-                            if imported_df.loc[i, 'ID'] in all_ids:
-                                imported_df.loc[i, 'ID'] = max(all_ids) + 1
-                            all_ids.append(int(imported_df.loc[i, 'ID']))
-                        
-                        df_vocab = pd.concat([df_vocab, imported_df], ignore_index=True)
-                        df_vocab['ID'] = df_vocab['ID'].astype('Int64') # 型を合わせる
-                        st.info("既存データに追加されます。")
-                    
-                    df_vocab = df_vocab.drop_duplicates(subset=['用語 (Term)', '説明 (Definition)'], keep='first')
-                    df_vocab = df_vocab.sort_values(by='ID').reset_index(drop=True)
-
-                    if write_data_to_supabase(df_vocab, current_vocab_table_name):
-                        st.success("データのインポートに成功しました！")
-                        st.session_state.df_vocab = df_vocab # セッションステートも更新
-                        st.rerun()
-                    else:
-                        st.error("データのインポートに失敗しました。")
-
+                    completed = run_chunked_import(
+                        uploaded_file, current_vocab_table_name, checkpoint, preview['import_ids'],
+                        skip_positions, preview['total_rows'], progress_bar
+                    )
                 except Exception as e:
+                    completed = False
                     st.error(f"ファイルのインポート中にエラーが発生しました: {e}")
                     st.exception(e)
+
+                if completed:
+                    # 結果は再実行後に表示する
+                    st.session_state.import_result = {'inserted': checkpoint['inserted'], 'skipped': checkpoint['skipped'], 'remapped': len(id_report)}
+                    del st.session_state.import_checkpoint
+                    st.session_state.import_uploader_version = st.session_state.get('import_uploader_version', 0) + 1 # アップロード欄を空にする
+                    # 書き込んだ行はSupabaseから読み込み直す (ファイル全体をセッションで結合しない)
+                    invalidate_shared_snapshots()
+                    st.session_state.snapshot_refs['df_vocab'] = load_shared_snapshot(current_vocab_table_name)
+                    st.rerun()
+                else:
+                    st.error(f"データのインポートに失敗しました。{checkpoint['rows_done']} / {preview['total_rows']} 行目まで書き込み済みです。もう一度「インポートを実行」を押すと続きから再開します。")
+
+        # --- テスト結果のインポート ---
+        st.markdown("##### テスト結果のインポート")
+        results_import_count = st.session_state.get('results_import_count')
+        if results_import_count is not None:
+            st.success(f"テスト結果のインポートに成功しました！ ({results_import_count} 件)")
+        results_file = st.file_uploader("Parquet・Arrowファイルをアップロード", type=["parquet", "arrow", "feather"],
+                                        key=f"results_file_uploader_{st.session_state.get('results_uploader_version', 0)}")
+        if results_file is not None:
+            results_action = st.radio(
+                "インポート方法を選択",
+                ("既存の結果に追加", "既存の結果を上書き"),
+                key="results_import_action_radio"
+            )
+            if results_action == "既存の結果を上書き":
+                st.warning("既存のテスト結果は全て上書きされます。")
+            if st.button("テスト結果をインポート", key="execute_results_import"):
+                st.session_state.pop('results_import_count', None)
+                try:
+                    imported_results = read_test_results_import(results_file)
+                except Exception as e:
+                    imported_results = None
+                    st.error(f"ファイルの読み込み中にエラーが発生しました: {e}")
+                if imported_results is not None:
+                    imported_count = len(imported_results)
+                    overwrite_results = results_action == "既存の結果を上書き"
+                    # 追加の場合もSupabaseにはインポートした行だけを送り、既存の結果は書き直さない
+                    if import_test_results_to_supabase(imported_results, current_test_results_table_name, overwrite_results):
+                        if not overwrite_results and not df_test_results.empty:
+                            existing_results = df_test_results.assign(Details=decode_details_column(df_test_results['Details']))
+                            imported_results = pd.concat([existing_results, imported_results], ignore_index=True)
+                        imported_results = imported_results.sort_values(by='Date', ascending=False).reset_index(drop=True)
+                        set_session_frame('df_test_results', current_test_results_table_name, imported_results)
+                        st.session_state.results_import_count = imported_count
+                        st.session_state.results_uploader_version = st.session_state.get('results_uploader_version', 0) + 1 # アップロード欄を空にする
+                        st.rerun()
+                    else:
+                        st.error("テスト結果のインポートに失敗しました。")
         
     elif st.session_state.current_page == "テストモード":
         st.header("📝 テストモード")
@@ -578,7 +1890,7 @@ else: # ユーザーがログインしている場合
         else:
             if not st.session_state.test_mode['active']:
                 st.subheader("テスト設定")
-                categories = df_vocab['カテゴリ (Category)'].dropna().unique().tolist()
+                categories = filter_values(df_vocab, 'カテゴリ (Category)')
                 
                 st.session_state.test_mode['selected_category'] = st.selectbox(
                     "テストカテゴリを選択", ['全カテゴリ'] + categories, key="test_category_select")
@@ -600,8 +1912,19 @@ else: # ユーザーがログインしている場合
                     format_func=lambda x: x[0], key="test_source_radio"
                 )[1]
 
+                st.session_state.test_mode['answer_mode'] = st.radio(
+                    "回答方式",
+                    [('まとめて回答 (ブラウザ内で回答し、最後に一度だけ送信)', 'batched'),
+                     ('1問ずつ回答', 'per_question')],
+                    format_func=lambda x: x[0], key="test_answer_mode_radio"
+                )[1]
+
                 if st.button("テスト開始", key="start_test_button"):
                     start_new_test(df_vocab)
+            elif st.session_state.test_mode.get('finished'):
+                end_test(df_vocab, current_test_results_table_name)
+            elif st.session_state.test_mode.get('answer_mode') == 'batched':
+                run_batched_test()
             else:
                 run_test(df_vocab, current_test_results_table_name)
 
@@ -612,29 +1935,38 @@ else: # ユーザーがログインしている場合
         if df_test_results.empty:
             st.info("まだテスト結果がありません。テストモードで学習を開始しましょう！")
         else:
-            # テスト結果の概要表示
+            # テスト結果の概要表示 (表示中のページの概要だけを表示し、Detailsはレビュー開始時に1件分だけ読む)
             st.subheader("テスト結果一覧")
-            display_df_test_results = df_test_results.copy()
+            total_results = len(df_test_results)
+            total_result_pages = (total_results - 1) // TEST_RESULTS_PAGE_SIZE + 1
+            results_page = st.number_input("ページ", min_value=1, max_value=total_result_pages, value=1, step=1,
+                                           key="test_results_page") - 1
+            page_start = results_page * TEST_RESULTS_PAGE_SIZE
+            page_results = df_test_results.iloc[page_start:page_start + TEST_RESULTS_PAGE_SIZE]
+            display_df_test_results = page_results[['Date', 'Category', 'TestType', 'Score', 'TotalQuestions']].copy()
             # 表示用のカラムを選択し、必要であればフォーマット
             display_df_test_results['Date'] = display_df_test_results['Date'].dt.strftime('%Y-%m-%d %H:%M')
-            st.dataframe(
-                display_df_test_results[['Date', 'Category', 'TestType', 'Score', 'TotalQuestions']],
+            st.caption(f"全 {total_results} 件中 {page_start + 1}〜{page_start + len(page_results)} 件を表示しています。")
+            results_selection = st.dataframe(
+                display_df_test_results,
                 use_container_width=True,
-                hide_index=True
+                hide_index=True,
+                on_select="rerun",
+                selection_mode="single-row",
+                key=f"test_results_table_{results_page}"
             )
 
             # 詳細レビュー機能
             st.subheader("テスト結果の詳細レビュー")
-            if len(df_test_results) > 0:
-                result_dates = df_test_results['Date'].dt.strftime('%Y-%m-%d %H:%M').tolist()
-                selected_result_index = st.selectbox("レビューするテスト結果を選択", range(len(result_dates)),
-                                                     format_func=lambda x: result_dates[x], key="review_select_result")
-                
-                if st.button("このテスト結果をレビュー", key="start_review_button"):
-                    st.session_state.test_review_mode['active'] = True
-                    st.session_state.test_review_mode['review_index'] = 0
-                    st.session_state.test_review_mode['results_to_review'] = df_test_results.loc[selected_result_index, 'Details']
-                    go_to_page("テスト結果") # 現在のページをリロードしてレビュー表示を開始
+            selected_rows = results_selection.selection.rows
+            if not selected_rows:
+                st.info("レビューするテスト結果を一覧から選択してください。")
+            elif st.button("このテスト結果をレビュー", key="start_review_button"):
+                selected_result_index = page_start + selected_rows[0]
+                st.session_state.test_review_mode['active'] = True
+                st.session_state.test_review_mode['review_index'] = 0
+                st.session_state.test_review_mode['results_to_review'] = details_to_list(df_test_results.iloc[selected_result_index]['Details'])
+                go_to_page("テスト結果") # 現在のページをリロードしてレビュー表示を開始
             
             if st.session_state.test_review_mode['active']:
                 review_current_question = st.session_state.test_review_mode['results_to_review'][st.session_state.test_review_mode['review_index']]
@@ -674,183 +2006,6 @@ else: # ユーザーがログインしている場合
         pass
 
 
-# --- テストモード関連関数 ---
-def start_new_test(df_vocab):
-    test_settings = st.session_state.test_mode
-
-    # 選択されたカテゴリでフィルタリング
-    if test_settings['selected_category'] == '全カテゴリ':
-        available_vocab = df_vocab.copy()
-    else:
-        available_vocab = df_vocab[df_vocab['カテゴリ (Category)'] == test_settings['selected_category']].copy()
-
-    if available_vocab.empty or len(available_vocab) < test_settings['question_count']:
-        st.error("選択された条件で十分な問題を作成できませんでした。カテゴリや問題数を見直してください。")
-        st.session_state.test_mode['active'] = False
-        return
-
-    # 出題元に基づくフィルタリングと選択
-    if test_settings['question_source'] == 'learning_focus':
-        # 'Not Started' と 'Learning' の用語を優先
-        focus_vocab = available_vocab[available_vocab['学習進捗 (Progress)'].isin(['Not Started', 'Learning'])]
-        if len(focus_vocab) >= test_settings['question_count']:
-            selected_questions_df = focus_vocab.sample(n=test_settings['question_count'], random_state=random.randint(0, 10000))
-        elif len(focus_vocab) > 0: # 優先用語が足りなければ、残りをランダムに補完
-            st.warning(f"学習不足用語が{len(focus_vocab)}件しかありませんでした。残りは他の用語からランダムに選択します。")
-            remaining_count = test_settings['question_count'] - len(focus_vocab)
-            other_vocab = available_vocab[~available_vocab.index.isin(focus_vocab.index)]
-            selected_questions_df = pd.concat([
-                focus_vocab,
-                other_vocab.sample(n=remaining_count, random_state=random.randint(0, 10000))
-            ])
-        else: # 学習不足用語がない場合
-            st.info("学習不足用語が見つからなかったため、全用語からランダムに選択します。")
-            selected_questions_df = available_vocab.sample(n=test_settings['question_count'], random_state=random.randint(0, 10000))
-    else: # 'random_all'
-        selected_questions_df = available_vocab.sample(n=test_settings['question_count'], random_state=random.randint(0, 10000))
-
-    questions = []
-    for index, row in selected_questions_df.iterrows():
-        correct_answer = ""
-        question_text = ""
-        if test_settings['test_type'] == 'term_to_def':
-            question_text = f"用語: **{row['用語 (Term)']}** の説明として正しいものを選びなさい。"
-            correct_answer = row['説明 (Definition)']
-            options_pool = available_vocab['説明 (Definition)'].tolist()
-        elif test_settings['test_type'] == 'example_to_term':
-            if pd.isna(row['例文 (Example)']) or row['例文 (Example)'] == '':
-                # 例文がない場合はスキップするか、他の形式にフォールバック
-                continue 
-            question_text = f"例文: 「*{row['例文 (Example)']}*」 が示す用語として正しいものを選びなさい。"
-            correct_answer = row['用語 (Term)']
-            options_pool = available_vocab['用語 (Term)'].tolist()
-        
-        # 選択肢を作成 (正解と異なるダミー選択肢を3つ追加)
-        options = [correct_answer]
-        dummy_options = [opt for opt in options_pool if opt != correct_answer]
-        options.extend(random.sample(dummy_options, min(3, len(dummy_options))))
-        random.shuffle(options)
-
-        questions.append({
-            'term_id': row['ID'],
-            'term': row['用語 (Term)'],
-            'definition': row['説明 (Definition)'],
-            'example': row['例文 (Example)'],
-            'category': row['カテゴリ (Category)'],
-            'question_text': question_text,
-            'correct_answer': correct_answer,
-            'options': options
-        })
-    
-    # 選択肢がない問題がスキップされた場合を考慮
-    if not questions:
-        st.error("選択された条件で有効な問題を作成できませんでした。例文が設定されていない用語が含まれている可能性があります。")
-        st.session_state.test_mode['active'] = False
-        return
-
-    st.session_state.test_mode['active'] = True
-    st.session_state.test_mode['current_question_index'] = 0
-    st.session_state.test_mode['questions'] = questions
-    st.session_state.test_mode['answers'] = [None] * len(questions)
-    st.session_state.test_mode['score'] = 0
-    st.session_state.test_mode['detailed_results'] = []
-    st.rerun()
-
-
-def run_test(df_vocab, current_test_results_table_name):
-    test_mode = st.session_state.test_mode
-    current_question = test_mode['questions'][test_mode['current_question_index']]
-
-    st.subheader(f"問題 {test_mode['current_question_index'] + 1} / {len(test_mode['questions'])}")
-    st.markdown(current_question['question_text'])
-
-    user_answer = st.radio(
-        "回答を選択してください:",
-        current_question['options'],
-        key=f"q_{test_mode['current_question_index']}"
-    )
-    
-    st.session_state.test_mode['answers'][test_mode['current_question_index']] = user_answer
-
-    col1, col2 = st.columns(2)
-    with col1:
-        if st.button("前の問題", key="prev_q"):
-            if test_mode['current_question_index'] > 0:
-                test_mode['current_question_index'] -= 1
-                st.rerun()
-    with col2:
-        if st.button("次の問題", key="next_q"):
-            if test_mode['current_question_index'] < len(test_mode['questions']) - 1:
-                test_mode['current_question_index'] += 1
-                st.rerun()
-            else: # 最終問題の次を押したとき
-                end_test(df_vocab, current_test_results_table_name)
-
-
-def end_test(df_vocab, current_test_results_table_name):
-    test_mode = st.session_state.test_mode
-    total_score = 0
-    detailed_results = []
-
-    for i, question in enumerate(test_mode['questions']):
-        user_answer = test_mode['answers'][i]
-        is_correct = (user_answer == question['correct_answer'])
-        
-        if is_correct:
-            total_score += 1
-            # 学習進捗を更新（正解したらMasteredへ向かう）
-            vocab_idx = df_vocab[df_vocab['ID'] == question['term_id']].index
-            if not vocab_idx.empty:
-                current_progress = df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)']
-                if current_progress == 'Not Started':
-                    df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Learning'
-                elif current_progress == 'Learning':
-                    df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Mastered'
-        else:
-            # 不正解なら学習進捗をLearningに戻す
-            vocab_idx = df_vocab[df_vocab['ID'] == question['term_id']].index
-            if not vocab_idx.empty:
-                df_vocab.loc[vocab_idx[0], '学習進捗 (Progress)'] = 'Learning'
-
-        detailed_results.append({
-            'term_id': question['term_id'],
-            'term': question['term'],
-            'definition': question['definition'],
-            'question_text': question['question_text'],
-            'correct_answer': question['correct_answer'],
-            'user_answer': user_answer,
-            'is_correct': is_correct
-        })
-
-    st.session_state.df_vocab = df_vocab # 更新されたdf_vocabをセッションステートに保存
-    write_data_to_supabase(df_vocab, current_vocab_table_name) # 用語集データも更新
-
-    # テスト結果を保存
-    new_test_result = pd.DataFrame([{
-        'Date': datetime.now(),
-        'Category': test_mode['selected_category'],
-        'TestType': test_mode['test_type'],
-        'Score': total_score,
-        'TotalQuestions': len(test_mode['questions']),
-        'Details': detailed_results # ここがJSONBになる部分
-    }])
-    st.session_state.df_test_results = pd.concat([st.session_state.df_test_results, new_test_result], ignore_index=True)
-    write_data_to_supabase(st.session_state.df_test_results, current_test_results_table_name)
-
-    st.subheader("テスト終了！")
-    st.success(f"あなたのスコア: {total_score} / {len(test_mode['questions'])}")
-    
-    if st.button("詳細結果を見る", key="view_detailed_results"):
-        st.session_state.test_review_mode['active'] = True
-        st.session_state.test_review_mode['review_index'] = 0
-        st.session_state.test_review_mode['results_to_review'] = detailed_results
-        st.session_state.test_mode['active'] = False # テストモードを終了
-        go_to_page("テスト結果") # テスト結果ページに遷移
-
-    if st.button("新しいテストを始める", key="start_new_test_after_finish"):
-        st.session_state.test_mode['active'] = False
-        st.rerun()
-
-    if st.button("用語集に戻る", key="back_to_vocab_list_after_finish"):
-        st.session_state.test_mode['active'] = False
-        go_to_page("用語集")
+# アプリ全体の再実行時間を記録 (st.rerun / st.stop で中断した場合は記録しない)
+if st.session_state.username is not None:
+    record_rerun_timing('full', time.perf_counter() - script_start_time)
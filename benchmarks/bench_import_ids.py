@@ -0,0 +1,63 @@
+"""
+「既存データに追加」のインポートで、取り込む行のIDを決める処理の計測。
+reconcile_import_ids (配列演算で一度に突き合わせる) と、以前の1行ずつ確認する方法の所要時間を行数ごとに比べる。
+
+    python benchmarks/bench_import_ids.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vocab_core import reconcile_import_ids
+
+ROW_COUNTS = [3125, 6250, 12500, 25000, 50000, 100000, 200000, 400000]
+ROW_BY_ROW_MAX_ROWS = 12500 # 以前の方法は行数の2乗で遅くなるので、この行数までだけ計測する
+MISSING_ID_RATIO = 0.3 # IDが空の行の割合
+
+
+def assign_ids_row_by_row(df_vocab, imported_df):
+    """以前の実装: apply と get_loc で1行ずつIDを決め、使用済みのIDをリストで確認する"""
+    max_id = df_vocab['ID'].max() if not df_vocab.empty else 0
+    imported_df['ID'] = imported_df.apply(
+        lambda row: max_id + 1 + imported_df.index.get_loc(row.name) if pd.isna(row['ID']) or row['ID'] == 0 else row['ID'], axis=1
+    )
+    existing_ids = df_vocab['ID'].dropna().astype(int).tolist()
+    imported_df['ID'] = imported_df['ID'].apply(
+        lambda x: x if x not in existing_ids else max_id + 1 + imported_df[imported_df['ID'] == x].index[0]
+    )
+    all_ids = list(df_vocab['ID'].dropna().astype(int))
+    for i in range(len(imported_df)):
+        if imported_df.loc[i, 'ID'] in all_ids:
+            imported_df.loc[i, 'ID'] = max(all_ids) + 1
+        all_ids.append(int(imported_df.loc[i, 'ID']))
+    return imported_df
+
+
+def main():
+    rng = np.random.default_rng(0)
+    for rows in ROW_COUNTS:
+        # 既存の用語は 1..rows、インポートするファイルのIDは一部が空で、残りは既存のIDと重なりうる
+        existing_ids = np.arange(1, rows + 1, dtype=np.int64)
+        file_ids = pd.Series(np.where(rng.random(rows) < MISSING_ID_RATIO, np.nan, rng.integers(1, 3 * rows, rows)).astype(float))
+
+        start = time.perf_counter()
+        assigned, _, _ = reconcile_import_ids(file_ids, existing_ids, rows + 1, keep_file_ids=True)
+        elapsed = time.perf_counter() - start
+        assert len(np.unique(np.concatenate([existing_ids, assigned]))) == 2 * rows
+        line = f"{rows:>7} 行: reconcile_import_ids {elapsed * 1000:8.1f} ms"
+
+        if rows <= ROW_BY_ROW_MAX_ROWS:
+            df_vocab = pd.DataFrame({'ID': pd.array(existing_ids, dtype='Int64')})
+            start = time.perf_counter()
+            assign_ids_row_by_row(df_vocab, pd.DataFrame({'ID': file_ids}))
+            line += f" / 以前の方法 {time.perf_counter() - start:6.1f} s"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
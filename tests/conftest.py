@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_supabase import FakeSupabase, vocab_rows
+
+
+@pytest.fixture
+def session_state():
+    """アプリを動かさずに vocab_core の処理を呼ぶテスト用に、プロセス内の st.session_state を空にする"""
+    for key in list(st.session_state):
+        del st.session_state[key]
+    yield st.session_state
+    for key in list(st.session_state):
+        del st.session_state[key]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.time を進める関数を返す (バージョンを確認し直す間隔などを実際に待たずに過ぎさせる)"""
+    real_time = time.time
+    offset = [0.0]
+    monkeypatch.setattr(time, 'time', lambda: real_time() + offset[0])
+
+    def advance(seconds):
+        offset[0] += seconds
+    return advance
+
+
+@pytest.fixture
+def supabase_db(monkeypatch):
+    """st.connection をメモリ上の Supabase に差し替え、プロセス内で共有するキャッシュを空にする"""
+    db = FakeSupabase()
+    db.tables['vocab_alice'] = vocab_rows(30)
+    db.tables['test_results_alice'] = []
+    monkeypatch.setattr(st, 'connection', lambda *args, **kwargs: db)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    shutil.rmtree(os.path.join(REPO_DIR, '.snapshot_cache'), ignore_errors=True)
+    yield db
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+@pytest.fixture
+def open_app(supabase_db, monkeypatch):
+    """ログイン済みのタブ (AppTest) を開く"""
+    rerun = st.rerun
+    monkeypatch.setattr(st, 'rerun', lambda scope='app': rerun()) # AppTest はフラグメントだけの再実行ができず、常にアプリ全体を再実行する
+
+    def open_tab(app_file='app25.py', username='alice'):
+        at = AppTest.from_file(os.path.join(REPO_DIR, app_file), default_timeout=30)
+        at.secrets['SUPABASE_URL'] = 'http://localhost'
+        at.secrets['SUPABASE_KEY'] = 'key'
+        at.session_state['username'] = username
+        at.run()
+        assert not at.exception
+        return at
+    return open_tab
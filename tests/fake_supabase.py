@@ -0,0 +1,176 @@
+"""
+テスト用のメモリ上の Supabase クライアント (app25 が使うクエリだけを実装する)。
+change_tracking_sql の実行でテーブルのバージョン管理を始め、以降は書き込みの文ごとにバージョンを進める。
+"""
+import copy
+import json
+import re
+from datetime import datetime, timedelta, timezone
+
+# upsert (INSERT ... ON CONFLICT DO UPDATE) は INSERT と UPDATE の両方の文トリガーを起動する
+STATEMENTS_PER_OP = {'insert': 1, 'upsert': 2, 'delete': 1}
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+
+class Query:
+    def __init__(self, db, table_name):
+        self.db = db
+        self.table_name = table_name
+        self.op = 'select'
+        self.payload = None
+        self.filters = []
+        self.row_range = None
+
+    def select(self, *args, **kwargs):
+        self.op = 'select'
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = 'insert', rows
+        return self
+
+    def upsert(self, rows):
+        self.op, self.payload = 'upsert', rows
+        return self
+
+    def delete(self):
+        self.op = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) > str(value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and str(row[column]) >= str(value))
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, spec):
+        conditions = []
+        for part in spec.split(','):
+            column, condition = part.split('.', 1)
+            if condition not in ('is.null', 'not.is.null'):
+                raise NotImplementedError(part)
+            conditions.append((column, condition == 'is.null'))
+        self.filters.append(lambda row: any((row.get(column) is None) == is_null for column, is_null in conditions))
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        self.row_range = (0, count - 1)
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        return self.db.execute(self)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {}
+        self.versions = {} # バージョン管理しているテーブル (table_versions テーブルの内容)
+        self.calls = [] # (テーブル名, 操作) の記録
+        self.rows_read = {} # テーブルごとの、select で返した行数の合計 (差分だけを読み込んだかの確認用)
+        self.sql = [] # execute_sql で実行したSQL
+        self.clock = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+    # --- アプリから呼ばれるクライアントのメソッド ---
+    def table(self, table_name):
+        return Query(self, table_name)
+
+    def rpc(self, name, params):
+        self.sql.append(params.get('sql_query', ''))
+        match = re.search(r"VALUES \('((?:[^']|'')+)', 0\)", params.get('sql_query', ''))
+        if match: # change_tracking_sql: バージョン管理と変更日時の記録を始める
+            table_name = match.group(1).replace("''", "'")
+            if table_name not in self.versions:
+                self.versions[table_name] = 0
+                stamp = self.tick()
+                for row in self.tables.get(table_name, []):
+                    row.setdefault('updated_at', stamp)
+        return Query(self, '__rpc__')
+
+    # --- テストから使うメソッド ---
+    def tick(self):
+        self.clock += timedelta(seconds=1)
+        return self.clock.isoformat()
+
+    def rows(self, table_name):
+        return self.tables.setdefault(table_name, [])
+
+    def writes(self):
+        return [call for call in self.calls if call[1] != 'select']
+
+    def execute(self, query):
+        name = query.table_name
+        if name == '__rpc__':
+            return Response([])
+        self.calls.append((name, query.op))
+        if name == 'table_versions':
+            rows = [{'table_name': table, 'version': version} for table, version in self.versions.items()]
+        else:
+            rows = self.rows(name)
+        matches = [row for row in rows if all(condition(row) for condition in query.filters)]
+        if query.op == 'select':
+            matches = copy.deepcopy(matches)
+            if query.row_range is not None:
+                matches = matches[query.row_range[0]:query.row_range[1] + 1]
+            self.rows_read[name] = self.rows_read.get(name, 0) + len(matches)
+            return Response(matches)
+
+        payload = json.loads(json.dumps(query.payload)) if query.payload is not None else None # 送れない値はここで失敗させる
+        tracked = name in self.versions
+        stamp = self.tick() if tracked else None
+        if tracked:
+            self.versions[name] += STATEMENTS_PER_OP[query.op]
+        if query.op == 'insert':
+            rows.extend(dict(row, updated_at=stamp) if tracked else row for row in payload)
+            return Response(payload)
+        if query.op == 'upsert':
+            by_id = {row.get('ID'): position for position, row in enumerate(rows)}
+            for row in payload:
+                new_row = dict(row, updated_at=stamp) if tracked else row
+                if row.get('ID') in by_id:
+                    rows[by_id[row['ID']]] = dict(rows[by_id[row['ID']]], **new_row)
+                else:
+                    rows.append(new_row)
+            return Response(payload)
+        # delete
+        self.tables[name] = [row for row in rows if not all(condition(row) for condition in query.filters)]
+        if tracked:
+            key_column = 'ID' if name.startswith('vocab_') else 'Date'
+            self.rows('deleted_rows').extend(
+                {'table_name': name, 'row_key': None if row.get(key_column) is None else str(row[key_column]), 'deleted_at': stamp}
+                for row in matches
+            )
+        return Response(matches)
+
+
+def vocab_rows(count):
+    categories = ['財務', 'マーケ', '人事', 'IT']
+    progress = ['Not Started', 'Learning', 'Mastered']
+    return [{'ID': i, '用語 (Term)': f'Term{i}', '説明 (Definition)': f'Def{i}', '例文 (Example)': '',
+             'カテゴリ (Category)': categories[i % 4], '学習進捗 (Progress)': progress[i % 3]} for i in range(1, count + 1)]
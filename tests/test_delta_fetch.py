@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+import pytest
+
+from fake_supabase import vocab_rows
+
+VERSION_CHECK_WAIT = 6 # app25 の VERSION_CHECK_INTERVAL_SECONDS より長い時間
+
+
+@pytest.fixture
+def tracked_db(supabase_db):
+    """バージョン管理済みで、行ごとの変更日時が1分ずつずれている用語テーブル (差分の重なりで読み直すのは最新の行だけになる)"""
+    start = supabase_db.clock - timedelta(hours=1)
+    for minutes, row in enumerate(supabase_db.rows('vocab_alice')):
+        row['updated_at'] = (start + timedelta(minutes=minutes)).isoformat()
+    supabase_db.versions['vocab_alice'] = 0
+    return supabase_db
+
+
+def shown_table(at):
+    """用語集ページの一覧に表示している (ID, 用語)"""
+    return at.dataframe[0].value[['ID', '用語 (Term)']].values.tolist()
+
+
+def table_rows(db):
+    return sorted([row['ID'], row['用語 (Term)']] for row in db.rows('vocab_alice'))
+
+
+def test_changes_elsewhere_are_merged_without_reading_the_whole_table(open_app, tracked_db, clock):
+    at = open_app()
+    edited = dict(tracked_db.rows('vocab_alice')[0], **{'用語 (Term)': 'EditedElsewhere'})
+    tracked_db.table('vocab_alice').upsert([edited]).execute()
+    tracked_db.table('vocab_alice').delete().eq('ID', 2).execute()
+    tracked_db.table('vocab_alice').insert(vocab_rows(31)[30:]).execute()
+    tracked_db.rows_read.clear()
+
+    clock(VERSION_CHECK_WAIT)
+    at.run()
+
+    assert not at.exception
+    assert shown_table(at) == table_rows(tracked_db)
+    # 変更・追加した2行と、差分の重なりに入る最新の1行 (ID 30) だけを読む
+    assert tracked_db.rows_read['vocab_alice'] == 3
+    assert tracked_db.rows_read['deleted_rows'] == 1
+
+
+def test_truncate_reloads_the_whole_table(open_app, tracked_db, clock):
+    at = open_app()
+    # TRUNCATE は行ごとの削除記録を残さず、テーブル全体の削除 (キーが NULL) だけを記録する
+    stamp = tracked_db.tick()
+    tracked_db.tables['vocab_alice'] = [dict(row, updated_at=(tracked_db.clock - timedelta(days=1)).isoformat()) for row in vocab_rows(5)]
+    tracked_db.rows('deleted_rows').append({'table_name': 'vocab_alice', 'row_key': None, 'deleted_at': stamp})
+    tracked_db.versions['vocab_alice'] += 1
+    tracked_db.rows_read.clear()
+
+    clock(VERSION_CHECK_WAIT)
+    at.run()
+
+    assert not at.exception
+    assert shown_table(at) == table_rows(tracked_db)
+    assert tracked_db.rows_read['vocab_alice'] == 5
+
+
+def test_expired_deletion_records_reload_the_whole_table(open_app, tracked_db, clock):
+    at = open_app()
+    tracked_db.table('vocab_alice').delete().eq('ID', 2).execute()
+    tracked_db.rows('deleted_rows').clear() # 保存期間を過ぎて消えた削除記録
+    tracked_db.rows_read.clear()
+
+    clock(7 * 86400) # app25 の DELETED_ROWS_RETENTION_DAYS
+    at.run()
+
+    assert not at.exception
+    assert shown_table(at) == table_rows(tracked_db)
+    assert tracked_db.rows_read['vocab_alice'] == 29
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fake_supabase import vocab_rows
+from vocab_core import (
+    FILTER_INDEX_COLUMNS, build_filter_index, bump_data_version, carry_filter_index, compact_vocab_frame,
+    filter_count, filter_positions, filter_values, get_data_version, get_filter_index,
+)
+
+CATEGORY, PROGRESS = FILTER_INDEX_COLUMNS
+
+
+@pytest.fixture
+def df_vocab(session_state):
+    return compact_vocab_frame(pd.DataFrame(vocab_rows(30)))
+
+
+def expected_positions(df, conditions):
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in conditions.items():
+        mask &= (df[col] == value).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def assert_same_index(index, rebuilt):
+    for col in FILTER_INDEX_COLUMNS:
+        assert index['positions'][col].keys() == rebuilt['positions'][col].keys()
+        for value, positions in rebuilt['positions'][col].items():
+            np.testing.assert_array_equal(index['positions'][col][value], positions)
+    assert index['values'] == rebuilt['values']
+    assert index['counts'] == rebuilt['counts']
+
+
+@pytest.mark.parametrize('conditions', [
+    {CATEGORY: '財務'},
+    {PROGRESS: 'Mastered'},
+    {CATEGORY: 'IT', PROGRESS: 'Learning'},
+    {CATEGORY: '存在しないカテゴリ'},
+])
+def test_filter_positions_match_column_comparison(df_vocab, conditions):
+    np.testing.assert_array_equal(filter_positions(df_vocab, conditions), expected_positions(df_vocab, conditions))
+
+
+def test_filter_without_conditions_means_all_rows(df_vocab):
+    assert filter_positions(df_vocab, {}) is None
+
+
+def test_values_and_counts(df_vocab):
+    assert filter_values(df_vocab, CATEGORY) == sorted(['財務', 'マーケ', '人事', 'IT'])
+    assert filter_count(df_vocab, PROGRESS, 'Learning') == 10
+    assert filter_count(df_vocab, CATEGORY, '存在しないカテゴリ') == 0
+
+
+def test_carry_filter_index_matches_rebuild(df_vocab, session_state):
+    get_filter_index(df_vocab)
+    removed, changed = [0, 7, 8], [3, 8, 20]
+    new_df = df_vocab.drop(index=df_vocab.index[removed]).reset_index(drop=True)
+    new_df.loc[[2, 17], CATEGORY] = 'IT' # 編集前の位置 3, 20 (削除した行の分だけ前に詰まる)
+    new_df.loc[17, PROGRESS] = 'Mastered'
+    appended = pd.DataFrame(vocab_rows(33)[30:]).assign(**{CATEGORY: '新カテゴリ'})
+    new_df = compact_vocab_frame(pd.concat([new_df, appended], ignore_index=True))
+    bump_data_version(new_df)
+
+    carry_filter_index(df_vocab, new_df, removed_positions=removed, changed_positions=changed, appended_from=27)
+
+    carried = session_state['filter_index_cache'][get_data_version(new_df)]
+    assert_same_index(carried, build_filter_index(new_df))
+
+
+def test_carry_drops_values_that_no_longer_occur(df_vocab):
+    get_filter_index(df_vocab)
+    it_positions = expected_positions(df_vocab, {CATEGORY: 'IT'})
+    new_df = df_vocab.drop(index=df_vocab.index[it_positions]).reset_index(drop=True)
+    bump_data_version(new_df)
+
+    carry_filter_index(df_vocab, new_df, removed_positions=it_positions)
+
+    assert 'IT' not in filter_values(new_df, CATEGORY)
+    assert_same_index(get_filter_index(new_df), build_filter_index(new_df))
+
+
+def test_carry_without_old_index_builds_on_next_use(df_vocab, session_state):
+    new_df = df_vocab.copy()
+    bump_data_version(new_df)
+
+    carry_filter_index(df_vocab, new_df, changed_positions=[1])
+
+    assert 'filter_index_cache' not in session_state or get_data_version(new_df) not in session_state['filter_index_cache']
+    assert_same_index(get_filter_index(new_df), build_filter_index(new_df))
@@ -0,0 +1,73 @@
+import io
+
+import pandas as pd
+import pytest
+
+import vocab_core
+from vocab_core import VOCAB_HEADERS, iter_import_chunks, iter_normalized_import_chunks, normalize_import_chunk
+
+
+def uploaded(name, data):
+    upload = io.BytesIO(data)
+    upload.name = name
+    return upload
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(vocab_core, 'IMPORT_CHUNK_ROWS', 4)
+
+
+def test_csv_is_read_in_chunks_indexed_by_file_position(small_chunks):
+    rows = pd.DataFrame({'用語 (Term)': [f'Term{i}' for i in range(10)], '説明 (Definition)': [f'Def{i}' for i in range(10)]})
+    upload = uploaded('vocab.csv', rows.to_csv(index=False).encode('utf-8'))
+
+    chunks = list(iter_import_chunks(upload))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert pd.concat(chunks).index.tolist() == list(range(10))
+    assert pd.concat(chunks)['用語 (Term)'].tolist() == rows['用語 (Term)'].tolist()
+
+
+def test_file_is_read_from_the_start_again():
+    upload = uploaded('vocab.csv', '用語 (Term)\nA\nB\n'.encode('utf-8'))
+    list(iter_import_chunks(upload))
+
+    assert pd.concat(iter_import_chunks(upload))['用語 (Term)'].tolist() == ['A', 'B']
+
+
+def test_unsupported_file_type_is_rejected():
+    with pytest.raises(ValueError, match="サポートされていないファイル形式"):
+        list(iter_import_chunks(uploaded('vocab.xlsx', b'')))
+
+
+def test_normalize_import_chunk():
+    chunk = pd.DataFrame({
+        'ID': ['3', 'abc', None, '5'],
+        '用語 (Term)': ['  ROI ', '', None, 'KPI'],
+        '説明 (Definition)': ['投資利益率', '   ', None, ''],
+        'カテゴリ (Category)': ['財務', '', None, 'IT'],
+        '余分な列': [1, 2, 3, 4],
+    }, index=pd.RangeIndex(10, 14))
+
+    normalized = normalize_import_chunk(chunk)
+
+    assert normalized.columns.tolist() == VOCAB_HEADERS
+    assert normalized.index.tolist() == [10, 13] # 用語と説明の両方が空の行は除く (行位置はそのまま)
+    assert normalized['用語 (Term)'].tolist() == ['ROI', 'KPI']
+    assert normalized['ID'].tolist() == [3, 5]
+    assert pd.isna(normalized['説明 (Definition)'].iloc[1])
+    assert normalized['例文 (Example)'].tolist() == ['', '']
+    assert normalized['学習進捗 (Progress)'].tolist() == ['Not Started', 'Not Started']
+
+
+def test_normalized_chunks_record_file_stats(small_chunks):
+    rows = pd.DataFrame({'用語 (Term)': [f'Term{i}' for i in range(6)] + [''], '説明 (Definition)': [f'Def{i}' for i in range(6)] + ['']})
+    upload = uploaded('vocab.csv', rows.to_csv(index=False).encode('utf-8'))
+    file_stats = {'rows': 0, 'missing_cols': set()}
+
+    chunks = list(iter_normalized_import_chunks(upload, file_stats))
+
+    assert file_stats['rows'] == 7 # 取り込まない空の行も、ファイルの行数には数える
+    assert file_stats['missing_cols'] == {'ID', '例文 (Example)', 'カテゴリ (Category)', '学習進捗 (Progress)'}
+    assert sum(len(chunk) for chunk in chunks) == 6
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from vocab_core import (
+    IMPORT_ID_REASON_DUPLICATED, IMPORT_ID_REASON_IN_USE, IMPORT_ID_REASON_INVALID, IMPORT_ID_REASON_MISSING,
+    IMPORT_ID_REASON_OVERWRITE, plan_import_ids, reconcile_import_ids,
+)
+
+USED_IDS = np.array([1, 2, 3, 5, 10, 11], dtype=np.int64)
+
+
+def test_every_reason_code_when_appending():
+    file_ids = pd.Series([None, 4, 5, 4, -1, 2.5, 12, 13, 'abc', 100, 12, 0], dtype=object)
+
+    assigned, next_id, reasons = reconcile_import_ids(file_ids, USED_IDS, 12, keep_file_ids=True)
+
+    assert reasons.tolist() == [
+        IMPORT_ID_REASON_MISSING, None, IMPORT_ID_REASON_IN_USE, IMPORT_ID_REASON_DUPLICATED,
+        IMPORT_ID_REASON_INVALID, IMPORT_ID_REASON_INVALID, None, None, IMPORT_ID_REASON_MISSING, None,
+        IMPORT_ID_REASON_DUPLICATED, IMPORT_ID_REASON_INVALID,
+    ]
+    # 振り直すIDは next_id から順に、そのまま使うID (12, 13) を飛ばして割り当てる
+    assert assigned.tolist() == [14, 4, 15, 16, 17, 18, 12, 13, 19, 100, 20, 21]
+    assert next_id == 22
+
+
+def test_assigned_ids_are_unique_and_unused():
+    rng = np.random.default_rng(0)
+    file_ids = pd.Series(np.where(rng.random(5000) < 0.3, np.nan, rng.integers(-5, 8000, 5000)))
+    used_ids = np.unique(rng.integers(1, 8000, 3000))
+
+    assigned, next_id, reasons = reconcile_import_ids(file_ids, used_ids, int(used_ids[-1]) + 1, keep_file_ids=True)
+
+    assert len(np.unique(assigned)) == len(assigned)
+    assert not np.isin(assigned, used_ids).any()
+    kept = pd.isna(reasons)
+    np.testing.assert_array_equal(assigned[kept], file_ids[kept].astype(np.int64))
+    assert next_id > assigned[~kept].max()
+
+
+def test_overwrite_renumbers_every_row():
+    assigned, next_id, reasons = reconcile_import_ids(pd.Series([1, 7, None]), np.empty(0, dtype=np.int64), 1, keep_file_ids=False)
+
+    assert assigned.tolist() == [1, 2, 3]
+    assert next_id == 4
+    assert reasons.tolist() == [None, IMPORT_ID_REASON_OVERWRITE, IMPORT_ID_REASON_OVERWRITE] # 番号が変わらなかった行は理由なし
+
+
+def test_ids_below_next_id_are_never_reused():
+    # 削除済みのID (4 など) はファイルにあればそのまま使うが、振り直しの番号には使わない
+    assigned, next_id, reasons = reconcile_import_ids(pd.Series([4, None]), USED_IDS, 12, keep_file_ids=True)
+
+    assert assigned.tolist() == [4, 12]
+    assert next_id == 13
+
+
+def test_empty_file():
+    assigned, next_id, reasons = reconcile_import_ids(pd.Series([], dtype=float), USED_IDS, 12, keep_file_ids=True)
+
+    assert len(assigned) == 0
+    assert next_id == 12
+
+
+@pytest.mark.parametrize('overwrite', [False, True])
+def test_plan_import_ids_maps_file_positions(overwrite):
+    df_vocab = pd.DataFrame({'ID': pd.array([1, 2, 5], dtype='Int64')})
+    # 行位置 1 は完全一致の重複として取り込まない
+    rows = pd.DataFrame({'ID': [2, 9, None], '用語 (Term)': ['A', 'C', 'D']}, index=[0, 2, 3])
+
+    import_ids, id_report = plan_import_ids(rows, df_vocab, overwrite, total_rows=4)
+
+    if overwrite:
+        assert import_ids.tolist() == [1, 0, 2, 3]
+        assert id_report['行番号'].tolist() == [1, 3, 4]
+        assert id_report['理由'].tolist() == [IMPORT_ID_REASON_OVERWRITE] * 3
+    else:
+        assert import_ids.tolist() == [6, 0, 9, 7]
+        assert id_report['行番号'].tolist() == [1, 4]
+        assert id_report['新しいID'].tolist() == [6, 7]
+        assert id_report['理由'].tolist() == [IMPORT_ID_REASON_IN_USE, IMPORT_ID_REASON_MISSING]
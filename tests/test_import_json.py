@@ -0,0 +1,71 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import vocab_core
+from vocab_core import iter_import_chunks, iter_json_records
+
+RECORDS = [
+    {'ID': 1, '用語 (Term)': 'ROI', '説明 (Definition)': '投資利益率 (Return On Investment)', 'カテゴリ (Category)': '財務'},
+    {'ID': 2, '用語 (Term)': 'キャッシュフロー', '説明 (Definition)': '現金の流れ。"引用符" や \\ も含む', '例文 (Example)': None},
+    {'ID': None, '用語 (Term)': '損益分岐点', '説明 (Definition)': '売上と費用が等しくなる点\n(改行を含む)'},
+]
+
+
+def json_array(records):
+    return json.dumps(records, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def json_lines(records):
+    return ('\n'.join(json.dumps(record, ensure_ascii=False) for record in records) + '\n').encode('utf-8')
+
+
+@pytest.mark.parametrize('read_bytes', [1, 2, 3, 7, 64, 1 << 20]) # 1〜3バイトではマルチバイト文字の途中でも切れる
+@pytest.mark.parametrize('encode', [json_array, json_lines])
+@pytest.mark.parametrize('bom', [b'', b'\xef\xbb\xbf'])
+def test_records_survive_any_read_boundary(monkeypatch, read_bytes, encode, bom):
+    monkeypatch.setattr(vocab_core, 'IMPORT_JSON_READ_BYTES', read_bytes)
+
+    assert list(iter_json_records(io.BytesIO(bom + encode(RECORDS)))) == RECORDS
+
+
+@pytest.mark.parametrize('data', [b'', b'[]', b'  [ ]\n', b'\n\n'])
+def test_empty_files_have_no_records(data):
+    assert list(iter_json_records(io.BytesIO(data))) == []
+
+
+def test_json_lines_skip_blank_lines():
+    data = b'\n' + json_lines(RECORDS[:1]) + b'\n\n' + json_lines(RECORDS[1:])
+
+    assert list(iter_json_records(io.BytesIO(data))) == RECORDS
+
+
+def test_unclosed_array_is_an_error():
+    with pytest.raises(ValueError, match="閉じられていません"):
+        list(iter_json_records(io.BytesIO(json_array(RECORDS)[:-1])))
+
+
+def test_truncated_record_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_records(io.BytesIO(json_lines(RECORDS)[:-3])))
+
+
+@pytest.mark.parametrize('data', [b'[1, 2]', b'"text"\n'])
+def test_records_must_be_objects(data):
+    with pytest.raises(ValueError, match="レコード"):
+        list(iter_json_records(io.BytesIO(data)))
+
+
+@pytest.mark.parametrize('name, encode', [('vocab.json', json_array), ('vocab.jsonl', json_lines)])
+def test_json_import_chunks_are_indexed_by_file_position(monkeypatch, name, encode):
+    monkeypatch.setattr(vocab_core, 'IMPORT_CHUNK_ROWS', 2)
+    upload = io.BytesIO(encode(RECORDS * 3))
+    upload.name = name
+
+    chunks = list(iter_import_chunks(upload))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2, 2, 1]
+    assert pd.concat(chunks).index.tolist() == list(range(9))
+    assert pd.concat(chunks)['用語 (Term)'].tolist() == [record['用語 (Term)'] for record in RECORDS * 3]
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from vocab_core import compact_vocab_frame, find_near_duplicates, text_shingles
+
+GROSS_PROFIT = '売上高から売上原価を差し引いた利益で、企業の本業の収益力を示す指標。'
+CASH_FLOW = '一定期間に企業に出入りした現金の流れで、営業・投資・財務の3つの活動に分けて示す。'
+BURN_RATE = 'スタートアップが毎月どれだけの手元資金を消費しているかを表す数値。'
+CHURN_RATE = '一定期間に解約・離脱した顧客の割合で、サブスクリプション事業の健全性を測る。'
+
+
+@pytest.fixture
+def df_vocab(session_state):
+    return compact_vocab_frame(pd.DataFrame({
+        'ID': [1, 2], '用語 (Term)': ['粗利益', 'キャッシュフロー'], '説明 (Definition)': [GROSS_PROFIT, CASH_FLOW],
+        '例文 (Example)': '', 'カテゴリ (Category)': '財務', '学習進捗 (Progress)': 'Not Started',
+    }))
+
+
+def import_chunk(definitions, start=0):
+    """ファイル内の行位置 start 以降の行として、インポートするチャンクを作る"""
+    index = pd.RangeIndex(start, start + len(definitions))
+    return pd.DataFrame({'ID': [None] * len(definitions), '用語 (Term)': [f'Imported{i}' for i in index],
+                         '説明 (Definition)': definitions}, index=index)
+
+
+def test_import_row_close_to_existing_term_is_skipped(df_vocab):
+    chunks = [import_chunk([BURN_RATE, GROSS_PROFIT.rstrip('。'), CHURN_RATE])]
+
+    clusters, skip_positions = find_near_duplicates(df_vocab, chunks)
+
+    assert skip_positions == [1]
+    assert clusters['由来'].tolist() == ['既存', 'インポート']
+    assert clusters['ID'].tolist()[0] == 1
+    assert clusters['取り込み'].tolist() == ['既存', '取り込まない候補']
+
+
+def test_first_of_near_duplicate_imports_is_kept(df_vocab):
+    chunks = [import_chunk([BURN_RATE, CHURN_RATE]), import_chunk([BURN_RATE.rstrip('。'), BURN_RATE], start=2)]
+
+    clusters, skip_positions = find_near_duplicates(df_vocab, chunks)
+
+    assert skip_positions == [2, 3] # チャンクをまたいでも、ファイル内の行位置で返す
+    assert clusters['用語 (Term)'].tolist() == ['Imported0', 'Imported2', 'Imported3']
+    assert clusters['取り込み'].tolist() == ['取り込む', '取り込まない候補', '取り込まない候補']
+
+
+def test_distinct_definitions_have_no_groups(df_vocab):
+    clusters, skip_positions = find_near_duplicates(df_vocab, [import_chunk([BURN_RATE, CHURN_RATE])])
+
+    assert clusters.empty
+    assert skip_positions == []
+
+
+def test_existing_terms_are_ignored_when_overwriting(df_vocab):
+    clusters, skip_positions = find_near_duplicates(df_vocab, [import_chunk([GROSS_PROFIT, CASH_FLOW])], compare_existing=False)
+
+    assert clusters.empty
+    assert skip_positions == []
+
+
+def test_rows_dropped_by_normalization_keep_file_positions(df_vocab):
+    # 正規化で除かれた行 (行位置 1, 2) があっても、後続の行の位置はずれない
+    chunk = import_chunk([BURN_RATE, 'x', 'y', BURN_RATE]).drop(index=[1, 2])
+
+    clusters, skip_positions = find_near_duplicates(df_vocab, [chunk])
+
+    assert skip_positions == [3]
+
+
+def test_empty_definitions_are_not_duplicates(df_vocab):
+    assert text_shingles('') == frozenset()
+    assert text_shingles(None) == frozenset()
+
+    clusters, skip_positions = find_near_duplicates(df_vocab, [import_chunk(['', '', None])])
+
+    assert clusters.empty
+    assert skip_positions == []
@@ -0,0 +1,75 @@
+import random
+
+import pandas as pd
+import pytest
+
+from vocab_core import build_alias_table, compute_term_weights, weighted_sample_without_replacement
+
+
+def alias_probabilities(prob, alias):
+    """エイリアステーブルから、各位置が1回の抽選で選ばれる確率を計算する"""
+    n = len(prob)
+    mass = [p / n for p in prob]
+    for i, p in enumerate(prob):
+        mass[alias[i]] += (1.0 - p) / n
+    return mass
+
+
+@pytest.mark.parametrize('weights', [
+    [1.0, 1.0, 1.0, 1.0],
+    [0.1, 0.2, 0.3, 0.4],
+    [5.0, 0.001, 0.001, 0.5, 2.0],
+    [1e-3] * 9 + [100.0],
+])
+def test_alias_table_reproduces_weights(weights):
+    prob, alias = build_alias_table(weights)
+
+    assert alias_probabilities(prob, alias) == pytest.approx([w / sum(weights) for w in weights])
+
+
+def test_sample_returns_distinct_positions():
+    random.seed(0)
+    positions = weighted_sample_without_replacement([0.5, 1.0, 2.0, 0.25, 1.5], 3)
+
+    assert len(positions) == 3
+    assert len(set(positions)) == 3
+    assert all(0 <= position < 5 for position in positions)
+
+
+def test_sample_larger_than_population_returns_everything():
+    random.seed(0)
+
+    assert sorted(weighted_sample_without_replacement([1.0, 2.0, 3.0], 10)) == [0, 1, 2]
+
+
+def test_sample_with_skewed_weights_falls_back_to_remaining_terms():
+    # 1件に重みが集中していると棄却が続くので、残りの用語でテーブルを作り直して k 件を揃える
+    random.seed(0)
+    weights = [1e6] + [1e-3] * 20
+
+    positions = weighted_sample_without_replacement(weights, 15)
+
+    assert len(set(positions)) == 15
+    assert positions[0] == 0
+
+
+def test_sample_frequencies_follow_weights():
+    random.seed(0)
+    weights = [1.0, 2.0, 3.0, 4.0]
+    table = build_alias_table(weights)
+    draws = 20000
+    counts = [0] * len(weights)
+    for _ in range(draws):
+        counts[weighted_sample_without_replacement(weights, 1, table)[0]] += 1
+
+    assert [count / draws for count in counts] == pytest.approx([0.1, 0.2, 0.3, 0.4], abs=0.015)
+
+
+def test_term_weights_favour_untested_and_unmastered_terms():
+    vocab = pd.DataFrame({'ID': [1, 2, 3], '学習進捗 (Progress)': ['Learning', 'Learning', 'Mastered']})
+    today = pd.Timestamp('2026-10-19')
+    stats = {'attempts': {2: 4}, 'errors': {2: 0}, 'last_tested': {2: today}}
+
+    untested, just_tested, mastered = compute_term_weights(vocab, stats, today)
+
+    assert untested > mastered > just_tested
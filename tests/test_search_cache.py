@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fake_supabase import vocab_rows
+from vocab_core import FILTER_CACHE_SIZE, bump_data_version, compact_vocab_frame, search_positions
+
+TERM = '用語 (Term)'
+CATEGORY = 'カテゴリ (Category)'
+
+
+@pytest.fixture
+def df_vocab(session_state):
+    return compact_vocab_frame(pd.DataFrame(vocab_rows(120)))
+
+
+def full_scan(df, conditions, query):
+    mask = df[TERM].str.casefold().str.contains(query, regex=False).to_numpy(dtype=bool, copy=True)
+    for col, value in conditions.items():
+        mask &= (df[col] == value).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def test_longer_query_narrows_from_cached_result(df_vocab, session_state):
+    first = search_positions(df_vocab, {}, 'Term1', [TERM])
+    narrowed = search_positions(df_vocab, {}, 'term11', [TERM])
+
+    np.testing.assert_array_equal(first, full_scan(df_vocab, {}, 'term1'))
+    np.testing.assert_array_equal(narrowed, full_scan(df_vocab, {}, 'term11'))
+    assert session_state['filter_cache_stats'] == {'hits': 0, 'narrowed': 1, 'misses': 1}
+
+
+def test_narrowing_starts_from_the_longest_cached_query(df_vocab, session_state):
+    search_positions(df_vocab, {}, 'term', [TERM])
+    search_positions(df_vocab, {}, 'term1', [TERM])
+    term1_key = list(session_state['filter_cache'])[-1]
+    session_state['filter_cache'][term1_key] = np.array([10], dtype=np.int64)
+
+    # term1 の結果 (ここでは1件だけに差し替えたもの) から検索するので、term の結果から検索した場合より少なくなる
+    np.testing.assert_array_equal(search_positions(df_vocab, {}, 'term11', [TERM]), [10])
+
+
+def test_same_query_is_a_cache_hit(df_vocab, session_state):
+    first = search_positions(df_vocab, {CATEGORY: 'IT'}, 'term', [TERM])
+    again = search_positions(df_vocab, {CATEGORY: 'IT'}, ' TERM ', [TERM])
+
+    assert again is first
+    assert session_state['filter_cache_stats']['hits'] == 1
+
+
+def test_results_for_other_conditions_are_not_reused(df_vocab, session_state):
+    search_positions(df_vocab, {CATEGORY: 'IT'}, 'term1', [TERM])
+    positions = search_positions(df_vocab, {CATEGORY: '財務'}, 'term11', [TERM])
+
+    np.testing.assert_array_equal(positions, full_scan(df_vocab, {CATEGORY: '財務'}, 'term11'))
+    assert session_state['filter_cache_stats']['narrowed'] == 0
+
+
+def test_new_data_version_searches_all_rows_again(df_vocab, session_state):
+    search_positions(df_vocab, {}, 'term1', [TERM])
+    edited = df_vocab.copy()
+    edited.loc[0, TERM] = 'Term1000'
+    bump_data_version(edited)
+
+    positions = search_positions(edited, {}, 'term100', [TERM])
+
+    np.testing.assert_array_equal(positions, full_scan(edited, {}, 'term100'))
+    assert session_state['filter_cache_stats']['misses'] == 2
+
+
+def test_cache_keeps_only_recent_queries(df_vocab, session_state):
+    for i in range(FILTER_CACHE_SIZE + 5):
+        search_positions(df_vocab, {}, f'term{i}', [TERM])
+
+    assert len(session_state['filter_cache']) == FILTER_CACHE_SIZE
+    assert [key[-1] for key in session_state['filter_cache']][0] == 'term5'
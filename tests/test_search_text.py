@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+from vocab_core import build_search_columns, compact_vocab_frame, normalize_search_text, search_positions
+
+TERM = '用語 (Term)'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('ＲＯＩ', 'roi'), # 全角英字
+    ('１２３', '123'), # 全角数字
+    ('ｶﾞｲﾄﾞ', 'がいど'), # 半角カナ (濁点の結合を含む)
+    ('マーケティング', 'まーけてぃんぐ'),
+    ('ヴァリュー', 'ゔぁりゅー'),
+    ('Straße', 'strasse'),
+    ('キャッシュフロー計算書', 'きゃっしゅふろー計算書'), # 漢字はそのまま
+])
+def test_normalize_search_text(text, expected):
+    assert normalize_search_text(text) == expected
+
+
+def test_shadow_columns_use_the_same_normalization():
+    terms = ['ＲＯＩ', 'ｶﾞｲﾄﾞﾗｲﾝ', 'キャッシュフロー', 'Straße', None]
+    df = compact_vocab_frame(pd.DataFrame({TERM: terms, '説明 (Definition)': ['説明'] * len(terms)}))
+
+    shadow = build_search_columns(df)
+
+    assert shadow[TERM].tolist()[:-1] == [normalize_search_text(term) for term in terms[:-1]]
+    assert pd.isna(shadow[TERM].iloc[-1])
+
+
+@pytest.mark.parametrize('query', ['roi', 'ＲＯＩ', 'がいど', 'ガイド', 'ｶﾞｲﾄﾞ', 'きゃっしゅ'])
+def test_search_ignores_width_case_and_kana(session_state, query):
+    df = compact_vocab_frame(pd.DataFrame({'ID': [1, 2, 3, 4], TERM: ['ROI', 'ガイドライン', 'キャッシュフロー', '損益計算書'],
+                                           '説明 (Definition)': '', '例文 (Example)': '', 'カテゴリ (Category)': '財務',
+                                           '学習進捗 (Progress)': 'Not Started'}))
+
+    positions = search_positions(df, {}, query, [TERM])
+
+    assert len(positions) == 1
+    assert normalize_search_text(query) in normalize_search_text(df[TERM].iloc[positions[0]])
@@ -0,0 +1,62 @@
+from fake_supabase import vocab_rows
+
+VERSION_CHECK_WAIT = 6 # app25 の VERSION_CHECK_INTERVAL_SECONDS より長い時間
+
+
+def shown_terms(at):
+    """用語集ページの一覧に表示している用語"""
+    return at.dataframe[0].value['用語 (Term)'].tolist()
+
+
+def edit_elsewhere(supabase_db, term_id, term):
+    """別のタブ・端末から用語を書き換える"""
+    row = next(row for row in supabase_db.rows('vocab_alice') if row['ID'] == term_id)
+    supabase_db.table('vocab_alice').upsert([dict(row, **{'用語 (Term)': term})]).execute()
+
+
+def test_unchanged_table_is_not_read_again(open_app, supabase_db, clock):
+    at = open_app()
+    supabase_db.calls.clear()
+
+    clock(VERSION_CHECK_WAIT)
+    at.run()
+
+    assert not at.exception
+    assert {table for table, op in supabase_db.calls} == {'table_versions'} # バージョンの確認だけ
+    assert shown_terms(at)[0] == 'Term1'
+
+
+def test_write_elsewhere_is_shown_after_the_version_check(open_app, supabase_db, clock):
+    at = open_app()
+    edit_elsewhere(supabase_db, 1, 'EditedElsewhere')
+
+    at.run() # 確認の間隔が過ぎるまではバージョンを問い合わせない
+    assert shown_terms(at)[0] == 'Term1'
+
+    clock(VERSION_CHECK_WAIT)
+    at.run()
+    assert not at.exception
+    assert shown_terms(at)[0] == 'EditedElsewhere'
+
+
+def test_tabs_share_the_checked_snapshot(open_app, supabase_db):
+    open_app()
+    supabase_db.rows_read.clear()
+
+    other_tab = open_app()
+
+    assert supabase_db.rows_read.get('vocab_alice', 0) == 0 # 最初のタブが読み込んだスナップショットを使う
+    assert shown_terms(other_tab) == [f'Term{i}' for i in range(1, 31)]
+
+
+def test_change_tracking_sql_quotes_the_table_name(open_app, supabase_db):
+    # テーブル名はユーザー名から作るので、引用符を含んでいても識別子・文字列リテラルとして正しく埋め込む
+    supabase_db.tables['vocab_o\'ne"il'] = vocab_rows(3)
+    supabase_db.tables['test_results_o\'ne"il'] = []
+
+    at = open_app(username='O\'Ne"il')
+
+    assert shown_terms(at) == ['Term1', 'Term2', 'Term3']
+    assert 'vocab_o\'ne"il' in supabase_db.versions
+    tracking_sql = next(sql for sql in supabase_db.sql if "VALUES ('vocab_o''ne\"il', 0)" in sql)
+    assert 'ON public."vocab_o\'ne""il"' in tracking_sql
@@ -0,0 +1,85 @@
+import io
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+STALE_WARNING = "他のタブ・端末でデータが更新された"
+
+
+@pytest.fixture
+def import_file(monkeypatch):
+    """データ管理ページの用語のインポート欄に CSV ファイルをアップロードした状態にする"""
+    rows = pd.DataFrame({'ID': range(1, 6), '用語 (Term)': [f'Imported{i}' for i in range(1, 6)],
+                         '説明 (Definition)': [f'説明その{i}' for i in range(1, 6)], 'カテゴリ (Category)': 'IT'})
+    upload = io.BytesIO(rows.to_csv(index=False).encode('utf-8'))
+    upload.name, upload.size, upload.file_id = 'vocab.csv', len(upload.getvalue()), 'vocab-csv'
+    monkeypatch.setattr(st, 'file_uploader',
+                        lambda *args, **kwargs: upload if kwargs.get('key', '').startswith('import_file_uploader') else None)
+    return upload
+
+
+def start_overwrite_import(at):
+    at.session_state['current_page'] = 'データ管理'
+    at.run()
+    at.radio(key='import_action_radio').set_value('既存データを上書き').run()
+
+
+def test_overwrite_import_replaces_table(open_app, supabase_db, import_file):
+    at = open_app()
+    start_overwrite_import(at)
+    at.button(key='execute_import').click().run()
+
+    assert not at.exception
+    assert [row['用語 (Term)'] for row in supabase_db.rows('vocab_alice')] == [f'Imported{i}' for i in range(1, 6)]
+
+
+def test_overwrite_import_refused_after_write_elsewhere(open_app, supabase_db, import_file):
+    at = open_app()
+    start_overwrite_import(at)
+    # 別のタブ・端末が、このタブの読み込み後に用語を書き換える
+    supabase_db.table('vocab_alice').upsert([dict(supabase_db.rows('vocab_alice')[0], **{'用語 (Term)': 'EditedElsewhere'})]).execute()
+    supabase_db.calls.clear()
+
+    at.button(key='execute_import').click().run()
+
+    assert any(STALE_WARNING in warning.value for warning in at.warning)
+    assert supabase_db.writes() == []
+    assert supabase_db.rows('vocab_alice')[0]['用語 (Term)'] == 'EditedElsewhere'
+    assert len(supabase_db.rows('vocab_alice')) == 30
+
+    # 次の実行で最新のデータを読み込み直すので、もう一度実行すれば書き込める
+    at.button(key='execute_import').click().run()
+
+    assert not any(STALE_WARNING in warning.value for warning in at.warning)
+    assert [row['用語 (Term)'] for row in supabase_db.rows('vocab_alice')] == [f'Imported{i}' for i in range(1, 6)]
+
+
+def test_test_progress_applied_to_latest_data(open_app, supabase_db):
+    at = open_app()
+    at.session_state['current_page'] = 'テストモード'
+    at.session_state['test_answer_mode_radio'] = ('1問ずつ回答', 'per_question')
+    at.run()
+    at.button(key='start_test_button').click().run()
+    questions = at.session_state.test_mode['questions']
+
+    def answer_next_question():
+        if at.main.radio:
+            at.main.radio[0].set_value(at.main.radio[0].options[0])
+        at.button(key='next_q').click().run()
+        assert not at.exception
+
+    for _ in questions[:-1]:
+        answer_next_question()
+    # 最後の回答の直前に、出題された用語の説明を別のタブ・端末が書き換える
+    edited_id = questions[0]['term_id']
+    edited_row = next(row for row in supabase_db.rows('vocab_alice') if row['ID'] == edited_id)
+    supabase_db.table('vocab_alice').upsert([dict(edited_row, **{'説明 (Definition)': 'EditedElsewhere'})]).execute()
+    supabase_db.calls.clear()
+    answer_next_question()
+
+    assert at.session_state.test_mode.get('graded')
+    assert not any(STALE_WARNING in warning.value for warning in at.warning)
+    assert supabase_db.writes() == [('vocab_alice', 'upsert'), ('test_results_alice', 'insert')]
+    edited_row = next(row for row in supabase_db.rows('vocab_alice') if row['ID'] == edited_id)
+    assert edited_row['説明 (Definition)'] == 'EditedElsewhere' # 学習進捗の書き込みで古い説明に戻さない
@@ -0,0 +1,1078 @@
+"""
+用語集アプリ (app23・app24 の GAS 版、app25 の Supabase 版) で共通の、保存先に依存しない処理。
+データ型の変換・絞り込みと検索・エクスポートとインポートの読み込み・サンプリングなどをまとめ、
+各アプリには保存先との読み書きと画面の処理だけを置く。
+"""
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
+import codecs
+import os
+import random
+import time
+import re
+import threading
+import zlib
+import unicodedata
+from collections import OrderedDict
+import streamlit.components.v1 as components
+
+# --- 設定項目 ---
+VOCAB_HEADERS = ['ID', '用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)', '学習進捗 (Progress)']
+TEST_RESULTS_HEADERS = ['Date', 'Category', 'TestType', 'Score', 'TotalQuestions', 'Details']
+
+# --- カスタムコンポーネント ---
+# テスト問題一式をブラウザ側で回答させ、回答をまとめて一度だけ送信するコンポーネント
+COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+batched_quiz = components.declare_component("batched_quiz", path=os.path.join(COMPONENTS_DIR, "batched_quiz"))
+# 用語の入力欄。キー入力が途切れるたびに入力中の用語を送り、登録済みの候補・重複の表示をその場で更新する
+term_input = components.declare_component("term_input", path=os.path.join(COMPONENTS_DIR, "term_input"))
+TERM_INPUT_DEBOUNCE_MS = 250 # 最後のキー入力からこの時間で入力中の用語を送る
+# 学習モードの用語カードをウィンドウ単位で受け取り、ページ送りとカードめくりをブラウザ内で行うコンポーネント
+flashcards = components.declare_component("flashcards", path=os.path.join(COMPONENTS_DIR, "flashcards"))
+FLASHCARD_WINDOW_SIZE = 50 # 一度にブラウザへ送るカード枚数
+FLASHCARD_PREFETCH_MARGIN = 10 # ウィンドウ端からこの枚数以内に近づいたら次のウィンドウを要求
+
+
+# --- 学習不足用語の重み付きサンプリング (エイリアス法) ---
+PROGRESS_WEIGHT_FACTOR = {'Not Started': 1.0, 'Learning': 1.0, 'Mastered': 0.25}
+RECENCY_HALF_LIFE_DAYS = 7.0
+MIN_SAMPLING_WEIGHT = 1e-3
+
+def compute_term_stats(test_results_df):
+    """テスト結果の全Detailsから、用語ごとの出題回数・誤答数・最終出題日 (日付) を集計する"""
+    attempts = {}
+    errors = {}
+    last_tested = {}
+    if not test_results_df.empty:
+        for test_date, details in zip(test_results_df['Date'], test_results_df['Details']):
+            for detail in details_to_list(details):
+                term_id = detail.get('term_id')
+                if term_id is None or pd.isna(term_id):
+                    continue
+                term_id = int(term_id)
+                attempts[term_id] = attempts.get(term_id, 0) + 1
+                if not detail.get('is_correct'):
+                    errors[term_id] = errors.get(term_id, 0) + 1
+                if pd.isna(test_date):
+                    continue
+                test_date = pd.Timestamp(test_date)
+                if test_date.tzinfo is not None:
+                    test_date = test_date.tz_convert(None)
+                test_date = test_date.normalize()
+                if term_id not in last_tested or test_date > last_tested[term_id]:
+                    last_tested[term_id] = test_date
+    return {'attempts': attempts, 'errors': errors, 'last_tested': last_tested}
+
+def get_term_stats(test_results_df):
+    """用語ごとの集計をテスト結果のデータバージョンごとにキャッシュする (テストを始めるたびに全Detailsを走査しない)"""
+    version = get_data_version(test_results_df)
+    cache = st.session_state.get('term_stats_cache')
+    if cache is None or cache['key'] != version:
+        cache = {'key': version, 'stats': compute_term_stats(test_results_df)}
+        st.session_state.term_stats_cache = cache
+    return cache['stats']
+
+def compute_term_weights(vocab_df, term_stats, today):
+    """用語ごとの誤答率と最終出題日 (today からの経過日数) からサンプリング用の重みを計算する"""
+    attempts, errors, last_tested = term_stats['attempts'], term_stats['errors'], term_stats['last_tested']
+    weights = []
+    for term_id, progress in zip(vocab_df['ID'], vocab_df['学習進捗 (Progress)']):
+        term_id = int(term_id) if pd.notna(term_id) else None
+        # 誤答率 (ラプラス平滑化): 未出題の用語は 0.5 から始まる
+        error_rate = (errors.get(term_id, 0) + 1) / (attempts.get(term_id, 0) + 2)
+        # 直近に出題した用語ほど重みを下げる (未出題なら 1.0)
+        if term_id in last_tested:
+            days_since = max((today - last_tested[term_id]).days, 0)
+            recency = 1.0 - 0.5 ** (days_since / RECENCY_HALF_LIFE_DAYS)
+        else:
+            recency = 1.0
+        weight = error_rate * recency * PROGRESS_WEIGHT_FACTOR.get(progress, 1.0)
+        weights.append(max(weight, MIN_SAMPLING_WEIGHT))
+    return weights
+
+def build_alias_table(weights):
+    """Walker のエイリアス法のテーブルを O(n) で構築する"""
+    n = len(weights)
+    total = float(sum(weights))
+    scaled = [w * n / total for w in weights]
+    prob = [0.0] * n
+    alias = [0] * n
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = (scaled[l] + scaled[s]) - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    for i in large + small: # 丸め誤差で残ったものは確率1
+        prob[i] = 1.0
+    return prob, alias
+
+def get_sampling_table(df_vocab, available_vocab, test_results_df, category):
+    """
+    出題候補 available_vocab の重みとエイリアステーブルを返す。
+    (用語・テスト結果のデータバージョン, カテゴリ, 日付) ごとにキャッシュし、データが変わるか日付が変わった場合にのみ作り直す
+    """
+    today = pd.Timestamp.now().normalize() # 最終出題日からの経過は日単位で数えるので、同じ日の間はキーが変わらない
+    key = (get_data_version(df_vocab), get_data_version(test_results_df), category, today)
+    cache = st.session_state.get('alias_table_cache')
+    if cache is None or cache['key'] != key:
+        weights = compute_term_weights(available_vocab, get_term_stats(test_results_df), today)
+        cache = {'key': key, 'weights': weights, 'table': build_alias_table(weights)}
+        st.session_state.alias_table_cache = cache
+    return cache['weights'], cache['table']
+
+def weighted_sample_without_replacement(weights, k, alias_table=None):
+    """エイリアステーブルから O(1) で抽選し、重複は棄却して k 件の位置を返す"""
+    n = len(weights)
+    k = min(k, n)
+    prob, alias = alias_table if alias_table is not None else build_alias_table(weights)
+    selected = []
+    seen = set()
+    rejections = 0
+    while len(selected) < k:
+        i = random.randrange(n)
+        pick = i if random.random() < prob[i] else alias[i]
+        if pick in seen:
+            rejections += 1
+            # 棄却が続く場合 (重みが一部に偏っている場合) は残りの用語でテーブルを作り直す
+            if rejections > 4 * k + 16:
+                remaining = [j for j in range(n) if j not in seen]
+                remaining_weights = [weights[j] for j in remaining]
+                sub_positions = weighted_sample_without_replacement(remaining_weights, k - len(selected))
+                selected.extend(remaining[j] for j in sub_positions)
+                break
+            continue
+        seen.add(pick)
+        selected.append(pick)
+    return selected
+
+
+# --- データのバージョン管理 ---
+def get_data_version(df):
+    """データフレームのバージョンを返す (読み込み時・書き込み成功時に更新されるトークン)"""
+    if 'data_version' not in df.attrs:
+        df.attrs['data_version'] = time.time_ns()
+    return df.attrs['data_version']
+
+def bump_data_version(df):
+    df.attrs['data_version'] = time.time_ns()
+
+
+# --- 省メモリなデータ型 (カテゴリ型・Arrow文字列・列指向のDetails) ---
+PROGRESS_LEVELS = ['Not Started', 'Learning', 'Mastered']
+ARROW_STRING_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan) # 欠損値は従来どおり NaN として扱う
+
+def compact_vocab_frame(df):
+    """用語データの文字列列をArrow文字列に、カテゴリ・学習進捗をカテゴリ型に変換する (dfをその場で変更して返す)"""
+    for col in ['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)']:
+        if col in df.columns:
+            df[col] = df[col].astype(ARROW_STRING_DTYPE)
+    if 'カテゴリ (Category)' in df.columns:
+        df['カテゴリ (Category)'] = df['カテゴリ (Category)'].astype('category')
+    if '学習進捗 (Progress)' in df.columns:
+        # 進捗の更新で代入する値は常にカテゴリに含めておく
+        progress = df['学習進捗 (Progress)'].astype(ARROW_STRING_DTYPE)
+        extra_levels = sorted(set(progress.dropna()) - set(PROGRESS_LEVELS))
+        df['学習進捗 (Progress)'] = progress.astype(pd.CategoricalDtype(PROGRESS_LEVELS + extra_levels))
+    return df
+
+def compact_test_results_frame(df):
+    """テスト結果のカテゴリ・形式をカテゴリ型に、Detailsを列指向の形式に変換する (dfをその場で変更して返す)"""
+    for col in ['Category', 'TestType']:
+        if col in df.columns:
+            df[col] = df[col].astype(ARROW_STRING_DTYPE).astype('category')
+    if 'Details' in df.columns:
+        df['Details'] = encode_details_column(df['Details'])
+    return df
+
+def encode_details_column(details):
+    """Detailsを Arrow の list<struct> 型 (問題の項目ごとに列として保持) に変換する。項目の型が揃わない場合は元のまま返す"""
+    if isinstance(details.dtype, pd.ArrowDtype): # スナップショットのファイルから読み込んだ列など、既に変換済み
+        return details
+    try:
+        arrow_details = pa.array([details_to_list(item) for item in details])
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        return details
+    return pd.Series(pd.arrays.ArrowExtensionArray(arrow_details), index=details.index)
+
+def details_to_list(details):
+    """Details 1件分をPythonの辞書のリストとして返す (Arrow由来の配列もリストに戻す)"""
+    if isinstance(details, np.ndarray):
+        details = details.tolist()
+    return details if isinstance(details, list) else []
+
+def decode_details_column(details):
+    """列指向で保持しているDetailsを、書き込み・ダウンロード用に辞書のリストの列に戻す"""
+    return pd.Series([details_to_list(item) for item in details], index=details.index, dtype=object)
+
+def with_plain_categories(df):
+    """カテゴリ型の列を文字列列に戻したコピーを返す (カテゴリにない値を代入する前に使う)"""
+    return df.astype({col: ARROW_STRING_DTYPE for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+
+def frame_memory_report(name, df):
+    """列ごとのデータ型とメモリ使用量をデータのバージョンごとにキャッシュして返す"""
+    cache = st.session_state.setdefault('memory_report_cache', {})
+    version = get_data_version(df)
+    if name not in cache or cache[name][0] != version:
+        report = pd.DataFrame({
+            '型': df.dtypes.astype(str),
+            'メモリ (KB)': (df.memory_usage(index=False, deep=True) / 1024).round(1)
+        })
+        cache[name] = (version, report)
+    return cache[name][1]
+
+def render_memory_report(frames):
+    with st.sidebar.expander("🧠 メモリ使用量"):
+        for name, df in frames.items():
+            report = frame_memory_report(name, df)
+            st.write(f"**{name}**: {len(df)} 行 / {report['メモリ (KB)'].sum():.1f} KB")
+            st.dataframe(report, use_container_width=True)
+
+
+# --- カテゴリ・学習進捗の絞り込みインデックス ---
+FILTER_INDEX_COLUMNS = ['カテゴリ (Category)', '学習進捗 (Progress)']
+FILTER_INDEX_VERSIONS_KEPT = 2
+EMPTY_POSITIONS = np.array([], dtype=np.int64)
+
+def build_filter_index(df):
+    """列の値ごとの行位置 (昇順の位置配列) と値の一覧をまとめたインデックスを作る"""
+    positions = {}
+    for col in FILTER_INDEX_COLUMNS:
+        groups = df.groupby(col, observed=True, sort=False).indices if not df.empty else {}
+        positions[col] = {value: np.asarray(pos, dtype=np.int64) for value, pos in groups.items()}
+    return make_filter_index(positions)
+
+def make_filter_index(positions):
+    return {
+        'positions': positions,
+        'values': {col: sorted(col_positions) for col, col_positions in positions.items()},
+        'counts': {col: {value: len(pos) for value, pos in col_positions.items()} for col, col_positions in positions.items()}
+    }
+
+def store_filter_index(version, index):
+    cache = st.session_state.setdefault('filter_index_cache', {})
+    cache[version] = index
+    for stale_version in list(cache)[:-FILTER_INDEX_VERSIONS_KEPT]:
+        del cache[stale_version]
+
+def get_filter_index(df):
+    """データのバージョンごとの絞り込みインデックスを返す (未構築の場合のみ全行から作る)"""
+    version = get_data_version(df)
+    index = st.session_state.setdefault('filter_index_cache', {}).get(version)
+    if index is None:
+        index = build_filter_index(df)
+        store_filter_index(version, index)
+    return index
+
+def carry_filter_index(old_df, new_df, removed_positions=(), changed_positions=(), appended_from=None):
+    """編集前のインデックスから変更行だけを差し替えて、新しいバージョンのインデックスを作る
+    行の並びは 削除・その場での更新・末尾への追加 だけで変わっている前提 (位置はいずれも編集前の位置)"""
+    old_index = st.session_state.setdefault('filter_index_cache', {}).get(get_data_version(old_df))
+    if old_index is None: # 編集前のインデックスがなければ、次に参照したときに作る
+        return
+    removed = np.sort(np.asarray(removed_positions, dtype=np.int64))
+    changed = np.setdiff1d(np.asarray(changed_positions, dtype=np.int64), removed) # 削除された行は更新しない
+    dropped = np.union1d(removed, changed)
+    # 変更行の新しい位置 (削除された行の分だけ前に詰める) と末尾に追加された行の位置
+    readded = changed - np.searchsorted(removed, changed)
+    if appended_from is not None:
+        readded = np.concatenate([readded, np.arange(appended_from, len(new_df), dtype=np.int64)])
+    positions = {}
+    for col in FILTER_INDEX_COLUMNS:
+        col_positions = {}
+        for value, pos in old_index['positions'][col].items():
+            kept = np.setdiff1d(pos, dropped, assume_unique=True)
+            col_positions[value] = kept - np.searchsorted(removed, kept)
+        additions = {}
+        for position, value in zip(readded, new_df[col].iloc[readded]):
+            if pd.notna(value):
+                additions.setdefault(value, []).append(position)
+        for value, added in additions.items():
+            col_positions[value] = np.sort(np.concatenate([col_positions.get(value, EMPTY_POSITIONS), added]))
+        positions[col] = {value: pos for value, pos in col_positions.items() if len(pos) > 0}
+    store_filter_index(get_data_version(new_df), make_filter_index(positions))
+
+def filter_values(df, col):
+    """列に含まれる値 (欠損値を除く) の一覧"""
+    return get_filter_index(df)['values'][col]
+
+def filter_count(df, col, value):
+    return get_filter_index(df)['counts'][col].get(value, 0)
+
+def filter_positions(df, conditions):
+    """{列: 値} の条件をすべて満たす行の位置 (昇順) を返す。条件がなければ None (全行)"""
+    index = get_filter_index(df)
+    result = None
+    for col, value in conditions.items():
+        positions = index['positions'][col].get(value, EMPTY_POSITIONS)
+        result = positions if result is None else np.intersect1d(result, positions, assume_unique=True)
+    return result
+
+def filter_frame(df, conditions):
+    """絞り込みインデックスを使って条件に一致する行を返す (コピーは表示用の部分だけ)"""
+    positions = filter_positions(df, conditions)
+    return df if positions is None else df.iloc[positions]
+
+
+# --- 検索用の正規化テキスト (全角・半角、大文字・小文字、ひらがな・カタカナの違いを吸収) ---
+SEARCH_TEXT_COLUMNS = ['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)']
+SEARCH_INDEX_CACHE_SIZE = 64 # 正規化済みテキスト・トライ木を保持する件数 (全セッション合計)
+KATAKANA_TO_HIRAGANA = str.maketrans({chr(code): chr(code - 0x60) for code in range(0x30A1, 0x30F7)})
+
+def normalize_search_text(text):
+    """NFKC正規化 (全角英数→半角、半角カナ→全角) の後、大文字小文字を揃えてカタカナをひらがなにする"""
+    return unicodedata.normalize('NFKC', text).casefold().translate(KATAKANA_TO_HIRAGANA)
+
+@st.cache_resource
+def get_search_index_store():
+    """全セッションで共有する {(種類, データのバージョン): 検索用データ} のストア"""
+    return {'lock': threading.Lock(), 'indexes': OrderedDict()}
+
+def get_search_index(kind, df, build):
+    """データのバージョンごとに一度だけ build(df) で作った検索用データを、全セッションで共有して返す"""
+    store = get_search_index_store()
+    key = (kind, get_data_version(df))
+    with store['lock']:
+        index = store['indexes'].get(key)
+    if index is None:
+        index = build(df)
+        with store['lock']:
+            store['indexes'][key] = index
+            while len(store['indexes']) > SEARCH_INDEX_CACHE_SIZE:
+                store['indexes'].popitem(last=False)
+    return index
+
+def build_search_columns(df):
+    """検索対象の列を normalize_search_text と同じ手順で正規化した影の列を作る (インデックスは行位置)"""
+    shadow = {}
+    for col in SEARCH_TEXT_COLUMNS:
+        if col in df.columns:
+            values = df[col].astype(ARROW_STRING_DTYPE).reset_index(drop=True)
+            shadow[col] = values.str.normalize('NFKC').str.casefold().str.translate(KATAKANA_TO_HIRAGANA)
+    return pd.DataFrame(shadow, index=pd.RangeIndex(len(df)))
+
+def prepare_search_columns(df):
+    """正規化済みテキストをデータのバージョンごとに一度だけ作り、セッション間で共有する"""
+    return get_search_index('columns', df, build_search_columns)
+
+
+# --- 用語の前方一致インデックス (トライ木) ---
+TERM_SUGGESTION_LIMIT = 5 # 追加フォームに表示する登録済み用語の候補数
+
+def build_term_trie(df):
+    """正規化した用語のトライ木を作る。ノードは [子ノードの辞書, ここで終わる用語のリスト, 部分木に含まれる用語数]"""
+    root = [{}, [], 0]
+    for term, normalized in zip(df['用語 (Term)'], prepare_search_columns(df)['用語 (Term)']):
+        if pd.isna(term):
+            continue
+        node = root
+        node[2] += 1
+        for char in normalized.strip():
+            node = node[0].setdefault(char, [{}, [], 0])
+            node[2] += 1
+        node[1].append(str(term))
+    return root
+
+def get_term_trie(df):
+    return get_search_index('term_trie', df, build_term_trie)
+
+def find_trie_node(trie, prefix):
+    node = trie
+    for char in normalize_query(prefix):
+        node = node[0].get(char)
+        if node is None:
+            return None
+    return node
+
+def find_existing_terms(df, term):
+    """正規化すると同じになる登録済みの用語を返す (全角・半角や大文字・小文字だけが違う用語も重複とみなす)"""
+    node = find_trie_node(get_term_trie(df), term)
+    return list(node[1]) if node is not None else []
+
+def complete_terms(df, prefix, limit):
+    """prefix で始まる登録済みの用語を (正規化した表記の) 辞書順に最大 limit 件と、該当する用語の総数を返す"""
+    node = find_trie_node(get_term_trie(df), prefix)
+    if node is None:
+        return [], 0
+    terms = []
+    stack = [node]
+    while stack and len(terms) < limit:
+        current = stack.pop()
+        terms.extend(current[1][:limit - len(terms)])
+        stack.extend(current[0][char] for char in sorted(current[0], reverse=True))
+    return terms, node[2]
+
+def render_term_suggestions(df_vocab, term):
+    """入力中の用語で始まる登録済みの用語を表示し、同じ用語が登録済みなら警告する。登録済みの同じ用語のリストを返す"""
+    if not term or not term.strip():
+        return []
+    existing_terms = find_existing_terms(df_vocab, term)
+    if existing_terms:
+        st.warning(f"「{existing_terms[0]}」は既に登録されています。")
+        return existing_terms
+    suggestions, total = complete_terms(df_vocab, term, TERM_SUGGESTION_LIMIT)
+    if suggestions:
+        more = f" ほか {total - len(suggestions)} 件" if total > len(suggestions) else ""
+        st.caption("登録済みの用語: " + " / ".join(suggestions) + more)
+    return []
+
+def render_term_input(df_vocab, label, key, placeholder=""):
+    """
+    用語の入力欄と、入力中の用語で始まる登録済みの用語・重複の警告を表示する (入力のたびにこの部分だけを再実行する)。
+    (入力中の用語, 登録済みの同じ用語のリスト) を返す
+    """
+    def term_input_with_suggestions():
+        term = term_input(label=label, placeholder=placeholder, value=st.session_state.get(key) or "",
+                          debounce_ms=TERM_INPUT_DEBOUNCE_MS, key=key, default="")
+        render_term_suggestions(df_vocab, term)
+    st.fragment(term_input_with_suggestions)()
+    term = st.session_state.get(key) or ""
+    return term, find_existing_terms(df_vocab, term) if term.strip() else []
+
+
+# --- 絞り込み・検索結果のメモ化 ---
+FILTER_CACHE_SIZE = 32 # セッションごとに保持する絞り込み結果の数 (LRU)
+
+def normalize_query(query):
+    """検索語を正規化済みテキストと照合する形に揃える (検索1回につき検索語の正規化だけを行う)"""
+    return normalize_search_text((query or '').strip())
+
+def match_query(df, positions, search_cols, query):
+    """行位置 positions のうち、search_cols の正規化済みテキストのいずれかに検索語を含む行を True とする配列を返す"""
+    shadow = prepare_search_columns(df).iloc[positions]
+    matched = np.zeros(len(shadow), dtype=bool)
+    for col in search_cols:
+        matched |= shadow[col].str.contains(query, regex=False, na=False).to_numpy()
+    return matched
+
+def search_positions(df, conditions, query, search_cols):
+    """絞り込み条件 {列: 値} と検索語に一致する行の位置 (昇順) を返す
+    結果は (データのバージョン, 絞り込み条件, 検索対象列, 正規化した検索語) ごとにLRUキャッシュし、
+    キャッシュ済みの検索語を含む検索語 (1文字追加した場合など) はその結果の行だけを検索する"""
+    cache = st.session_state.setdefault('filter_cache', OrderedDict())
+    stats = st.session_state.setdefault('filter_cache_stats', {'hits': 0, 'narrowed': 0, 'misses': 0})
+    query = normalize_query(query)
+    base_key = (get_data_version(df), tuple(sorted(conditions.items())), tuple(search_cols))
+    key = base_key + (query,)
+    if key in cache:
+        cache.move_to_end(key)
+        stats['hits'] += 1
+        return cache[key]
+
+    # 今の検索語に含まれる検索語の結果があれば、そのうち最も長いもの (最も絞り込まれたもの) から検索する
+    narrowed_from = max((cached_key[-1] for cached_key in cache
+                         if cached_key[:-1] == base_key and cached_key[-1] in query), key=len, default=None)
+    if narrowed_from is not None:
+        candidates = cache[base_key + (narrowed_from,)]
+        stats['narrowed'] += 1
+    else:
+        candidates = filter_positions(df, conditions)
+        if candidates is None:
+            candidates = np.arange(len(df), dtype=np.int64)
+        stats['misses'] += 1
+    positions = candidates[match_query(df, candidates, search_cols, query)] if query else candidates
+
+    cache[key] = positions
+    if len(cache) > FILTER_CACHE_SIZE:
+        cache.popitem(last=False)
+    return positions
+
+def format_filter_cache_stats():
+    stats = st.session_state.get('filter_cache_stats', {'hits': 0, 'narrowed': 0, 'misses': 0})
+    total = stats['hits'] + stats['narrowed'] + stats['misses']
+    if total == 0:
+        return "絞り込み・検索キャッシュ: 計測なし"
+    return (f"絞り込み・検索キャッシュ: ヒット率 {stats['hits'] / total:.0%} "
+            f"(ヒット {stats['hits']} / 前回結果から検索 {stats['narrowed']} / 全件から検索 {stats['misses']})")
+
+
+# --- エクスポート (ダウンロードボタンが押されたときに生成し、データのバージョンごとにキャッシュ) ---
+EXPORT_CHUNK_ROWS = 5000 # 一度に文字列にする行数
+EXPORT_CACHE_SIZE = 4 # 生成済みのエクスポートを保持する件数 (全セッション合計)
+
+@st.cache_resource
+def get_export_store():
+    """全セッションで共有する {(種類, データのバージョン): エクスポートのバイト列} のストア"""
+    return {'lock': threading.Lock(), 'exports': OrderedDict()}
+
+def get_export(kind, df, build):
+    """データのバージョンごとに一度だけ build(df) でエクスポートを生成し、セッション間で共有する"""
+    store = get_export_store()
+    key = (kind, get_data_version(df))
+    with store['lock']:
+        data = store['exports'].get(key)
+        if data is not None:
+            store['exports'].move_to_end(key)
+    if data is None:
+        data = build(df)
+        with store['lock']:
+            store['exports'][key] = data
+            while len(store['exports']) > EXPORT_CACHE_SIZE:
+                store['exports'].popitem(last=False)
+    return data
+
+def export_data_source(kind, df, build):
+    """download_button の data に渡す関数。ページの表示時ではなく、ボタンが押されたときに (別スレッドで) 呼ばれる"""
+    return lambda: get_export(kind, df, build)
+
+def iter_csv_export_chunks(df, prepare_chunk=None):
+    """df を EXPORT_CHUNK_ROWS 行ずつCSVの文字列にして返す (ヘッダーは最初のチャンクのみ)"""
+    for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+        if prepare_chunk is not None:
+            chunk = prepare_chunk(chunk)
+        yield chunk.to_csv(index=False, header=(start == 0))
+
+def build_csv_export(df, prepare_chunk=None):
+    return b''.join(text.encode('utf-8') for text in iter_csv_export_chunks(df, prepare_chunk))
+
+def iter_json_export_chunks(df):
+    """df を EXPORT_CHUNK_ROWS 行ずつ orient="records" のJSONにして、1つの配列になるようにつないで返す"""
+    yield '['
+    wrote = False
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        records = df.iloc[start:start + EXPORT_CHUNK_ROWS].to_json(orient="records", force_ascii=False)[1:-1]
+        if records:
+            yield (',' if wrote else '') + records
+            wrote = True
+    yield ']'
+
+def build_json_export(df):
+    return b''.join(text.encode('utf-8') for text in iter_json_export_chunks(df))
+
+
+# --- Parquet・Arrow IPC 形式の入出力 (Detailsは list<struct> のまま保存し、インポート時にスキーマを検証する) ---
+ARROW_IMPORT_EXTENSIONS = ('.parquet', '.arrow', '.feather')
+ARROW_READ_BATCH_ROWS = 5000 # Parquetファイルを一度に読み込む行数
+DETAILS_REQUIRED_FIELDS = ['question_text', 'correct_answer', 'user_answer', 'is_correct'] # テスト結果の表示・レビューで使う項目
+VOCAB_ARROW_SCHEMA = pa.schema([
+    ('ID', pa.int64()),
+    ('用語 (Term)', pa.string()),
+    ('説明 (Definition)', pa.string()),
+    ('例文 (Example)', pa.string()),
+    ('カテゴリ (Category)', pa.string()),
+    ('学習進捗 (Progress)', pa.string()),
+])
+# Dateのタイムゾーン (GAS版はなし、Supabase版はUTC) とDetailsの型は書き出すデータから決まるので、書き出すときに追加する
+TEST_RESULTS_ARROW_SCHEMA = pa.schema([
+    ('Category', pa.string()),
+    ('TestType', pa.string()),
+    ('Score', pa.int64()),
+    ('TotalQuestions', pa.int64()),
+])
+
+def is_arrow_text(arrow_type):
+    if pa.types.is_dictionary(arrow_type):
+        return is_arrow_text(arrow_type.value_type)
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type) or pa.types.is_null(arrow_type)
+
+def is_arrow_integer(arrow_type):
+    return pa.types.is_integer(arrow_type) or pa.types.is_null(arrow_type)
+
+def is_arrow_timestamp(arrow_type):
+    return pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type)
+
+def is_arrow_details(arrow_type):
+    """Detailsが問題ごとの構造体のリスト (list<struct>) で、必要な項目を含んでいるか (全テストが空なら list<null> も可)"""
+    if not (pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type)):
+        return False
+    item_type = arrow_type.value_type
+    if pa.types.is_null(item_type):
+        return True
+    return pa.types.is_struct(item_type) and all(item_type.get_field_index(name) >= 0 for name in DETAILS_REQUIRED_FIELDS)
+
+VOCAB_ARROW_CHECKS = {
+    'ID': is_arrow_integer,
+    '用語 (Term)': is_arrow_text,
+    '説明 (Definition)': is_arrow_text,
+    '例文 (Example)': is_arrow_text,
+    'カテゴリ (Category)': is_arrow_text,
+    '学習進捗 (Progress)': is_arrow_text,
+}
+TEST_RESULTS_ARROW_CHECKS = {
+    'Date': is_arrow_timestamp,
+    'Category': is_arrow_text,
+    'TestType': is_arrow_text,
+    'Score': is_arrow_integer,
+    'TotalQuestions': is_arrow_integer,
+    'Details': is_arrow_details,
+}
+
+def frame_to_arrow_table(df, schema):
+    """df の列を schema の型に揃えた Arrow テーブルにする (カテゴリ型は文字列に戻す)"""
+    table = pa.Table.from_pandas(with_plain_categories(df[schema.names]), preserve_index=False)
+    return table.cast(schema)
+
+def test_results_arrow_table(df):
+    """テスト結果を Arrow テーブルにする。Detailsは列指向で保持している list<struct> の型をそのまま使う"""
+    table = pa.Table.from_pandas(with_plain_categories(df[TEST_RESULTS_HEADERS]), preserve_index=False)
+    date_field = pa.field('Date', pa.timestamp('us', tz=getattr(table.schema.field('Date').type, 'tz', None)))
+    return table.cast(pa.schema([date_field, *TEST_RESULTS_ARROW_SCHEMA, table.schema.field('Details')]))
+
+def build_arrow_export(table, file_format):
+    """Arrow テーブルを Parquet (zstd圧縮) または Arrow IPC のファイル形式のバイト列にする"""
+    sink = pa.BufferOutputStream()
+    if file_format == 'parquet':
+        pq.write_table(table, sink, compression='zstd', row_group_size=EXPORT_CHUNK_ROWS)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=EXPORT_CHUNK_ROWS)
+    return sink.getvalue().to_pybytes()
+
+def build_vocab_parquet_export(df):
+    return build_arrow_export(frame_to_arrow_table(df, VOCAB_ARROW_SCHEMA), 'parquet')
+
+def build_vocab_arrow_export(df):
+    return build_arrow_export(frame_to_arrow_table(df, VOCAB_ARROW_SCHEMA), 'arrow')
+
+def build_test_results_parquet_export(df):
+    return build_arrow_export(test_results_arrow_table(df), 'parquet')
+
+def build_test_results_arrow_export(df):
+    return build_arrow_export(test_results_arrow_table(df), 'arrow')
+
+def open_arrow_import(uploaded_file):
+    """Parquet・Arrow IPC (ファイル形式またはストリーム形式) のファイルを開き、(スキーマ, レコードバッチのイテレータ) を返す"""
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(uploaded_file)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=ARROW_READ_BATCH_ROWS)
+    buffer = pa.py_buffer(uploaded_file.getbuffer())
+    try:
+        reader = pa.ipc.open_file(buffer)
+        return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        pass
+    try:
+        reader = pa.ipc.open_stream(buffer)
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Arrow IPC形式のファイルとして読み込めませんでした: {e}")
+    return reader.schema, iter(reader)
+
+def validate_arrow_schema(schema, column_checks, required_cols=()):
+    """インポートするファイルのスキーマを検証し、不足している列・型が合わない列をまとめて ValueError で知らせる"""
+    problems = [f"{col} (列がありません)" for col in required_cols if col not in schema.names]
+    problems += [f"{field.name} (型: {field.type})" for field in schema
+                 if field.name in column_checks and not column_checks[field.name](field.type)]
+    if problems:
+        raise ValueError(f"ファイルのスキーマが想定と異なります: {', '.join(problems)}")
+
+def read_arrow_import(uploaded_file, column_checks, required_cols=()):
+    """スキーマを検証してから、ファイル全体をDataFrameとして読み込む"""
+    schema, batches = open_arrow_import(uploaded_file)
+    validate_arrow_schema(schema, column_checks, required_cols)
+    return pa.Table.from_batches(list(batches), schema=schema).to_pandas()
+
+# --- ページ分割テーブル表示 ---
+TABLE_PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+
+def get_sorted_index(df, sort_column, ascending):
+    """並べ替え順 (インデックスの並び) をデータのバージョンごとにキャッシュする"""
+    cache = st.session_state.setdefault('sorted_index_cache', {})
+    cache_key = (get_data_version(df), sort_column, ascending)
+    if cache_key not in cache:
+        # 別バージョンの並べ替え順は不要なので破棄
+        for stale_key in [k for k in cache if k[0] != cache_key[0]]:
+            del cache[stale_key]
+        cache[cache_key] = df.sort_values(by=sort_column, ascending=ascending, kind='stable').index
+    return cache[cache_key]
+
+def render_paginated_table(df, filtered_index, state_key, columns, filter_key=None):
+    """絞り込み結果のうち表示中のページだけを st.dataframe に渡す (ページサイズ・並べ替え・オフセットはセッションに保持)"""
+    state = st.session_state.setdefault(state_key, {
+        'page_size': 50,
+        'sort_column': columns[0],
+        'ascending': True,
+        'offset': 0,
+        'filter_key': None
+    })
+    if state['filter_key'] != filter_key: # 絞り込み条件が変わったら先頭ページに戻す
+        state['filter_key'] = filter_key
+        state['offset'] = 0
+
+    col_sort, col_order, col_page_size = st.columns([2, 1, 1])
+    with col_sort:
+        state['sort_column'] = st.selectbox("並べ替え:", columns, index=columns.index(state['sort_column']),
+                                            key=f"{state_key}_sort_column")
+    with col_order:
+        state['ascending'] = st.radio("順序:", [True, False], format_func=lambda x: "昇順" if x else "降順",
+                                      index=0 if state['ascending'] else 1, horizontal=True,
+                                      key=f"{state_key}_ascending")
+    with col_page_size:
+        state['page_size'] = st.selectbox("表示件数:", TABLE_PAGE_SIZE_OPTIONS,
+                                          index=TABLE_PAGE_SIZE_OPTIONS.index(state['page_size']),
+                                          key=f"{state_key}_page_size")
+
+    page_size = state['page_size']
+    total_rows = len(filtered_index)
+    last_offset = max(total_rows - 1, 0) // page_size * page_size
+    state['offset'] = min(state['offset'] // page_size * page_size, last_offset)
+
+    sorted_index = get_sorted_index(df, state['sort_column'], state['ascending'])
+    if total_rows < len(df):
+        sorted_index = sorted_index[sorted_index.isin(filtered_index)]
+    page_index = sorted_index[state['offset']:state['offset'] + page_size]
+
+    st.dataframe(df.loc[page_index, columns], use_container_width=True, hide_index=True)
+
+    col_prev, col_position, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("前のページ", key=f"{state_key}_prev", disabled=(state['offset'] == 0)):
+            state['offset'] -= page_size
+            st.rerun()
+    with col_position:
+        st.write(f"全 {total_rows} 件中 {state['offset'] + 1 if total_rows else 0}〜{state['offset'] + len(page_index)} 件")
+    with col_next:
+        if st.button("次のページ", key=f"{state_key}_next", disabled=(state['offset'] >= last_offset)):
+            state['offset'] += page_size
+            st.rerun()
+
+
+# --- インポートするファイルの分割読み込み ---
+IMPORT_CHUNK_ROWS = 5000 # ファイルを一度に読み込む行数
+IMPORT_JSON_READ_BYTES = 1 << 20 # JSONファイルを一度に読み込むバイト数
+JSON_ARRAY_SEPARATOR = re.compile(r'[\s,]*')
+JSON_LINES_SEPARATOR = re.compile(r'\s*')
+
+def iter_json_records(binary_file):
+    """
+    JSON (エクスポートと同じ orient="records" のレコードの配列) または JSON Lines のレコードを1件ずつ返す。
+    ファイルは IMPORT_JSON_READ_BYTES ずつ読み込んでパースするので、ファイル全体の文字列やオブジェクトを一度に持たない。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, pos, eof = '', 0, False
+    separator = None # 先頭が '[' なら配列、それ以外は JSON Lines として読む
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        block = binary_file.read(IMPORT_JSON_READ_BYTES)
+        eof = not block
+        buffer = buffer[pos:] + text_decoder.decode(block, final=eof)
+        pos = 0
+
+    while True:
+        pos = (separator or JSON_LINES_SEPARATOR).match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                if separator is JSON_ARRAY_SEPARATOR:
+                    raise ValueError("JSONの配列が ']' で閉じられていません。")
+                return
+            read_more()
+            continue
+        if separator is None:
+            separator = JSON_ARRAY_SEPARATOR if buffer[pos] == '[' else JSON_LINES_SEPARATOR
+            if separator is JSON_ARRAY_SEPARATOR:
+                pos += 1
+            continue
+        if separator is JSON_ARRAY_SEPARATOR and buffer[pos] == ']':
+            return
+        try:
+            record, pos_after = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            read_more() # レコードが読み込んだ範囲の途中で切れている
+            continue
+        if not isinstance(record, dict):
+            raise ValueError("JSONの各レコードは {\"列名\": 値} の形式である必要があります。")
+        pos = pos_after
+        yield record
+
+def iter_import_chunks(uploaded_file):
+    """
+    アップロードされたファイルを IMPORT_CHUNK_ROWS 行ずつのDataFrameとして返す (インデックスはファイル内の行位置)。
+    CSVは pd.read_csv の chunksize で、JSON・JSON Lines は iter_json_records で、Parquet・Arrow はレコードバッチごとに少しずつ読み込む。
+    """
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith('.csv'):
+        yield from pd.read_csv(uploaded_file, chunksize=IMPORT_CHUNK_ROWS)
+    elif uploaded_file.name.endswith(('.json', '.jsonl')):
+        records, start = [], 0
+        for record in iter_json_records(uploaded_file):
+            records.append(record)
+            if len(records) == IMPORT_CHUNK_ROWS:
+                yield pd.DataFrame(records, index=pd.RangeIndex(start, start + len(records)))
+                records, start = [], start + len(records)
+        if records:
+            yield pd.DataFrame(records, index=pd.RangeIndex(start, start + len(records)))
+    elif uploaded_file.name.endswith(ARROW_IMPORT_EXTENSIONS):
+        schema, batches = open_arrow_import(uploaded_file)
+        validate_arrow_schema(schema, VOCAB_ARROW_CHECKS) # 読み込み始める前に列の型を確かめる
+        start = 0
+        for batch in batches:
+            for offset in range(0, batch.num_rows, IMPORT_CHUNK_ROWS):
+                chunk = batch.slice(offset, IMPORT_CHUNK_ROWS).to_pandas()
+                chunk.index = pd.RangeIndex(start, start + len(chunk))
+                start += len(chunk)
+                yield chunk
+    else:
+        raise ValueError("サポートされていないファイル形式です。CSV・JSON・JSON Lines・Parquet・Arrowファイルをアップロードしてください。")
+
+def normalize_import_chunk(chunk):
+    """読み込んだチャンクを VOCAB_HEADERS の列に揃え、読み込み時 (load_data_from_supabase) と同じ規則で整える"""
+    chunk = chunk.reindex(columns=VOCAB_HEADERS)
+    for col in ['用語 (Term)', '説明 (Definition)', '例文 (Example)', 'カテゴリ (Category)']:
+        values = chunk[col].astype(ARROW_STRING_DTYPE).str.strip()
+        chunk[col] = values.mask(values == '')
+    chunk['ID'] = pd.to_numeric(chunk['ID'], errors='coerce')
+    chunk['例文 (Example)'] = chunk['例文 (Example)'].fillna('')
+    chunk['学習進捗 (Progress)'] = chunk['学習進捗 (Progress)'].fillna('Not Started')
+    return chunk.dropna(subset=['用語 (Term)', '説明 (Definition)'], how='all') # 両方空の行は取り込まない
+
+def iter_normalized_import_chunks(uploaded_file, file_stats):
+    """iter_import_chunks のチャンクを整えて返す。file_stats にファイルの行数と、ファイルに無かった列名を記録する"""
+    for chunk in iter_import_chunks(uploaded_file):
+        file_stats['rows'] += len(chunk)
+        file_stats['missing_cols'].update(col for col in VOCAB_HEADERS if col not in chunk.columns)
+        yield normalize_import_chunk(chunk)
+
+
+# --- インポート時の近似重複検出 (MinHash/LSH) ---
+SHINGLE_SIZE = 3 # 説明文を何文字ずつの断片 (シングル) に分けて比べるか
+MINHASH_NUM_PERM = 96 # MinHash の署名の長さ
+LSH_BANDS = 16 # 署名を分けるバンドの数 (1バンド6値。類似度がおよそ0.6以上の組が候補に残る)
+LSH_MAX_BUCKET_COMPARISONS = 32 # 同じバケットの中で1行と比べる先行行の上限 (定型文が多い場合に組み合わせが増えすぎないように)
+NEAR_DUPLICATE_THRESHOLD = 0.7 # 署名の一致率 (Jaccard係数の推定値) がこの値以上の組を近似重複とみなす
+MINHASH_PRIME = (1 << 31) - 1
+MINHASH_A, MINHASH_B = np.random.default_rng(20240601).integers(1, MINHASH_PRIME, size=(2, MINHASH_NUM_PERM), dtype=np.uint64)
+LSH_BAND_MULTIPLIERS = np.random.default_rng(20240602).integers(1, 1 << 62, size=MINHASH_NUM_PERM // LSH_BANDS, dtype=np.uint64) | np.uint64(1)
+
+def text_shingles(normalized_text):
+    """正規化済みの説明文を SHINGLE_SIZE 文字ずつの断片の集合にする (空の説明文は空集合)"""
+    if not isinstance(normalized_text, str):
+        return frozenset()
+    text = re.sub(r'\s+', ' ', normalized_text).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return frozenset([text]) if text else frozenset()
+    return frozenset(text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1))
+
+def minhash_signatures(normalized_texts):
+    """説明文ごとの MinHash 署名 (行数 x MINHASH_NUM_PERM) と、説明文が空でない行のマスクを返す"""
+    signatures = np.zeros((len(normalized_texts), MINHASH_NUM_PERM), dtype=np.uint32)
+    valid = np.zeros(len(normalized_texts), dtype=bool)
+    for position, text in enumerate(normalized_texts):
+        shingles = text_shingles(text)
+        if shingles:
+            hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) & MINHASH_PRIME for shingle in shingles),
+                                 dtype=np.uint64, count=len(shingles))
+            signatures[position] = ((MINHASH_A[:, None] * hashes[None, :] + MINHASH_B[:, None]) % MINHASH_PRIME).min(axis=1)
+            valid[position] = True
+    return signatures, valid
+
+def lsh_band_hashes(signatures):
+    """署名をバンドに分け、バンドごとの値を1つの整数にまとめる (行数 x LSH_BANDS)"""
+    bands = signatures.reshape(len(signatures), LSH_BANDS, MINHASH_NUM_PERM // LSH_BANDS).astype(np.uint64)
+    return (bands * LSH_BAND_MULTIPLIERS).sum(axis=2)
+
+def build_near_duplicate_index(df):
+    """既存の用語の説明文の MinHash 署名とバンドの値"""
+    signatures, valid = minhash_signatures(prepare_search_columns(df)['説明 (Definition)'].tolist())
+    return {'signatures': signatures, 'valid': valid, 'band_hashes': lsh_band_hashes(signatures)}
+
+def lsh_candidate_pairs(band_hashes, valid, first_imported):
+    """いずれかのバンドの値が一致する行の組 (先行行, 後続行) のうち、後続行がインポートの行 (first_imported 以降) の組"""
+    positions = np.flatnonzero(valid)
+    pairs = []
+    for band in range(LSH_BANDS):
+        order = positions[np.argsort(band_hashes[positions, band], kind='stable')] # 同じ値の中では行番号順
+        sorted_values = band_hashes[order, band]
+        starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            if end - start < 2 or order[end - 1] < first_imported:
+                continue
+            bucket = order[start:end]
+            for offset in range(max(1, np.searchsorted(bucket, first_imported)), len(bucket)):
+                earlier = bucket[:min(offset, LSH_MAX_BUCKET_COMPARISONS)]
+                pairs.append(np.column_stack([earlier, np.full(len(earlier), bucket[offset])]))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def find_near_duplicates(df_vocab, chunks, compare_existing=True):
+    """
+    インポートする用語の説明文を既存の用語集 (と、インポートする用語どうし) と比べ、近似重複のグループを返す。
+    チャンクごとに署名だけを作り、LSHで同じバケットに入った組だけを比べるので、おおむね行数に比例する時間で済む。
+    戻り値は (グループの一覧表, 取り込まないインポート行の位置のリスト)。
+    各グループでは既存の用語があればそれを、なければインポートで最初の行を残し、それ以外を取り込まない候補にする。
+    """
+    if compare_existing and not df_vocab.empty:
+        existing = get_search_index('near_duplicates', df_vocab, build_near_duplicate_index)
+    else:
+        signatures, valid = minhash_signatures([])
+        existing = {'signatures': signatures, 'valid': valid, 'band_hashes': lsh_band_hashes(signatures)}
+    offset = len(existing['signatures']) # 既存の行は 0..offset-1、インポートの行は offset + ファイル内の行位置 で扱う
+    signature_parts, valid_parts, row_parts = [existing['signatures']], [existing['valid']], []
+    total_rows = 0
+    for chunk in chunks:
+        # 正規化で除いた行の分も、ファイル内の行位置に合わせて空の署名で埋める
+        chunk_rows = pd.RangeIndex(total_rows, chunk.index.max() + 1 if len(chunk) else total_rows)
+        chunk = chunk.reindex(chunk_rows)
+        signatures, valid = minhash_signatures(build_search_columns(chunk)['説明 (Definition)'].tolist())
+        signature_parts.append(signatures)
+        valid_parts.append(valid)
+        row_parts.append(chunk[['ID', '用語 (Term)', '説明 (Definition)']])
+        total_rows = chunk_rows.stop
+    signatures = np.concatenate(signature_parts)
+    band_hashes = np.concatenate([existing['band_hashes'], lsh_band_hashes(signatures[offset:])])
+    pairs = lsh_candidate_pairs(band_hashes, np.concatenate(valid_parts), offset)
+    scores = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+
+    parent = {}
+    best_score = {}
+
+    def find_root(node):
+        while parent.get(node, node) != node:
+            node = parent[node]
+        return node
+
+    for (earlier, later), score in zip(pairs[scores >= NEAR_DUPLICATE_THRESHOLD].tolist(), scores[scores >= NEAR_DUPLICATE_THRESHOLD].tolist()):
+        parent[find_root(later)] = find_root(earlier)
+        for member in (earlier, later):
+            best_score[member] = max(best_score.get(member, 0.0), score)
+
+    imported_rows = pd.concat(row_parts) if row_parts else pd.DataFrame(columns=['ID', '用語 (Term)', '説明 (Definition)'])
+    groups = {}
+    for member in best_score:
+        groups.setdefault(find_root(member), []).append(member)
+    rows = []
+    skip_positions = []
+    for group_number, members in enumerate(sorted((sorted(members) for members in groups.values()), key=lambda m: m[0]), start=1):
+        keep = members[0] # 番号順なので先頭は既存の行 (なければインポートで最初の行)
+        group_skips = [member for member in members if member >= offset and member != keep]
+        skip_positions.extend(member - offset for member in group_skips)
+        for member in members:
+            source, row = ('既存', df_vocab.iloc[member]) if member < offset else ('インポート', imported_rows.loc[member - offset])
+            rows.append({
+                'グループ': group_number,
+                '由来': source,
+                'ID': row['ID'],
+                '用語 (Term)': row['用語 (Term)'],
+                '説明 (Definition)': row['説明 (Definition)'],
+                '類似度': round(best_score[member], 2),
+                '取り込み': '既存' if member < offset else ('取り込まない候補' if member in group_skips else '取り込む'),
+            })
+    clusters = pd.DataFrame(rows, columns=['グループ', '由来', 'ID', '用語 (Term)', '説明 (Definition)', '類似度', '取り込み'])
+    return clusters, sorted(skip_positions)
+
+def get_import_preview(uploaded_file, import_action, df_vocab):
+    """
+    ファイルを一度通して読み、近似重複の検出と取り込む行のIDの決定をまとめて行う。
+    結果は、ファイル・インポート方法・データのバージョンが変わるまでセッションに保持する (ファイルの中身は保持しない)。
+    """
+    file_key = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+    preview_key = (file_key, import_action, get_data_version(df_vocab))
+    preview = st.session_state.get('import_preview')
+    if preview is None or preview['key'] != preview_key:
+        overwrite = import_action == "既存データを上書き"
+        file_stats = {'rows': 0, 'missing_cols': set()}
+        seen_keys = set() if overwrite else set(import_duplicate_keys(df_vocab).tolist())
+        plan_parts = []
+        chunks = iter_import_plan_chunks(iter_normalized_import_chunks(uploaded_file, file_stats), seen_keys, plan_parts)
+        clusters, skip_positions = find_near_duplicates(df_vocab, chunks, compare_existing=not overwrite)
+        rows = pd.concat(plan_parts) if plan_parts else pd.DataFrame(columns=['ID', '用語 (Term)'])
+        import_ids, id_report = plan_import_ids(rows, df_vocab, overwrite, file_stats['rows'])
+        preview = {'key': preview_key, 'missing_cols': [col for col in VOCAB_HEADERS if col in file_stats['missing_cols']],
+                   'clusters': clusters, 'skip_positions': skip_positions, 'total_rows': file_stats['rows'],
+                   'import_ids': import_ids, 'id_report': id_report}
+        st.session_state.import_preview = preview
+    return preview
+
+
+# --- 分割インポートの計画 (IDの割り当て・チェックポイント。書き込みは各アプリで行う) ---
+def new_import_checkpoint(import_key, overwrite):
+    """インポートの進捗。書き込みに失敗しても、同じファイルで再実行すると rows_done 行目から再開する"""
+    return {
+        'key': import_key,
+        'cleared': not overwrite, # 上書きの場合は最初に既存の行を全て削除する
+        'rows_done': 0, # ファイルの先頭から処理済みの行数
+        'inserted': 0,
+        'skipped': 0,
+    }
+
+def import_duplicate_keys(df):
+    """(用語, 説明) の完全一致を判定するためのキー"""
+    return df['用語 (Term)'].astype(ARROW_STRING_DTYPE).fillna('') + '\x1f' + df['説明 (Definition)'].astype(ARROW_STRING_DTYPE).fillna('')
+
+IMPORT_ID_REASON_MISSING = 'IDなし'
+IMPORT_ID_REASON_INVALID = '正の整数でないID'
+IMPORT_ID_REASON_IN_USE = '既存のIDと重複'
+IMPORT_ID_REASON_DUPLICATED = 'ファイル内でIDが重複'
+IMPORT_ID_REASON_OVERWRITE = '上書きのため振り直し'
+
+def iter_import_plan_chunks(chunks, seen_keys, plan_parts):
+    """チャンクをそのまま返しながら、(用語, 説明) が既存の用語や先行する行と完全一致しない行のIDと用語を plan_parts に集める"""
+    for chunk in chunks:
+        keys = import_duplicate_keys(chunk)
+        duplicated = keys.isin(seen_keys) | keys.duplicated()
+        seen_keys.update(keys[~duplicated].tolist())
+        plan_parts.append(chunk.loc[~duplicated, ['ID', '用語 (Term)']])
+        yield chunk
+
+def reconcile_import_ids(file_ids, used_ids, next_id, keep_file_ids):
+    """
+    インポートする行のIDを、使用済みのID (昇順の配列 used_ids) と配列演算で一度に突き合わせて決める。
+    未使用の正の整数のIDはそのまま使い、欠けている・不正・使用済み・ファイル内で重複しているIDには
+    next_id から順に、使用済みでもそのまま使うIDでもない番号を割り当てる。
+    戻り値は (割り当てたIDの配列, 次の next_id, 振り直した理由の配列 (そのまま使った行は None))。
+    """
+    ids = pd.to_numeric(pd.Series(file_ids), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    missing = np.isnan(ids)
+    valid = ~missing & (np.nan_to_num(ids) > 0) & (np.nan_to_num(ids) % 1 == 0)
+    candidates = np.where(valid, np.nan_to_num(ids), 0).astype(np.int64)
+    positions = np.minimum(np.searchsorted(used_ids, candidates), max(len(used_ids) - 1, 0))
+    in_use = valid & (used_ids[positions] == candidates) if len(used_ids) else np.zeros(len(ids), dtype=bool)
+    duplicated = valid & ~in_use & pd.Series(np.where(in_use, 0, candidates)).duplicated().to_numpy()
+    keep = valid & ~in_use & ~duplicated & keep_file_ids
+    reasons = np.select(
+        [keep, ~np.bool_(keep_file_ids), missing, ~valid, in_use],
+        [None, IMPORT_ID_REASON_OVERWRITE, IMPORT_ID_REASON_MISSING, IMPORT_ID_REASON_INVALID, IMPORT_ID_REASON_IN_USE],
+        default=IMPORT_ID_REASON_DUPLICATED
+    ).astype(object)
+
+    # 新しいIDは next_id 以降の番号から、使用済みのIDとそのまま使うIDを除いて小さい順に取る
+    new_count = int((~keep).sum())
+    reserved = np.union1d(used_ids[np.searchsorted(used_ids, next_id):], candidates[keep & (candidates >= next_id)])
+    numbers = np.arange(next_id, next_id + new_count + len(reserved), dtype=np.int64)
+    new_ids = numbers[~np.isin(numbers, reserved)][:new_count]
+    assigned = candidates.copy()
+    assigned[~keep] = new_ids
+    reasons[valid & (assigned == candidates)] = None # 上書きで振り直しても番号が変わらなかった行
+    if new_count:
+        next_id = int(new_ids[-1]) + 1
+    return assigned, next_id, reasons
+
+def plan_import_ids(rows, df_vocab, overwrite, total_rows):
+    """
+    取り込む行 (インデックスはファイル内の行位置) のIDを reconcile_import_ids でまとめて決める。
+    戻り値は (ファイル内の行位置ごとのID (取り込まない行は 0), IDを振り直した行の一覧表)。
+    """
+    used_ids = np.empty(0, dtype=np.int64) if overwrite else np.unique(df_vocab['ID'].dropna().to_numpy(dtype=np.int64))
+    next_id = int(used_ids[-1]) + 1 if len(used_ids) else 1 # 削除済みのIDは再利用しない
+    assigned, _, reasons = reconcile_import_ids(rows['ID'], used_ids, next_id, keep_file_ids=not overwrite)
+    import_ids = np.zeros(total_rows, dtype=np.int64)
+    import_ids[rows.index.to_numpy(dtype=np.int64)] = assigned
+    remapped = pd.notna(reasons)
+    id_report = pd.DataFrame({
+        '行番号': rows.index.to_numpy()[remapped] + 1,
+        '用語 (Term)': rows['用語 (Term)'].to_numpy()[remapped],
+        '元のID': rows['ID'].to_numpy()[remapped],
+        '新しいID': assigned[remapped],
+        '理由': reasons[remapped],
+    })
+    return import_ids, id_report
+
+
+# --- テスト結果一覧 ---
+TEST_RESULTS_PAGE_SIZE = 20 # テスト結果一覧の1ページあたりの件数